@@ -0,0 +1,218 @@
+"""
+Compile many models, or variants of a model with different macro
+definitions, in parallel processes
+
+Object files and LLVM IR are written to a cache directory together with a
+manifest.json which records the files each job was compiled from and their
+hashes, and the version of the compiler. Jobs whose definitions, codegen
+options and files did not change are not recompiled by the same compiler.
+
+Run from the src directory:
+`python batch_compile.py -o CACHE [-j N] [-I DIR] [-D NAME=VALUE] model.va ...`
+or with a JSON list of jobs (objects with the fields of CompileJob):
+`python batch_compile.py -o CACHE --jobs jobs.json`
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from hashlib import sha256
+from itertools import repeat
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+import json
+import sys
+import llvmlite
+import llvmlite.binding as llvm
+from codegen import CodegenContext
+from compiler import compile_object, ir_text
+from parser_interface import preprocess_source, parse_tokens, parse_defines
+from profiling import Profile
+
+MANIFEST = "manifest.json"
+STAGES = [
+    "lex", "preprocess", "parse", "lower", "codegen", "format", "llvm parse", "llvm compile"
+]
+
+
+@dataclass
+class CompileJob:
+    name: str
+    filename: str
+    defines: dict[str, str] = field(default_factory=dict)
+    include_path: list[str] = field(default_factory=list)
+    # Options for CodegenContext
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class CompileResult:
+    name: str
+    # Relative to the cache directory, one per module in the source
+    object_files: list[str] = field(default_factory=list)
+    # Hash of each file the job was compiled from
+    dependencies: dict[str, str] = field(default_factory=dict)
+    # Seconds spent in each stage
+    timings: dict[str, float] = field(default_factory=dict)
+    # Tokens lexed, IR instructions, etc.
+    counters: dict[str, int] = field(default_factory=dict)
+    cached: bool = False
+    error: Optional[str] = None
+
+
+def file_hash(filename) -> str:
+    return sha256(Path(filename).read_bytes()).hexdigest()
+
+
+def compiler_version() -> str:
+    """
+    Hash of the sources of the compiler and of the LLVM version, which the
+    cached object files depend on too
+    """
+    digest = sha256(f"{llvmlite.__version__} {llvm.llvm_version_info}".encode())
+    for filename in sorted(Path(__file__).parent.glob("*.py")):
+        if not filename.name.startswith("test_"):
+            digest.update(filename.name.encode())
+            digest.update(filename.read_bytes())
+    return digest.hexdigest()
+
+
+def compile_job(job: CompileJob, cache_dir: Path) -> CompileResult:
+    """Compile all the modules of a source file"""
+    result = CompileResult(name=job.name)
+    included_files = []
+    with Profile() as profile:
+        try:
+            tokens = preprocess_source(
+                filename=job.filename,
+                include_path=job.include_path,
+                defines=job.defines,
+                included_files=included_files,
+            )
+            for filename in [job.filename, *included_files]:
+                result.dependencies[str(Path(filename).resolve())] = file_hash(filename)
+            hir = parse_tokens(tokens, release_parse_tree=True)
+            for module in hir.modules:
+                codegen = CodegenContext.module_to_llvm_module_ir(module, **job.options)
+                llvm_ir = ir_text(codegen.irmodule)
+                object_file = f"{job.name}.{module.name}.o"
+                (cache_dir / object_file).write_bytes(compile_object(llvm_ir))
+                (cache_dir / f"{job.name}.{module.name}.ll").write_text(llvm_ir)
+                result.object_files.append(object_file)
+        except Exception as error:
+            result.error = f"{type(error).__name__}: {error}"
+    result.timings = profile.times
+    result.counters = profile.counters
+    return result
+
+
+def load_manifest(cache_dir: Path) -> dict:
+    try:
+        return json.loads((cache_dir / MANIFEST).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def is_up_to_date(job: CompileJob, entry: dict, cache_dir: Path, compiler: str) -> bool:
+    """
+    Whether the cached artifacts of a job were compiled from its current
+    files, with the same options and compiler
+    """
+    if entry["job"] != asdict(job) or entry.get("compiler") != compiler:
+        return False
+    if not all((cache_dir / object_file).exists() for object_file in entry["object_files"]):
+        return False
+    for filename, digest in entry["dependencies"].items():
+        try:
+            if file_hash(filename) != digest:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def compile_batch(
+    jobs: list[CompileJob], cache_dir: Path | str, processes: Optional[int] = None
+) -> list[CompileResult]:
+    """Compile the jobs which are not up to date in the cache in parallel"""
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names must be unique")
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    compiler = compiler_version()
+    results = {}
+    pending = []
+    for job in jobs:
+        entry = manifest.get(job.name)
+        if entry is not None and is_up_to_date(job, entry, cache_dir, compiler):
+            results[job.name] = CompileResult(
+                name=job.name,
+                object_files=entry["object_files"],
+                dependencies=entry["dependencies"],
+                cached=True,
+            )
+        else:
+            pending.append(job)
+    if pending:
+        with ProcessPoolExecutor(processes) as pool:
+            for job, result in zip(pending, pool.map(compile_job, pending, repeat(cache_dir))):
+                results[job.name] = result
+                if result.error is None:
+                    manifest[job.name] = {
+                        "job": asdict(job),
+                        "compiler": compiler,
+                        "object_files": result.object_files,
+                        "dependencies": result.dependencies,
+                    }
+                else:
+                    manifest.pop(job.name, None)
+        (cache_dir / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return [results[name] for name in names]
+
+
+def print_report(results: list[CompileResult], elapsed: float, file=sys.stdout):
+    """Per-model timings, slowest first"""
+    print(f"{'model':30} {'status':9}" + "".join(f"{s:>13}" for s in STAGES + ["total"]), file=file)
+    for result in sorted(results, key=lambda r: -sum(r.timings.values())):
+        if result.error is not None:
+            status = "failed"
+        elif result.cached:
+            status = "cached"
+        else:
+            status = "compiled"
+        timings = [result.timings.get(stage, 0.0) for stage in STAGES]
+        timings.append(sum(timings))
+        print(f"{result.name:30} {status:9}" + "".join(f"{t:13.3f}" for t in timings), file=file)
+        if result.error is not None:
+            print(f"    {result.error}", file=file)
+    total = sum(sum(result.timings.values()) for result in results)
+    print(f"{len(results)} models, {total:.3f} s of compilation in {elapsed:.3f} s", file=file)
+
+
+def main():
+    parser = ArgumentParser(description="Compile Verilog-A models in parallel")
+    parser.add_argument("veriloga", nargs="*")
+    parser.add_argument("-o", "--cache-dir", required=True)
+    parser.add_argument("-j", "--processes", type=int, help="default: number of CPUs")
+    parser.add_argument("-I", action="append", default=[])
+    parser.add_argument("-D", action="append", help="define a macro, name or name=value")
+    parser.add_argument("--jobs", help="JSON file with a list of jobs")
+    args = parser.parse_args()
+    defines = parse_defines(args.D)
+    jobs = [
+        CompileJob(name=Path(filename).stem, filename=filename, defines=defines, include_path=args.I)
+        for filename in args.veriloga
+    ]
+    if args.jobs is not None:
+        jobs += [CompileJob(**job) for job in json.loads(Path(args.jobs).read_text())]
+    start = perf_counter()
+    results = compile_batch(jobs, args.cache_dir, args.processes)
+    print_report(results, perf_counter() - start)
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
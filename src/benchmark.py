@@ -0,0 +1,717 @@
+"""
+Benchmarks of the compiler and of the generated code
+
+Run from the src directory: `python benchmark.py [benchmark ...]`
+
+Measurements named "... /s" are rates, higher is better, and those named
+"... s" are times, lower is better. `--save FILE` stores the results and
+`--compare FILE` reports, and fails on, regressions beyond a tolerance.
+"""
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from timeit import Timer
+import ctypes
+import json
+import math
+import subprocess
+import sys
+import tracemalloc
+from llvmlite import ir
+import llvmlite.binding as llvm
+from parser_interface import parse_source, preprocess_source
+from manual_parser import Parser
+from lexer import tok
+from lower_parsetree import LowerParseTree
+from symboltable import SymbolTable
+from codegen import CodegenContext
+from compile_module import CompiledModule
+from compiler import compile_ir, get_engine
+from incremental import IncrementalCompiler
+from parallel_compile import compile_source
+from profiling import Profile
+import serialize_hir
+from vabuiltins import builtins
+from verilogatypes import VAType
+import fastmath
+import hir
+import synthetic
+
+INCLUDE_PATH = [Path(__file__).parent.parent / "include"]
+
+benchmarks = {}
+
+
+def benchmark(func):
+    """Register a benchmark, which returns a dict of measurements"""
+    benchmarks[func.__name__] = func
+    return func
+
+
+def seconds_per_call(func, repeat=3):
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def parse_model(source, files=None):
+    """
+    Parse a source which includes the standard disciplines, and which may
+    include other `files` (a dict of file names to contents)
+    """
+    with TemporaryDirectory() as tmpdir:
+        for name, content in (files or {}).items():
+            (Path(tmpdir) / name).write_text(content)
+        filename = Path(tmpdir) / "model.va"
+        filename.write_text('`include "disciplines.vams"\n' + source)
+        return parse_source(filename=str(filename), include_path=INCLUDE_PATH)
+
+
+def conditionals_source(n):
+    """Module with a chain of `n` small conditionals"""
+    lines = [
+        "module conditionals(a, b);",
+        "inout electrical a, b;",
+        "real " + ", ".join(f"x{i}" for i in range(n + 1)) + ";",
+        "analog begin",
+        "    x0 = V(a, b);",
+    ]
+    for i in range(1, n + 1):
+        lines.append(f"    x{i} = x{i-1} * 0.75 + 0.5;")
+        lines.append(f"    if (x{i} != 1.0) x{i} = x{i} - 1.0; else x{i} = 0.0;")
+    lines += [f"    I(a, b) <+ x{n};", "end", "endmodule"]
+    return "\n".join(lines)
+
+
+def codegen_with(**options):
+    """CodegenContext subclass with some class options changed"""
+    return type("CodegenContext", (CodegenContext,), options)
+
+
+@benchmark
+def if_conversion(n=200):
+    """run_analog evaluations/s of a module with many conditionals"""
+    module = parse_model(conditionals_source(n)).modules[0]
+    results = {}
+    for name, if_conversion in [("branches", False), ("select", True)]:
+        codegen = codegen_with(if_conversion=if_conversion)
+        compiled = CompiledModule.from_codegen(codegen.module_to_llvm_module_ir(module))
+        compiled.net_potential["a"] = 1.5
+        results[name + " evaluations/s"] = 1 / seconds_per_call(compiled.run_analog)
+    return results
+
+
+@benchmark
+def compile_time(n=3000):
+    """Seconds spent in each stage of compiling a large module to machine code"""
+    module = parse_model(conditionals_source(n)).modules[0]
+    engine = get_engine()
+    start = perf_counter()
+    codegen = CodegenContext.module_to_llvm_module_ir(module)
+    generated = perf_counter()
+    llvm_ir = str(codegen.irmodule)
+    formatted = perf_counter()
+    llvm_module = llvm.parse_assembly(llvm_ir)
+    llvm_module.verify()
+    parsed = perf_counter()
+    engine.add_module(llvm_module)
+    engine.finalize_object()
+    jitted = perf_counter()
+    return {
+        "codegen s": generated - start,
+        "IR formatting s": formatted - generated,
+        "IR parsing s": parsed - formatted,
+        "machine code s": jitted - parsed,
+        "IR size MB": len(llvm_ir) / 1e6,
+    }
+
+
+MATH_BUILTINS = [
+    "ln", "log", "exp", "sqrt", "abs", "floor", "ceil", "sin", "cos", "tan",
+    "asin", "acos", "atan", "sinh", "cosh", "tanh", "asinh", "acosh", "atanh",
+    "limexp", "pow", "min", "max", "atan2", "hypot",
+]
+# C math library names which differ from the Verilog-A ones
+LIBM_NAMES = {"ln": "log", "log": "log10", "abs": "fabs", "min": "fmin", "max": "fmax"}
+
+
+def math_module(name, n, x, codegen=CodegenContext):
+    """Module which accumulates `n` calls to a math builtin"""
+    function = builtins[name]
+    xvar = hir.Variable(name="x", type_=VAType.real, initializer=None)
+    acc = hir.Variable(name="acc", type_=VAType.real, initializer=None)
+    statements = []
+    for i in range(n):
+        # Different arguments to avoid common subexpressions
+        arg = hir.FunctionCall(builtins.real_addition, (xvar, hir.Literal(i * 1e-6)))
+        args = (arg, xvar)[: len(function.type_.parameters)]
+        call = hir.FunctionCall(function, args)
+        statements.append(
+            hir.Assignment(acc, hir.FunctionCall(builtins.real_addition, (acc, call)))
+        )
+    module = hir.Module(name=name, variables=[xvar, acc], statements=statements)
+    compiled = CompiledModule.from_codegen(codegen.module_to_llvm_module_ir(module))
+    compiled.vars["x"] = x
+    return compiled
+
+
+@benchmark
+def math_builtins(n=200):
+    """Calls/s of each math builtin, native codegen vs calling libm"""
+    libm_functions = {
+        builtins[name]: LIBM_NAMES.get(name, name)
+        for name in MATH_BUILTINS
+        if name != "limexp"
+    }
+    libm_codegen = codegen_with(intrinsics={}, libm_functions=libm_functions)
+    results = {}
+    for name in MATH_BUILTINS:
+        x = 1.5 if name == "acosh" else 0.5
+        compiled = math_module(name, n, x)
+        results[name + " calls/s"] = n / seconds_per_call(compiled.run_analog)
+        if name == "limexp":
+            continue
+        compiled = math_module(name, n, x, codegen=libm_codegen)
+        results[name + " libm calls/s"] = n / seconds_per_call(compiled.run_analog)
+    return results
+
+
+# Unary fastmath functions, the intrinsics they replace and the libm reference
+FAST_MATH = {
+    "exp": (
+        fastmath.exp,
+        lambda builder, x: fastmath.intrinsic(builder, "llvm.exp", x),
+        math.exp,
+    ),
+    "ln": (
+        fastmath.ln,
+        lambda builder, x: fastmath.intrinsic(builder, "llvm.log", x),
+        math.log,
+    ),
+    "pow": (
+        lambda builder, x: fastmath.pow(builder, x, fastmath.constant(x.type, 1.3)),
+        lambda builder, x: fastmath.intrinsic(
+            builder, "llvm.pow", x, fastmath.constant(x.type, 1.3)
+        ),
+        lambda x: math.pow(x, 1.3),
+    ),
+}
+
+
+@benchmark
+def fast_math(n=4096):
+    """Evaluations/s and max relative error over arrays, fastmath vs intrinsics"""
+    x = (ctypes.c_double * n)(*(0.01 + 10 * i / n for i in range(n)))
+    y = (ctypes.c_double * n)()
+    results = {}
+    for i, (name, (fast, precise, libm)) in enumerate(FAST_MATH.items()):
+        kernels = {"precise": (precise, 1), "fast": (fast, 1), "fast <4 x double>": (fast, 4)}
+        for j, (accuracy, (function, width)) in enumerate(kernels.items()):
+            kernel = array_kernel(f"fast_math_kernel{i}_{j}", function, width)
+            seconds = seconds_per_call(lambda: kernel(x, y, n))
+            results[f"{name} {accuracy} evaluations/s"] = n / seconds
+        expected = list(map(libm, x))
+        error = max(abs(y[k] - expected[k]) / expected[k] for k in range(n) if expected[k])
+        results[f"{name} fast max relative error"] = error
+    return results
+
+
+def array_kernel(name, function, width):
+    """
+    Compile `void name(double *x, double *y, i64 n)` which sets y[i] to
+    function(builder, x[i]) for <width x double> chunks of the arrays
+    """
+    double = ir.DoubleType()
+    i64 = ir.IntType(64)
+    type_ = ir.VectorType(double, width) if width > 1 else double
+    irmodule = ir.Module(name=name)
+    functype = ir.FunctionType(ir.VoidType(), [double.as_pointer()] * 2 + [i64])
+    func = ir.Function(irmodule, functype, name=name)
+    x, y, n = func.args
+    entry = func.append_basic_block(name="entry")
+    loop = func.append_basic_block(name="loop")
+    end = func.append_basic_block(name="end")
+    builder = ir.IRBuilder(entry)
+    builder.branch(loop)
+    builder.position_at_end(loop)
+    i = builder.phi(i64)
+    i.add_incoming(ir.Constant(i64, 0), entry)
+    xi = builder.bitcast(builder.gep(x, [i]), type_.as_pointer())
+    yi = builder.bitcast(builder.gep(y, [i]), type_.as_pointer())
+    builder.store(function(builder, builder.load(xi, align=8)), yi, align=8)
+    next_i = builder.add(i, ir.Constant(i64, width))
+    i.add_incoming(next_i, loop)
+    builder.cbranch(builder.icmp_signed("<", next_i, n), loop, end)
+    builder.position_at_end(end)
+    builder.ret_void()
+    compile_ir(str(irmodule))
+    pointer = ctypes.POINTER(ctypes.c_double)
+    cfunctype = ctypes.CFUNCTYPE(None, pointer, pointer, ctypes.c_int64)
+    return cfunctype(get_engine().get_function_address(name))
+
+
+@benchmark
+def vector_math(n=4096):
+    """exp evaluations/s over arrays, scalar llvm.exp.f64 vs fast exp"""
+    x = (ctypes.c_double * n)(*(-5 + 10 * i / n for i in range(n)))
+    y = (ctypes.c_double * n)()
+    kernels = {
+        "llvm.exp.f64": (lambda builder, x: fastmath.intrinsic(builder, "llvm.exp", x), 1),
+        "fast": (fastmath.exp, 1),
+        "fast <2 x double>": (fastmath.exp, 2),
+        "fast <4 x double>": (fastmath.exp, 4),
+    }
+    results = {}
+    for i, (name, (function, width)) in enumerate(kernels.items()):
+        kernel = array_kernel(f"exp_kernel{i}", function, width)
+        results[name + " evaluations/s"] = n / seconds_per_call(lambda: kernel(x, y, n))
+    return results
+
+
+def parameters_source(n):
+    """Module which sums `n` parameters"""
+    lines = ["module parameters(a, b);", "inout electrical a, b;", "real x;"]
+    lines += [f"parameter real p{i} = {i}.5;" for i in range(n)]
+    lines += ["analog begin", "    x = 0;"]
+    lines += [f"    x = x + p{i};" for i in range(n)]
+    lines += ["    I(a, b) <+ x * V(a, b);", "end", "endmodule"]
+    return "\n".join(lines)
+
+
+def statements_source(n, nvariables=20):
+    """Module with `n` assignments to a few variables"""
+    variables = [f"x{i}" for i in range(nvariables)]
+    lines = ["module statements(a, b);", "inout electrical a, b;"]
+    lines += ["real " + ", ".join(variables) + ";", "analog begin"]
+    lines += [f"    {v} = V(a, b);" for v in variables]
+    for i in range(n):
+        target, source = variables[i % nvariables], variables[(i * 7 + 3) % nvariables]
+        lines.append(f"    {target} = {target} * 0.5 + {source} / {i + 2}.0 - 1;")
+    lines += ["    I(a, b) <+ " + " + ".join(variables) + ";", "end", "endmodule"]
+    return "\n".join(lines)
+
+
+def macros_source(depth):
+    """Module using a macro which expands `depth` nested macros"""
+    lines = ["`define M0(x) (x)"]
+    lines += [f"`define M{i}(x) `M{i - 1}((x) * 0.5 + {i})" for i in range(1, depth + 1)]
+    lines += [
+        "module macros(a, b);",
+        "inout electrical a, b;",
+        f"analog I(a, b) <+ `M{depth}(V(a, b));",
+        "endmodule",
+    ]
+    return "\n".join(lines)
+
+
+def includes_files(n):
+    """Source including `n` files, each defining a macro, and those files"""
+    files = {f"include{i}.vams": f"`define INC{i} {i}.0\n" for i in range(n)}
+    lines = [f'`include "include{i}.vams"' for i in range(n)]
+    lines += [
+        "module includes(a, b);",
+        "inout electrical a, b;",
+        "real x;",
+        "analog begin",
+        "    x = 0;",
+    ]
+    lines += [f"    x = x + `INC{i};" for i in range(n)]
+    lines += ["    I(a, b) <+ x * V(a, b);", "end", "endmodule"]
+    return "\n".join(lines), files
+
+
+def profile_pipeline(parse, repeat=3):
+    """
+    Parse (by calling `parse`) and compile a module `repeat` times, returning
+    the fastest time of each stage and the compiled module
+    """
+    times = {}
+    for _ in range(repeat):
+        with Profile() as profile:
+            module = parse().modules[0]
+            compiled = CompiledModule.from_hir(module)
+        for stage, seconds in profile.times.items():
+            times[stage] = min(times.get(stage, seconds), seconds)
+    profile.times = times
+    return profile, compiled
+
+
+def pipeline_measurements(source, files=None):
+    """Throughput of each stage compiling a source, and of the compiled code"""
+    profile, compiled = profile_pipeline(partial(parse_model, source, files))
+    times, counters = profile.times, profile.counters
+    return {
+        "lex tokens/s": counters["tokens lexed"] / times["lex"],
+        "preprocess tokens/s": counters["tokens preprocessed"] / times["preprocess"],
+        "parse nodes/s": counters["parse tree nodes"] / times["parse"],
+        "lower s": times["lower"],
+        "codegen s": times["codegen"],
+        "llvm s": times["format"] + times["llvm parse"] + times["llvm compile"],
+        "run_analog evaluations/s": 1 / seconds_per_call(compiled.run_analog),
+    }
+
+
+@benchmark
+def pipeline_parameters(n=1000):
+    """Compiling and evaluating a module with many parameters"""
+    return pipeline_measurements(parameters_source(n))
+
+
+@benchmark
+def pipeline_statements(n=2000):
+    """Compiling and evaluating a module with many statements"""
+    return pipeline_measurements(statements_source(n))
+
+
+@benchmark
+def pipeline_macros(depth=50):
+    """Compiling and evaluating a module with deeply nested macros"""
+    return pipeline_measurements(macros_source(depth))
+
+
+@benchmark
+def pipeline_includes(n=200):
+    """Compiling and evaluating a module which includes many files"""
+    return pipeline_measurements(*includes_files(n))
+
+
+@benchmark
+def scaling(size="bsimbulk", factors=(0.125, 0.25, 0.5, 1.0)):
+    """Seconds spent in each stage compiling synthetic models of growing size"""
+    results = {}
+    for factor in factors:
+        model_size = synthetic.SIZES[size].scaled(factor)
+        source = synthetic.generate_model(model_size)
+        parse = partial(parse_source, source, include_path=synthetic.INCLUDE_PATH)
+        profile, compiled = profile_pipeline(parse, repeat=1)
+        for stage, seconds in profile.times.items():
+            results[f"{model_size.statements} statements {stage} s"] = seconds
+    return results
+
+
+@benchmark
+def edit_parameters(scale=0.25):
+    """Seconds to recompile a synthetic model after changing parameter defaults"""
+    size = synthetic.SIZES["bsimbulk"].scaled(scale)
+    source = synthetic.generate_model(size)
+    edited = source.replace("parameter real p0 = ", "parameter real p0 = 0.5 + ")
+    compiler = IncrementalCompiler()
+
+    def compile_(source):
+        module = parse_source(source, include_path=synthetic.INCLUDE_PATH).modules[0]
+        start = perf_counter()
+        compiler.compile(module)
+        return perf_counter() - start
+
+    return {
+        "full compile s": compile_(source),
+        "parameters edited compile s": compile_(edited),
+    }
+
+
+def expressions_source(n, nvariables=20):
+    """Module with `n` assignments of expressions calling builtins"""
+    variables = [f"x{i}" for i in range(nvariables)]
+    lines = ["module expressions(a, b);", "inout electrical a, b;", "parameter real p = 1.5;"]
+    lines += ["real " + ", ".join(variables) + ";", "analog begin"]
+    lines += [f"    {v} = V(a, b);" for v in variables]
+    for i in range(n):
+        x, y, z = (variables[(i * k + 1) % nvariables] for k in (1, 3, 7))
+        lines.append(f"    {x} = sqrt({y} * {y} + p) - exp(-{z}) * max({x}, {z} / p) + 1;")
+    lines += ["    I(a, b) <+ " + " + ".join(variables) + ";", "end", "endmodule"]
+    return "\n".join(lines)
+
+
+@benchmark
+def lowering(n=5000):
+    """Identifiers/s lowering a module with many expressions, and resolutions/s"""
+    tokens = preprocess_source(
+        '`include "disciplines.vams"\n' + expressions_source(n), include_path=INCLUDE_PATH
+    )
+    parsetree = Parser(tokens).sourcefile()
+    identifiers = sum(token.type == "SIMPLE_IDENTIFIER" for token in tokens)
+
+    def lower():
+        contexts = [(None, SymbolTable(builtins.symbols.values()))]
+        return LowerParseTree(contexts=contexts).lower(parsetree)
+
+    # A builtin referenced in a block of a module, the slowest case without a flat table
+    nested = LowerParseTree(contexts=[
+        (None, SymbolTable(builtins.symbols.values())), (None, SymbolTable()), (None, SymbolTable())
+    ])
+    sqrt = tok.sqrt
+    return {
+        "identifiers/s": identifiers / seconds_per_call(lower),
+        "builtin resolutions/s": 1 / seconds_per_call(lambda: nested.resolve(sqrt)),
+    }
+
+
+def debug_variables_source(n, nvariables=10):
+    """Module whose `n` assignments are half to variables which no contribution reads"""
+    variables = [f"x{i}" for i in range(nvariables)]
+    debug = [f"d{i}" for i in range(nvariables)]
+    lines = ["module debugged(a, b);", "inout electrical a, b;", "parameter real p = 1.5;"]
+    lines += ["real " + ", ".join(variables + debug) + ";", "analog begin"]
+    lines += [f"    {v} = V(a, b);" for v in variables]
+    for i in range(n):
+        x, y, z = (variables[(i + k) % nvariables] for k in (1, 2, 3))
+        target = (variables if i % 2 else debug)[i % nvariables]
+        lines.append(f"    {target} = sqrt({y} * {y} + p) - exp(-{z}) * max({x}, {z} / p) + 1;")
+    lines += ["    I(a, b) <+ " + " + ".join(variables) + ";", "end", "endmodule"]
+    return "\n".join(lines)
+
+
+@benchmark
+def dead_code(n=2000):
+    """Seconds compiling, and evaluations/s, without dead code elimination and with it"""
+    module = parse_model(debug_variables_source(n)).modules[0]
+    results = {}
+    for name, options in [
+        ("no elimination", dict(dead_code_elimination=False)),
+        ("all variables", dict(observable_variables=None)),
+        ("outputs only", dict(observable_variables=())),
+    ]:
+        start = perf_counter()
+        compiled = CompiledModule.from_hir(module, **options)
+        results[f"{name} compile s"] = perf_counter() - start
+        compiled.net_potential["a"] = 1.5
+        results[f"{name} evaluations/s"] = 1 / seconds_per_call(compiled.run_analog)
+    return results
+
+
+def balanced_expression(n, operators="+-*"):
+    """Expression with `n` binary operators, nested log2(n) deep, without repeated subexpressions"""
+    leaves = iter(range(n + 1))
+
+    def build(n):
+        if n == 0:
+            i = next(leaves)
+            return f"x{i % 20}" if i % 2 else f"{i}.5"
+        left = (n - 1) // 2
+        operator = operators[n % len(operators)]
+        return f"({build(left)} {operator} {build(n - 1 - left)})"
+
+    return build(n)
+
+
+@benchmark
+def operators(n=100000):
+    """Operators/s lowering and generating code for one expression with many operators"""
+    variables = [f"x{i}" for i in range(20)]
+    source = "\n".join([
+        '`include "disciplines.vams"',
+        "module operators(a, b);",
+        "inout electrical a, b;",
+        "real " + ", ".join(variables) + ", y;",
+        "analog begin",
+        *(f"    {v} = V(a, b);" for v in variables),
+        f"    y = {balanced_expression(n)};",
+        "    I(a, b) <+ y;",
+        "end",
+        "endmodule",
+    ])
+    parsetree = Parser(preprocess_source(source, include_path=INCLUDE_PATH)).sourcefile()
+
+    def lower():
+        contexts = [(None, SymbolTable(builtins.symbols.values()))]
+        return LowerParseTree(contexts=contexts).lower(parsetree)
+
+    module = lower().modules[0]
+    codegen = partial(CodegenContext.module_to_llvm_module_ir, module)
+    return {
+        "lowered operators/s": n / seconds_per_call(lower),
+        "generated operators/s": n / seconds_per_call(codegen),
+    }
+
+
+def polynomial_source(n, horner=True):
+    """
+    Module assigning a polynomial with `n` terms, in Horner form (nested `n`
+    deep) or as a flat sum (a chain of `n` additions)
+    """
+    if horner:
+        polynomial = "".join(f"{k + 1} + x * (" for k in range(n - 1)) + f"{n}" + ")" * (n - 1)
+    else:
+        polynomial = " + ".join(f"{k + 1} * x" for k in range(n))
+    return f"module polynomial(); real x, y; analog y = {polynomial}; endmodule"
+
+
+@benchmark
+def deep_expressions(n=100000):
+    """
+    Terms/s parsing, lowering and generating code for polynomials with n/10
+    and n terms, which do not decrease with n as the time is linear, and
+    compiling the code with LLVM for n/100 to n/25 terms, which does: the
+    LLVM backend takes a time quadratic in the size of the basic blocks
+    """
+    results = {}
+    for terms in (n // 10, n):
+        for form, horner in [("horner", True), ("sum", False)]:
+            with Profile() as profile:
+                module = parse_model(polynomial_source(terms, horner)).modules[0]
+                CodegenContext.module_to_llvm_module_ir(module)
+            times = profile.times
+            parse = times["lex"] + times["preprocess"] + times["parse"]
+            for stage, seconds in [("parse", parse), ("lower", times["lower"]), ("codegen", times["codegen"])]:
+                results[f"{form} {terms} terms {stage} terms/s"] = terms / seconds
+    for terms in (n // 100, n // 50, n // 25):
+        for form, horner in [("horner", True), ("sum", False)]:
+            module = parse_model(polynomial_source(terms, horner)).modules[0]
+            with Profile() as profile:
+                CompiledModule.from_hir(module)
+            seconds = profile.times["llvm parse"] + profile.times["llvm compile"]
+            results[f"{form} {terms} terms llvm terms/s"] = terms / seconds
+    return results
+
+
+@benchmark
+def parse_tree_memory(size="bsimbulk"):
+    """Memory and time to build the tokens and the parse tree of a synthetic model"""
+    source = synthetic.generate_model(size)
+    results = {}
+    tracemalloc.start()
+    try:
+        tokens = preprocess_source(source, include_path=synthetic.INCLUDE_PATH)
+        results["tokens MB"] = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        parsetree = Parser(tokens).sourcefile()
+        results["parse tree MB"] = (tracemalloc.get_traced_memory()[0] - start) / 1e6
+    finally:
+        tracemalloc.stop()
+    del parsetree
+    results["parse s"] = seconds_per_call(lambda: Parser(tokens).sourcefile(), repeat=3)
+    return results
+
+
+def multi_module_source(n, size="medium"):
+    """Source with `n` synthetic modules, which includes the disciplines once"""
+    models = [synthetic.generate_model(size, name=f"model{i}", seed=i) for i in range(n)]
+    include = '`include "disciplines.vams"\n'
+    return include + "".join(model.replace(include, "") for model in models)
+
+
+@benchmark
+def release_parse_tree(n=8):
+    """Peak and retained memory parsing many modules, keeping their parse trees or not"""
+    source = multi_module_source(n)
+    results = {}
+    for mode, release in [("kept", False), ("released", True)]:
+        tracemalloc.start()
+        try:
+            hir = parse_source(
+                source, include_path=synthetic.INCLUDE_PATH, release_parse_tree=release
+            )
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del hir
+        results[f"parse trees {mode} peak MB"] = peak / 1e6
+        results[f"parse trees {mode} retained MB"] = retained / 1e6
+    return results
+
+
+@benchmark
+def parallel_modules(n=8):
+    """Seconds compiling a source with many modules one by one and in parallel"""
+    source = multi_module_source(n)
+    start = perf_counter()
+    for module in parse_source(source, include_path=synthetic.INCLUDE_PATH).modules:
+        CompiledModule.from_hir(module)
+    sequential = perf_counter() - start
+    start = perf_counter()
+    compile_source(source, include_path=synthetic.INCLUDE_PATH)
+    parallel = perf_counter() - start
+    return {
+        "sequential s": sequential,
+        "parallel s": parallel,
+        "speedup": sequential / parallel,
+    }
+
+
+@benchmark
+def serialized_hir(size="bsimbulk"):
+    """Seconds to load the serialized HIR of a synthetic model, compared to parsing it"""
+    source = synthetic.generate_model(size)
+    parse = partial(parse_source, source, include_path=synthetic.INCLUDE_PATH)
+    sourcefile = parse()
+    data = serialize_hir.dumps(sourcefile)
+    return {
+        "parse s": seconds_per_call(parse),
+        "dumps s": seconds_per_call(lambda: serialize_hir.dumps(sourcefile)),
+        "loads s": seconds_per_call(lambda: serialize_hir.loads(data)),
+        "serialized MB": len(data) / 1e6,
+    }
+
+
+def import_seconds(module, repeat=5):
+    """Seconds to import a module in a new interpreter, as reported by -X importtime"""
+    times = []
+    for _ in range(repeat):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        # The module itself is reported last, with the cumulative time of its imports
+        last = [line for line in stderr.splitlines() if line.startswith("import time:")][-1]
+        times.append(int(last.split("|")[1]) / 1e6)
+    return min(times)
+
+
+@benchmark
+def import_time(modules=("parser_interface", "compile_module", "compile_client")):
+    """Seconds to import the entry points of the compiler"""
+    return {f"import {module} s": import_seconds(module) for module in modules}
+
+
+def regressions(results, baseline, tolerance):
+    """Measurements which got worse than the baseline by more than tolerance"""
+    found = []
+    for name, measurements in results.items():
+        for measurement, value in measurements.items():
+            old = baseline.get(name, {}).get(measurement)
+            if old is None:
+                continue
+            if measurement.endswith("/s"):
+                ratio = old / value
+            elif measurement.endswith(" s"):
+                ratio = value / old
+            else:
+                continue
+            if ratio > 1 + tolerance:
+                found.append((name, measurement, old, value))
+    return found
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", help=", ".join(benchmarks))
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--compare", help="JSON file with baseline results")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="relative slowdown allowed by --compare"
+    )
+    args = parser.parse_args()
+    results = {}
+    for name in args.benchmarks or benchmarks:
+        results[name] = benchmarks[name]()
+        for measurement, value in results[name].items():
+            print(f"{name}: {measurement}: {value:.4g}")
+    if args.save is not None:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.compare is not None:
+        baseline = json.loads(Path(args.compare).read_text())
+        found = regressions(results, baseline, args.tolerance)
+        for name, measurement, old, value in found:
+            print(f"REGRESSION {name}: {measurement}: {old:.4g} -> {value:.4g}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 from verilogatypes import VAType
 from llvmlite import ir
-from functools import singledispatchmethod, partial
+from functools import partial
+from dispatch import dispatchmethod
+from itertools import chain
 import hir
 from vabuiltins import builtins
-from customdict import CustomDict
+from liveness import Liveness
+from constant_evaluation import evaluate_parameters, input_parameter_names, python_functions
+import profiling
 
 
 llvmreal = ir.DoubleType()
@@ -26,40 +30,174 @@ def vatype_to_llvmtype(vatype):
 
 realzero = ir.Constant(vatype_to_llvmtype(VAType.real), 0)
 
+# Builtins computed by one instruction, by identity: function of the builder
+# and the arguments
+instructions = {
+    id(builtins.integer_addition): ir.IRBuilder.add,
+    id(builtins.integer_subtraction): ir.IRBuilder.sub,
+    id(builtins.integer_product): ir.IRBuilder.mul,
+    id(builtins.integer_division): ir.IRBuilder.sdiv,
+    id(builtins.real_addition): ir.IRBuilder.fadd,
+    id(builtins.real_subtraction): ir.IRBuilder.fsub,
+    id(builtins.real_product): ir.IRBuilder.fmul,
+    id(builtins.real_division): ir.IRBuilder.fdiv,
+    id(builtins.cast_int_to_real): lambda builder, x: builder.sitofp(x, llvmreal),
+    id(builtins.cast_real_to_int): lambda builder, x: builder.fptosi(x, llvmint),
+}
+# Comparison builtins, by identity: IRBuilder method computing an i1 and its
+# comparison operator
+comparisons = {
+    id(builtins.integer_equality): (ir.IRBuilder.icmp_signed, "=="),
+    id(builtins.integer_inequality): (ir.IRBuilder.icmp_signed, "!="),
+    id(builtins.real_equality): (ir.IRBuilder.fcmp_ordered, "=="),
+    id(builtins.real_inequality): (ir.IRBuilder.fcmp_ordered, "!="),
+}
+
+
+def assigned_variables(statement):
+    """Variables which a statement may assign"""
+    pending = [statement]
+    while pending:
+        statement = pending.pop()
+        if isinstance(statement, hir.Assignment):
+            yield statement.lvalue
+        elif isinstance(statement, hir.Block):
+            pending.extend(statement.statements)
+        elif isinstance(statement, hir.If):
+            pending.extend(arm for arm in (statement.then, statement.else_) if arm is not None)
+
+
 class CodegenContext:
-    def __init__(self):
+    # Turn conditionals whose arms are only assignments into select
+    # instructions instead of branches
+    if_conversion = True
+    # Builtins which may have undefined behavior and must not be evaluated
+    # unless the program asks for it
+    unsafe_to_speculate = (builtins.integer_division,)
+    # Builtins whose Python implementation differs from the generated code,
+    # e.g. min and max propagate NaN but llvm.minnum and llvm.maxnum do not
+    unfoldable = (builtins.min, builtins.max)
+    # Math builtins implemented by LLVM intrinsics
+    intrinsics = {
+        builtins.sin: "llvm.sin.f64",
+        builtins.cos: "llvm.cos.f64",
+        builtins.exp: "llvm.exp.f64",
+        builtins.ln: "llvm.log.f64",
+        builtins.log: "llvm.log10.f64",
+        builtins.sqrt: "llvm.sqrt.f64",
+        builtins.abs: "llvm.fabs.f64",
+        builtins.floor: "llvm.floor.f64",
+        builtins.ceil: "llvm.ceil.f64",
+        builtins.pow: "llvm.pow.f64",
+        builtins.min: "llvm.minnum.f64",
+        builtins.max: "llvm.maxnum.f64",
+    }
+    # Math builtins without an intrinsic, implemented by the C math library
+    libm_functions = {
+        builtins.tan: "tan",
+        builtins.asin: "asin",
+        builtins.acos: "acos",
+        builtins.atan: "atan",
+        builtins.atan2: "atan2",
+        builtins.sinh: "sinh",
+        builtins.cosh: "cosh",
+        builtins.tanh: "tanh",
+        builtins.asinh: "asinh",
+        builtins.acosh: "acosh",
+        builtins.atanh: "atanh",
+    }
+    # limexp is linearized beyond this argument
+    limexp_limit = 80.0
+    # Eliminate the statements and variables which cannot affect the outputs
+    dead_code_elimination = True
+    # Names of the variables whose values are outputs of the module, besides
+    # the net flows and branch potentials, None for all of them
+    observable_variables = None
+    # Names of the variables which are set before run_analog, which are
+    # exported like the outputs
+    input_variables = ()
+    # Names of the parameters which can be set after compiling, None for all
+    # of them, besides the parameters whose defaults depend on them. The
+    # others are constants with their default values.
+    input_parameters = None
+
+    def __init__(self, **options):
+        # Options override the class attributes above
+        for name, value in options.items():
+            if not hasattr(type(self), name):
+                raise TypeError(f"Unknown codegen option {name!r}")
+            setattr(self, name, value)
         self.irmodule = ir.Module(name=__file__)
         self.builder = None
-        # Dicts which look up based on identity and not equality
+        # Dicts keyed by the uid of symbols, see hir.Symbol, and by the
+        # identity of builtins and of (interned) function calls
+        # Symbol of each uid in the tables below
+        self.symbols = {}
         # Compiled functions
-        self.functions = CustomDict(key=id)
+        self.functions = {}
         # Compiled variables
-        self.variables = CustomDict(key=id)
+        self.variables = {}
         # Compiled parameters
-        self.parameters = CustomDict(key=id)
+        self.parameters = {}
+        # Values of the parameters compiled as constants
+        self.constants = {}
+        # Constants computed from them, by identity, which builtins applied
+        # to are folded
+        self.folded = {}
         # Global variables set by simulator with net potentials
-        self.net_potential = CustomDict(key=id)
+        self.net_potential = {}
         # Global variables set by module with net flow contributions
-        self.net_flow = CustomDict(key=id)
+        self.net_flow = {}
         # Global variables set by simulator with branch flows
-        self.branch_flow = CustomDict(key=self.branch_key)
+        self.branch_flow = {}
         # Global variables set by module with branch potentials
-        self.branch_potential = CustomDict(key=self.branch_key)
+        self.branch_potential = {}
+        # Branch potentials and flows read at function entry
+        self.potential_probes = {}
+        self.flow_probes = {}
+        # IR values already computed for subexpressions and for loaded
+        # variables/parameters, valid at the current builder position
+        self.subexpressions = {}
+        self.loaded = {}
+        # Variables read by each subexpression
+        self.reads = {}
+        # Computed subexpressions which read each variable
+        self.readers = {}
+        # Functions which undo the changes to the known values, so that
+        # branches can go back to the values known at a dominating position
+        self.journal = []
+        # Methods which generate inline code for builtins, by identity
+        self.inline_functions = {
+            id(builtins.limexp): self.limexp_to_ir,
+            id(builtins.hypot): self.hypot_to_ir,
+            id(builtins.integer_abs): self.integer_abs_to_ir,
+            id(builtins.integer_min): partial(self.integer_select_to_ir, "<"),
+            id(builtins.integer_max): partial(self.integer_select_to_ir, ">"),
+        }
 
     def declare_builtins(self):
-        # Declare LLVM intrinsics as extern
-        intrinsic_names = {
-            "llvm.sin.f64": builtins.sin,
-            "llvm.pow.f64": builtins.pow,
-        }
-        for name, vafunc in intrinsic_names.items():
+        # Declare LLVM intrinsics and math library functions as extern
+        for vafunc, name in chain(self.intrinsics.items(), self.libm_functions.items()):
             functype = vatype_to_llvmtype(vafunc.type_)
             llvmfunc = ir.Function(self.irmodule, functype, name=name)
-            self.functions[vafunc] = llvmfunc
+            self.functions[id(vafunc)] = llvmfunc
+
+    @property
+    def exported_variables(self):
+        """Names of the variables which are inputs or outputs, None for all"""
+        if self.observable_variables is None:
+            return None
+        return {*self.observable_variables, *self.input_variables}
+
+    def declare(self, table, symbol, value):
+        """Set the IR value of a symbol in one of the tables keyed by uid"""
+        self.symbols[symbol.uid] = symbol
+        table[symbol.uid] = value
 
     @classmethod
-    def expression_to_llvm_module_ir(cls, expression, funcname):
-        codegen = cls()
+    @profiling.stage("codegen")
+    def expression_to_llvm_module_ir(cls, expression, funcname, **options):
+        codegen = cls(**options)
         codegen.declare_builtins()
         functype = ir.FunctionType(vatype_to_llvmtype(expression.type_), ())
         func = ir.Function(codegen.irmodule, functype, name=funcname)
@@ -68,7 +206,7 @@ class CodegenContext:
         codegen.builder.ret(codegen.expression_to_ir(expression))
         return codegen.irmodule
 
-    @singledispatchmethod
+    @dispatchmethod
     def expression_to_ir(self, expression: hir.Expression):
         raise NotImplementedError(type(expression))
 
@@ -78,54 +216,224 @@ class CodegenContext:
 
     @expression_to_ir.register
     def _(self, funcall: hir.FunctionCall):
-        func = funcall.function
-        if func is builtins.potential:
-            branch, = funcall.arguments
-            pot1 = self.builder.load(self.net_potential[branch.net1])
-            if branch.net2 is not None:
-                pot2 = self.builder.load(self.net_potential[branch.net2])
-                return self.builder.fsub(pot1, pot2)
+        return self.function_call_to_ir(funcall)
+
+    def remember(self, funcall, value):
+        self.set_value(self.subexpressions, id(funcall), value)
+        for variable in self.variables_read(funcall):
+            readers = self.readers.get(variable.uid)
+            if readers is None:
+                self.set_value(self.readers, variable.uid, [funcall])
             else:
-                return pot1
-        if func is builtins.flow:
-            branch, = funcall.arguments
-            return self.builder.load(self.branch_flow[branch])
-        args = [self.expression_to_ir(arg) for arg in funcall.arguments]
-        instructions = {
-            builtins.integer_addition: self.builder.add,
-            builtins.integer_subtraction: self.builder.sub,
-            builtins.integer_product: self.builder.mul,
-            builtins.integer_division: self.builder.sdiv,
-            builtins.real_addition: self.builder.fadd,
-            builtins.real_subtraction: self.builder.fsub,
-            builtins.real_product: self.builder.fmul,
-            builtins.real_division: self.builder.fdiv,
-            builtins.cast_int_to_real: partial(self.builder.sitofp, typ=llvmreal),
-            builtins.cast_real_to_int: partial(self.builder.fptosi, typ=llvmint),
-        }
-        if func in instructions:
-            return instructions[func](*args)
-        logical_instructions = {
-            builtins.integer_equality: partial(self.builder.icmp_signed, cmpop="=="),
-            builtins.integer_inequality: partial(self.builder.icmp_signed, cmpop="!="),
-            builtins.real_equality: partial(self.builder.fcmp_ordered, cmpop="=="),
-            builtins.real_inequality: partial(self.builder.fcmp_ordered, cmpop="!="),
-        }
-        if func in logical_instructions:
-            i1_result = logical_instructions[func](lhs=args[0], rhs=args[1])
-            return self.builder.zext(i1_result, llvmint)
-        if func in self.functions:
-            return self.builder.call(self.functions[func], args)
+                readers.append(funcall)
+                self.journal.append(readers.pop)
+
+    def set_value(self, values, key, value):
+        """Set a known value, recording how to undo it"""
+        old = values.get(key)
+        if old is None:
+            self.journal.append(partial(values.pop, key))
         else:
-            raise NotImplementedError(func)
+            self.journal.append(partial(values.__setitem__, key, old))
+        values[key] = value
+
+    def pop_value(self, values, key, default=None):
+        """Forget a known value, recording how to undo it"""
+        old = values.pop(key, None)
+        if old is None:
+            return default
+        self.journal.append(partial(values.__setitem__, key, old))
+        return old
+
+    def variables_read(self, expression):
+        """Variables which the value of an expression depends on"""
+        if isinstance(expression, hir.Variable):
+            return (expression,)
+        if not isinstance(expression, hir.FunctionCall):
+            return ()
+        try:
+            return self.reads[id(expression)]
+        except KeyError:
+            pass
+        # Each variable once, however many times it is read
+        reads = {
+            variable.uid: variable
+            for arg in expression.arguments
+            for variable in self.variables_read(arg)
+        }
+        reads = self.reads[id(expression)] = tuple(reads.values())
+        return reads
+
+    def forget_readers(self, variable):
+        """Drop computed subexpressions that depend on a variable"""
+        for funcall in self.pop_value(self.readers, variable.uid, ()):
+            self.pop_value(self.subexpressions, id(funcall))
+
+    def forget_variable(self, variable):
+        """Drop the known values of a variable and of its readers"""
+        self.forget_readers(variable)
+        self.pop_value(self.loaded, variable.uid)
+
+    def function_call_to_ir(self, funcall: hir.FunctionCall):
+        """
+        Generate the value of a function call, with an explicit stack instead
+        of recursion so that the depth of expressions is not limited by the
+        recursion limit
+        """
+        # Values of the subexpressions whose parents are not generated yet
+        values = []
+        # Subexpressions to generate, and (function call, number of
+        # arguments) for calls whose arguments are at the end of `values`
+        pending = [funcall]
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                node, count = node
+                start = len(values) - count
+                value = self.call_builtin(node.function, *values[start:])
+                del values[start:]
+            elif type(node) is hir.FunctionCall:
+                # Common subexpression elimination: identical subtrees are the
+                # same node thanks to hash-consing
+                value = self.subexpressions.get(id(node))
+                if value is not None:
+                    values.append(value)
+                    continue
+                func = node.function
+                if func is builtins.potential:
+                    value = self.potential_probes[node.arguments[0].uid]
+                elif func is builtins.flow:
+                    value = self.flow_probes[node.arguments[0].uid]
+                else:
+                    pending.append((node, len(node.arguments)))
+                    pending.extend(reversed(node.arguments))
+                    continue
+            else:
+                values.append(self.expression_to_ir(node))
+                continue
+            self.remember(node, value)
+            values.append(value)
+        value, = values
+        return value
+
+    def call_builtin(self, func, *args):
+        """Apply a function to already computed arguments"""
+        if any(id(arg) in self.folded for arg in args) and all(
+            isinstance(arg, ir.Constant) for arg in args
+        ):
+            constant = self.fold_constant(func, args)
+            if constant is not None:
+                self.folded[id(constant)] = constant
+                return constant
+        instruction = instructions.get(id(func))
+        if instruction is not None:
+            return instruction(self.builder, *args)
+        if id(func) in comparisons:
+            return self.builder.zext(self.comparison_to_ir(func, *args), llvmint)
+        function = self.functions.get(id(func))
+        if function is not None:
+            return self.builder.call(function, args)
+        inline = self.inline_functions.get(id(func))
+        if inline is not None:
+            return inline(*args)
+        raise NotImplementedError(func)
+
+    def fold_constant(self, func, args):
+        """
+        Constant result of a builtin applied to constants, None if it is
+        left to run time, like errors and the builtins generated inline
+        """
+        function = python_functions.get(id(func))
+        if (
+            function is None
+            or id(func) in self.inline_functions
+            or func in self.unfoldable
+        ):
+            return None
+        try:
+            value = function(*(arg.constant for arg in args))
+        except (ArithmeticError, ValueError):
+            return None
+        returntype = func.type_.returntype
+        if returntype == VAType.integer and not -(2**31) <= value < 2**31:
+            return None
+        return ir.Constant(vatype_to_llvmtype(returntype), value)
+
+    def limexp_to_ir(self, x):
+        """exp(x) for x up to the limit, then linear with continuous derivative"""
+        limit = ir.Constant(llvmreal, self.limexp_limit)
+        one = ir.Constant(llvmreal, 1.0)
+        clipped = self.call_builtin(builtins.min, x, limit)
+        excess = self.call_builtin(builtins.max, self.builder.fsub(x, limit), realzero)
+        exp = self.call_builtin(builtins.exp, clipped)
+        return self.builder.fmul(exp, self.builder.fadd(one, excess))
+
+    def hypot_to_ir(self, x, y):
+        squares = self.builder.fadd(self.builder.fmul(x, x), self.builder.fmul(y, y))
+        return self.call_builtin(builtins.sqrt, squares)
+
+    def integer_abs_to_ir(self, x):
+        negative = self.builder.icmp_signed("<", x, ir.Constant(llvmint, 0))
+        return self.builder.select(negative, self.builder.neg(x), x)
+
+    def integer_select_to_ir(self, cmpop, x, y):
+        """min or max of integers depending on the comparison"""
+        return self.builder.select(self.builder.icmp_signed(cmpop, x, y), x, y)
+
+    def comparison_to_ir(self, func, lhs, rhs):
+        """i1 result of a comparison builtin"""
+        method, cmpop = comparisons[id(func)]
+        return method(self.builder, cmpop, lhs, rhs)
+
+    def condition_to_ir(self, condition: hir.Expression):
+        """Generate an i1 which is true if the condition is nonzero"""
+        if isinstance(condition, hir.FunctionCall) and id(condition.function) in comparisons:
+            lhs, rhs = map(self.expression_to_ir, condition.arguments)
+            return self.comparison_to_ir(condition.function, lhs, rhs)
+        inequality = {
+            VAType.integer: builtins.integer_inequality,
+            VAType.real: builtins.real_inequality,
+        }[condition.type_]
+        zero = ir.Constant(vatype_to_llvmtype(condition.type_), 0)
+        return self.comparison_to_ir(inequality, self.expression_to_ir(condition), zero)
 
     @expression_to_ir.register
     def _(self, variable: hir.Variable):
-        return self.builder.load(self.variables[variable])
+        try:
+            return self.loaded[variable.uid]
+        except KeyError:
+            pass
+        value = self.builder.load(self.variables[variable.uid])
+        self.set_value(self.loaded, variable.uid, value)
+        return value
 
     @expression_to_ir.register
     def _(self, parameter: hir.Parameter):
-        return self.builder.load(self.parameters[parameter])
+        try:
+            return self.loaded[parameter.uid]
+        except KeyError:
+            pass
+        constant = self.constants.get(parameter.uid)
+        if constant is not None:
+            return constant
+        value = self.builder.load(self.parameters[parameter.uid])
+        self.set_value(self.loaded, parameter.uid, value)
+        return value
+
+    def save_values(self):
+        """Mark the IR values known at the current position"""
+        return len(self.journal)
+
+    def restore_values(self, mark):
+        """
+        Go back to the IR values known at a marked, dominating position
+
+        Values computed in between (e.g. in the other arm of an `if`) are
+        forgotten.
+        """
+        journal = self.journal
+        while len(journal) > mark:
+            journal.pop()()
 
     def global_variable(self, name, type_):
         llvmtype = vatype_to_llvmtype(type_)
@@ -133,51 +441,98 @@ class CodegenContext:
         irvar.initializer = ir.Constant(llvmtype, 0)
         return irvar
 
-    @staticmethod
-    def branch_key(branch):
-        return branch.net1.name, branch.net2.name if branch.net2 is not None else None
-
     def declare_branch(self, branch):
-        key = branch
         name = '__'.join((branch.net1.name, branch.net2.name if branch.net2 is not None else '0'))
-        self.branch_potential[key] = self.global_variable('__branch_potential__' + name, VAType.real)
-        self.branch_flow[key] = self.global_variable('__branch_flow_' + name, VAType.real)
+        self.declare(self.branch_potential, branch, self.global_variable('__branch_potential__' + name, VAType.real))
+        self.declare(self.branch_flow, branch, self.global_variable('__branch_flow_' + name, VAType.real))
+
+    def load_probes(self, branches):
+        """
+        Read branch potentials and flows into SSA values
+
+        Contributions never write the net potentials or branch flows, so
+        they are read once at function entry and every probe of a branch
+        reuses the same value.
+        """
+        net_potentials = {
+            uid: self.builder.load(variable) for uid, variable in self.net_potential.items()
+        }
+        for branch in branches:
+            potential = net_potentials[branch.net1.uid]
+            if branch.net2 is not None:
+                potential = self.builder.fsub(potential, net_potentials[branch.net2.uid])
+            self.potential_probes[branch.uid] = potential
+            self.flow_probes[branch.uid] = self.builder.load(self.branch_flow[branch.uid])
 
     @classmethod
-    def module_to_llvm_module_ir(cls, module):
-        codegen = cls()
+    @profiling.stage("codegen")
+    def module_to_llvm_module_ir(cls, module, **options):
+        codegen = cls(**options)
+        exported = codegen.exported_variables
+        # Variables whose values are kept from one run to the next, all of
+        # them without the liveness analysis
+        carried = None
+        if codegen.dead_code_elimination:
+            variables = len(module.variables)
+            liveness = Liveness()
+            module = liveness.eliminate(module, exported)
+            carried = liveness.carried
+            profiling.count("dead variables", variables - len(module.variables))
         codegen.declare_builtins()
         functype = ir.FunctionType(ir.VoidType(), ())
         func = ir.Function(codegen.irmodule, functype, name="run_analog")
+        block = func.append_basic_block(name="entry")
+        codegen.builder = ir.IRBuilder(block)
+        # The other variables are local to run_analog, which LLVM promotes to
+        # registers (see compiler.promote_locals)
         for variable in module.variables:
-            codegen.variables[variable] = codegen.global_variable(variable.name, variable.type_)
+            if carried is None or exported is None or variable.name in exported or variable.uid in carried:
+                pointer = codegen.global_variable(variable.name, variable.type_)
+            else:
+                pointer = codegen.builder.alloca(vatype_to_llvmtype(variable.type_), name=variable.name)
+                profiling.count("local variables")
+            codegen.declare(codegen.variables, variable, pointer)
+        inputs = codegen.input_parameters
+        defaults = None
+        if inputs is not None:
+            inputs = input_parameter_names(module.parameters, inputs)
+            defaults = evaluate_parameters(module.parameters)
         for parameter in module.parameters:
-            codegen.parameters[parameter] = codegen.global_variable(parameter.name, parameter.type_)
+            if inputs is None or parameter.name in inputs:
+                codegen.declare(codegen.parameters, parameter, codegen.global_variable(parameter.name, parameter.type_))
+            else:
+                value = ir.Constant(vatype_to_llvmtype(parameter.type_), defaults[parameter])
+                codegen.declare(codegen.constants, parameter, value)
+                codegen.folded[id(value)] = value
         for net in module.nets:
-            codegen.net_potential[net] = codegen.global_variable('__net_potential_' + net.name, VAType.real)
-            codegen.net_flow[net] = codegen.global_variable('__net_flow_' + net.name, VAType.real)
+            codegen.declare(codegen.net_potential, net, codegen.global_variable('__net_potential_' + net.name, VAType.real))
+            codegen.declare(codegen.net_flow, net, codegen.global_variable('__net_flow_' + net.name, VAType.real))
         for branch in module.branches.values():
             codegen.declare_branch(branch)
-        block = func.append_basic_block(name="entry")
-        codegen.builder = ir.IRBuilder(block)
         # Set all outputs to 0 at the beginning
         for var in codegen.net_flow.values():
             codegen.builder.store(realzero, var)
         for branch_var in codegen.branch_potential.values():
             codegen.builder.store(realzero, branch_var)
+        codegen.load_probes(module.branches.values())
         for statement in module.statements:
             codegen.statement_to_ir(statement)
         codegen.builder.ret_void()
+        profiling.count("IR instructions", sum(len(block.instructions) for block in func.blocks))
         return codegen
 
-    @singledispatchmethod
+    @dispatchmethod
     def statement_to_ir(self, statement: hir.Statement):
         raise NotImplementedError(type(statement))
 
     @statement_to_ir.register
     def _(self, assignment: hir.Assignment):
-        value = self.expression_to_ir(assignment.value)
-        self.builder.store(value, self.variables[assignment.lvalue])
+        self.store_variable(assignment.lvalue, self.expression_to_ir(assignment.value))
+
+    def store_variable(self, variable, value):
+        self.builder.store(value, self.variables[variable.uid])
+        self.forget_readers(variable)
+        self.set_value(self.loaded, variable.uid, value)
 
     @statement_to_ir.register
     def _(self, analogcontribution: hir.AnalogContribution):
@@ -186,7 +541,7 @@ class CodegenContext:
             for net, sign in [(analogcontribution.branch.net1, 1), (analogcontribution.branch.net2, -1)]:
                 if sign == -1 and net is None:
                     break
-                lvalue = self.net_flow[net]
+                lvalue = self.net_flow[net.uid]
                 oldvalue = self.builder.load(lvalue)
                 if sign == 1:
                     newvalue = self.builder.fadd(oldvalue, contribution)
@@ -194,7 +549,7 @@ class CodegenContext:
                     newvalue = self.builder.fsub(oldvalue, contribution)
                 self.builder.store(newvalue, lvalue)
         elif analogcontribution.type_ == 'potential':
-            lvalue = self.branch_potential[analogcontribution.branch]
+            lvalue = self.branch_potential[analogcontribution.branch.uid]
             oldvalue = self.builder.load(lvalue)
             newvalue = self.builder.fadd(oldvalue, contribution)
             self.builder.store(newvalue, lvalue)
@@ -208,17 +563,96 @@ class CodegenContext:
 
     @statement_to_ir.register
     def _(self, if_: hir.If):
-        inequality = {
-            VAType.integer: builtins.integer_inequality,
-            VAType.real: builtins.real_inequality,
-        }[if_.condition.type_]
-        zero = hir.Literal({VAType.integer: 0, VAType.real: 0.0}[if_.condition.type_])
-        condition_hir = hir.FunctionCall(inequality, (if_.condition, zero))
-        condition_ir = self.builder.trunc(self.expression_to_ir(condition_hir), llvmi1)
+        condition_ir = self.condition_to_ir(if_.condition)
+        if self.if_conversion and all(
+            arm is None or self.is_speculatable(arm) for arm in (if_.then, if_.else_)
+        ):
+            self.if_to_select(condition_ir, if_)
+            return
+        before = self.save_values()
         with self.builder.if_else(condition_ir) as (then, otherwise):
             with then:
                 if if_.then is not None:
                     self.statement_to_ir(if_.then)
+            self.restore_values(before)
             with otherwise:
                 if if_.else_ is not None:
                     self.statement_to_ir(if_.else_)
+        # Only values computed before the branch dominate the merge point,
+        # and those which depend on variables assigned in the arms are stale
+        self.restore_values(before)
+        for variable in assigned_variables(if_):
+            self.forget_variable(variable)
+
+    def is_speculatable(self, node) -> bool:
+        """Whether a statement or expression can be evaluated unconditionally"""
+        seen = set()
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, hir.Assignment):
+                pending.append(node.value)
+            elif isinstance(node, hir.Block):
+                pending.extend(node.statements)
+            elif isinstance(node, hir.FunctionCall):
+                # Shared subexpressions are checked once
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                if node.function in self.unsafe_to_speculate:
+                    return False
+                # Probes loaded at entry are SSA values, see load_probes
+                if node.function is builtins.potential:
+                    if node.arguments[0].uid not in self.potential_probes:
+                        return False
+                    continue
+                if node.function is builtins.flow:
+                    if node.arguments[0].uid not in self.flow_probes:
+                        return False
+                    continue
+                pending.extend(node.arguments)
+            elif not isinstance(node, (hir.Literal, hir.Variable, hir.Parameter)):
+                return False
+        return True
+
+    def speculate(self, statement):
+        """
+        Evaluate the assignments of a speculatable statement without storing
+
+        Returns the final value of each assigned variable, by uid.
+        """
+        assigned = {}
+        if statement is None:
+            return assigned
+        pending = [statement]
+        while pending:
+            statement = pending.pop()
+            if isinstance(statement, hir.Block):
+                pending.extend(reversed(statement.statements))
+                continue
+            value = self.expression_to_ir(statement.value)
+            self.forget_readers(statement.lvalue)
+            self.set_value(self.loaded, statement.lvalue.uid, value)
+            assigned[statement.lvalue.uid] = value
+        return assigned
+
+    def if_to_select(self, condition_ir, if_: hir.If):
+        """Evaluate both arms of a conditional and select the results"""
+        before = self.save_values()
+        then_values = self.speculate(if_.then)
+        self.restore_values(before)
+        else_values = self.speculate(if_.else_)
+        self.restore_values(before)
+        uids = list(then_values)
+        uids.extend(uid for uid in else_values if uid not in then_values)
+        for uid in uids:
+            variable = self.symbols[uid]
+            then_value = then_values.get(uid)
+            if then_value is None:
+                then_value = self.expression_to_ir(variable)
+            else_value = else_values.get(uid)
+            if else_value is None:
+                else_value = self.expression_to_ir(variable)
+            self.store_variable(
+                variable, self.builder.select(condition_ir, then_value, else_value)
+            )
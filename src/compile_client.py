@@ -0,0 +1,78 @@
+"""
+Client of compile_server.py listening on a Unix socket
+
+It only imports the standard library, so that it starts quickly.
+
+`python compile_client.py compile --socket PATH [-I DIR] [-D NAME=VALUE] model.va`
+`python compile_client.py evaluate --socket PATH module [-p NAME=VALUE] [-v NET=VALUE]`
+`python compile_client.py shutdown --socket PATH`
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional
+import json
+import socket
+import sys
+
+
+def request(path: Path | str, command: str, **arguments) -> dict:
+    """Send a request to the server listening on a Unix socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(path))
+        with connection.makefile("rw") as stream:
+            stream.write(json.dumps({"command": command, **arguments}) + "\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def parse_assignments(options: Optional[list[str]]) -> dict[str, str]:
+    """Values from `name=value` or `name` command line options"""
+    values = {}
+    for option in options or []:
+        name, _, value = option.partition("=")
+        values[name] = value
+    return values
+
+
+def main():
+    parser = ArgumentParser(description="Send requests to a compile server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_ = commands.add_parser("compile")
+    compile_.add_argument("veriloga")
+    compile_.add_argument("-I", action="append", default=[])
+    compile_.add_argument("-D", action="append", help="define a macro, name or name=value")
+    evaluate = commands.add_parser("evaluate")
+    evaluate.add_argument("module")
+    evaluate.add_argument("-p", action="append", help="parameter value, name=value")
+    evaluate.add_argument("-v", action="append", help="net potential, name=value")
+    ping = commands.add_parser("ping")
+    shutdown = commands.add_parser("shutdown")
+    for command in [compile_, evaluate, ping, shutdown]:
+        command.add_argument("--socket", required=True, help="Unix socket of the server")
+    args = parser.parse_args()
+    if args.command == "compile":
+        # The server may run in another directory
+        response = request(
+            args.socket,
+            "compile",
+            filename=str(Path(args.veriloga).resolve()),
+            include_path=[str(Path(path).resolve()) for path in args.I],
+            defines=parse_assignments(args.D),
+        )
+    elif args.command == "evaluate":
+        response = request(
+            args.socket,
+            "evaluate",
+            module=args.module,
+            parameters={k: float(v) for k, v in parse_assignments(args.p).items()},
+            net_potential={k: float(v) for k, v in parse_assignments(args.v).items()},
+        )
+    else:
+        response = request(args.socket, args.command)
+    print(json.dumps(response, indent=2))
+    if not response["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,10 @@ from compiler import compile_ir, get_engine, vatype_to_ctype
 from codegen import CodegenContext
 
 
-def expression_to_pythonfunc(expression):
+def expression_to_pythonfunc(expression, **options):
     funcname = "evaluate_expression"
-    irmodule = CodegenContext.expression_to_llvm_module_ir(expression, funcname)
-    mod = compile_ir(str(irmodule))
+    irmodule = CodegenContext.expression_to_llvm_module_ir(expression, funcname, **options)
+    mod = compile_ir(irmodule)
 
     func_ptr = get_engine().get_function_address(funcname)
 
@@ -3,13 +3,67 @@ from llvmlite import ir
 import hir
 from compiler import compile_ir, get_engine, vatype_to_ctype
 from codegen import CodegenContext
+from profiling import stage
+from constant_evaluation import evaluate_parameters
 from ctypes import POINTER, cast
+from dataclasses import dataclass
+from typing import Optional
 
-def make_pointer_to_global(vatype, name):
-    address = get_engine().get_global_value_address(name)
+def make_pointer_to_global(vatype, name, engine=None):
+    if engine is None:
+        engine = get_engine()
+    address = engine.get_global_value_address(name)
     type_ = POINTER(vatype_to_ctype(vatype))
     return cast(address, type_)
 
+def branch_name(branch):
+    """Names of the nets of a branch, the second one None for ground"""
+    return branch.net1.name, branch.net2.name if branch.net2 is not None else None
+
+@dataclass
+class ModuleGlobals:
+    """
+    Global variables of the generated code of a module, which unlike the
+    codegen context can be sent to other processes
+
+    Each maps the name of a Verilog-A object (branch_name for branches) to
+    the name of the IR global and its type.
+    """
+    variables: dict[str, tuple[str, VAType]]
+    parameters: dict[str, tuple[str, VAType]]
+    net_potential: dict[str, tuple[str, VAType]]
+    net_flow: dict[str, tuple[str, VAType]]
+    branch_potential: dict[tuple[str, Optional[str]], tuple[str, VAType]]
+    branch_flow: dict[tuple[str, Optional[str]], tuple[str, VAType]]
+
+    @classmethod
+    def from_codegen(cls, codegen):
+        symbols = codegen.symbols
+
+        def globals_of(table, key=lambda symbol: symbol.name, type_=None):
+            result = {}
+            for uid, variable in table.items():
+                symbol = symbols[uid]
+                result[key(symbol)] = (variable.name, type_ or symbol.type_)
+            return result
+
+        # Only the inputs and outputs are exported
+        exported = codegen.exported_variables
+        variables = {
+            uid: variable
+            for uid, variable in codegen.variables.items()
+            if exported is None or symbols[uid].name in exported
+        }
+        return cls(
+            variables=globals_of(variables),
+            parameters=globals_of(codegen.parameters),
+            # Potentials and flows are real
+            net_potential=globals_of(codegen.net_potential, type_=VAType.real),
+            net_flow=globals_of(codegen.net_flow, type_=VAType.real),
+            branch_potential=globals_of(codegen.branch_potential, branch_name, VAType.real),
+            branch_flow=globals_of(codegen.branch_flow, branch_name, VAType.real),
+        )
+
 class CompiledModule:
     def __init__(
             self,
@@ -43,53 +97,64 @@ class CompiledModule:
         def __setitem__(self, name, value):
             self.pointers[name][0] = value
 
+    def load_parameter_defaults(self, parameters):
+        """
+        Set the parameters to the values of their initializers, except those
+        compiled as constants
+        """
+        parameters = list(parameters)
+        values = evaluate_parameters(parameters)
+        for parameter in parameters:
+            if parameter.name in self.parameters.pointers:
+                self.parameters[parameter.name] = values[parameter]
+
     @classmethod
-    def from_hir(cls, module):
-        codegen = CodegenContext.module_to_llvm_module_ir(module)
-        llvm_ir = str(codegen.irmodule)
-        print(llvm_ir)
-        mod = compile_ir(llvm_ir)
-        engine = get_engine()
+    def from_hir(cls, module, dump=False, **options):
+        """Compile a module, with options for CodegenContext"""
+        codegen = CodegenContext.module_to_llvm_module_ir(module, **options)
+        return cls.from_codegen(codegen, dump=dump)
 
+    @classmethod
+    def from_codegen(cls, codegen, dump=False):
+        """Compile the generated IR, printing it if `dump` is true"""
+        with stage("format"):
+            llvm_ir = str(codegen.irmodule)
+        if dump:
+            print(llvm_ir)
+        compile_ir(llvm_ir)
+        compiled = cls.from_globals(ModuleGlobals.from_codegen(codegen))
+        compiled.load_parameter_defaults(
+            codegen.symbols[uid] for uid in codegen.parameters
+        )
+        return compiled
+
+    @classmethod
+    def from_globals(cls, globals_: ModuleGlobals, engine=None):
+        """
+        Module of compiled code, in the global engine or in a given one
+        which is kept alive with the module
+        """
+        if engine is None:
+            engine = get_engine()
         func_ptr = engine.get_function_address("run_analog")
         cfunctype = vatype_to_ctype(
             hir.FunctionSignature(returntype=VAType.void, parameters=[])
         )
-        run_analog = cfunctype(func_ptr)
 
-        # TODO: choose only exported variables
-        variable_pointers = {
-            variable.name: make_pointer_to_global(variable.type_, ir_variable.name)
-            for variable, ir_variable in codegen.variables.items()
-        }
-        parameters = {
-            parameter.name: make_pointer_to_global(parameter.type_, ir_variable.name)
-            for parameter, ir_variable in codegen.parameters.items()
-        }
-        net_potential = {
-            net.name: make_pointer_to_global(VAType.real, variable.name)
-            for net, variable in codegen.net_potential.items()
-        }
-        net_flow = {
-            net.name: make_pointer_to_global(VAType.real, variable.name)
-            for net, variable in codegen.net_flow.items()
-        }
-        branch_potential = {
-            (branch.net1.name, branch.net2.name if branch.net2 is not None else None):
-            make_pointer_to_global(VAType.real, variable.name)
-            for branch, variable in codegen.branch_potential.items()
-        }
-        branch_flow = {
-            (branch.net1.name, branch.net2.name if branch.net2 is not None else None):
-            make_pointer_to_global(VAType.real, variable.name)
-            for branch, variable in codegen.branch_flow.items()
-        }
-        return cls(
-            run_analog=run_analog,
-            variables=variable_pointers,
-            parameters=parameters,
-            net_potential=net_potential,
-            net_flow=net_flow,
-            branch_potential=branch_potential,
-            branch_flow=branch_flow,
+        def pointers(globals_of):
+            return {
+                key: make_pointer_to_global(type_, name, engine)
+                for key, (name, type_) in globals_of.items()
+            }
+
+        compiled = cls(
+            run_analog=cfunctype(func_ptr),
+            variables=pointers(globals_.variables),
+            parameters=pointers(globals_.parameters),
+            net_potential=pointers(globals_.net_potential),
+            net_flow=pointers(globals_.net_flow),
+            branch_potential=pointers(globals_.branch_potential),
+            branch_flow=pointers(globals_.branch_flow),
         )
+        compiled.engine = engine
+        return compiled
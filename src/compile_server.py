@@ -0,0 +1,158 @@
+"""
+Compile server which keeps the lexer, the lexed include files and the JIT
+engine warm between requests
+
+Requests and responses are JSON objects, one per line, read from stdin and
+written to stdout, or exchanged over a Unix socket. A request names a
+command and its arguments:
+
+    {"command": "compile", "filename": "model.va", "include_path": ["include"]}
+    {"command": "evaluate", "module": "mymod", "parameters": {"R": 2.0},
+     "net_potential": {"a": 1.0}}
+
+The response has "ok": true and the results of the command, or "ok": false
+and an "error". Modules whose structure did not change since they were last
+compiled are not compiled again, see incremental.py.
+
+Run from the src directory: `python compile_server.py [--socket PATH]`, and
+send requests with compile_client.py.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+import json
+import socket
+import sys
+from compiler import get_engine
+from compile_module import CompiledModule
+from incremental import IncrementalCompiler
+from parser_interface import parse_source
+from profiling import Profile
+
+
+class CompileServer:
+    def __init__(self, **options):
+        # Options for CodegenContext
+        self.compiler = IncrementalCompiler(**options)
+        # Last compiled module of each name
+        self.modules: dict[str, CompiledModule] = {}
+        self.running = True
+        get_engine()
+
+    def handle(self, request: dict) -> dict:
+        """Response to a request"""
+        arguments = dict(request)
+        command = arguments.pop("command", None)
+        handler = getattr(self, f"do_{command}", None)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command {command!r}"}
+        try:
+            return {"ok": True, **handler(**arguments)}
+        except Exception as error:
+            return {"ok": False, "error": f"{type(error).__name__}: {error}"}
+
+    def do_compile(
+        self,
+        content: Optional[str] = None,
+        filename: Optional[str] = None,
+        include_path: Optional[list[str]] = None,
+        defines: Optional[dict[str, str]] = None,
+    ):
+        """Compile the modules of a source given by content or file name"""
+        start = perf_counter()
+        with Profile() as profile:
+            hir = parse_source(
+                content,
+                filename,
+                include_path=include_path,
+                defines=defines,
+                release_parse_tree=True,
+            )
+            for module in hir.modules:
+                self.modules[module.name] = self.compiler.compile(module)
+        return {
+            "modules": [module.name for module in hir.modules],
+            "seconds": perf_counter() - start,
+            "timings": profile.times,
+        }
+
+    def do_evaluate(
+        self,
+        module: str,
+        parameters: Optional[dict[str, float]] = None,
+        net_potential: Optional[dict[str, float]] = None,
+        variables: Optional[dict[str, float]] = None,
+    ):
+        """Run the analog block of a compiled module with the given values"""
+        compiled = self.modules[module]
+        for values, given in [
+            (compiled.parameters, parameters),
+            (compiled.net_potential, net_potential),
+            (compiled.vars, variables),
+        ]:
+            for name, value in (given or {}).items():
+                values[name] = value
+        compiled.run_analog()
+        return {
+            name: {key: values[key] for key in values.pointers}
+            for name, values in [
+                ("variables", compiled.vars),
+                ("parameters", compiled.parameters),
+                ("net_flow", compiled.net_flow),
+            ]
+        }
+
+    def do_ping(self):
+        return {}
+
+    def do_shutdown(self):
+        self.running = False
+        return {}
+
+
+def serve_stream(server: CompileServer, input, output):
+    """Answer the requests read from `input` until it ends or a shutdown"""
+    for line in input:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            response = {"ok": False, "error": f"Invalid request: {error}"}
+        else:
+            response = server.handle(request)
+        output.write(json.dumps(response) + "\n")
+        output.flush()
+        if not server.running:
+            return
+
+
+def serve_socket(server: CompileServer, path: Path | str):
+    """Answer requests on a Unix socket, one connection at a time"""
+    path = Path(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(str(path))
+        listener.listen()
+        try:
+            while server.running:
+                connection, _ = listener.accept()
+                with connection, connection.makefile("rw") as stream:
+                    serve_stream(server, stream, stream)
+        finally:
+            path.unlink()
+
+
+def main():
+    parser = ArgumentParser(description="Serve compile requests, see compile_client.py")
+    parser.add_argument("--socket", help="Unix socket to listen on, default: stdin/stdout")
+    args = parser.parse_args()
+    server = CompileServer()
+    if args.socket is None:
+        serve_stream(server, sys.stdin, sys.stdout)
+    else:
+        serve_socket(server, args.socket)
+
+
+if __name__ == "__main__":
+    main()
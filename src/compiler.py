@@ -2,6 +2,7 @@ from verilogatypes import VAType
 import hir
 from dataclasses import dataclass
 from ctypes import c_double, c_int32, c_char_p, CFUNCTYPE
+from profiling import stage
 
 
 def vatype_to_ctype(vatype):
@@ -20,6 +21,8 @@ def vatype_to_ctype(vatype):
 
 
 import llvmlite.binding as llvm
+from ctypes.util import find_library
+import weakref
 
 
 engine = None
@@ -30,6 +33,17 @@ def initialize_llvm():
     llvm.initialize()
     llvm.initialize_native_target()
     llvm.initialize_native_asmprinter()
+    # Math builtins without an LLVM intrinsic call the C math library
+    libm = find_library("m")
+    if libm is not None:
+        llvm.load_library_permanently(libm)
+
+
+def create_target_machine(**options):
+    """Target machine for the host CPU, options as in llvmlite"""
+    initialize_llvm()
+    target = llvm.Target.from_default_triple()
+    return target.create_target_machine(**options)
 
 
 def create_execution_engine():
@@ -38,33 +52,138 @@ def create_execution_engine():
     the host CPU.  The engine is reusable for an arbitrary number of
     modules.
     """
-    initialize_llvm()
-    # Create a target machine representing the host
-    target = llvm.Target.from_default_triple()
-    target_machine = target.create_target_machine()
+    target_machine = create_target_machine()
     # And an execution engine with an empty backing module
     backing_mod = llvm.parse_assembly("")
     engine = llvm.create_mcjit_compiler(backing_mod, target_machine)
     return engine
 
 
+def ir_text(llvm_ir):
+    """Text of LLVM IR given as a string or an llvmlite ir.Module"""
+    if isinstance(llvm_ir, str):
+        return llvm_ir
+    with stage("format"):
+        return str(llvm_ir)
+
+
+def promote_locals(mod):
+    """
+    Promote the local variables of the functions of a parsed module, the
+    allocas of the variables which are not exported, to registers
+    """
+    pass_manager = llvm.create_module_pass_manager()
+    pass_manager.add_sroa_pass()
+    pass_manager.run(mod)
+
+
 def compile_ir(llvm_ir):
     """
-    Compile the LLVM IR string with the given engine.
+    Compile LLVM IR, a string or an llvmlite ir.Module, with the engine.
     The compiled module object is returned.
     """
-    global engine
-    if engine is None:
-        engine = create_execution_engine()
+    engine = get_engine()
     # Create a LLVM module object from the IR
-    mod = llvm.parse_assembly(llvm_ir)
-    mod.verify()
+    llvm_ir = ir_text(llvm_ir)
+    with stage("llvm parse"):
+        mod = llvm.parse_assembly(llvm_ir)
+        mod.verify()
     # Now add the module and make sure it is ready for execution
-    engine.add_module(mod)
-    engine.finalize_object()
-    engine.run_static_constructors()
+    with stage("llvm compile"):
+        promote_locals(mod)
+        engine.add_module(mod)
+        engine.finalize_object()
+        engine.run_static_constructors()
     return mod
 
 
+def close_engine(engine, context):
+    """Close an execution engine, and its modules, before their context"""
+    engine.close()
+    context.close()
+
+
+class JitEngine:
+    """
+    Execution engine of a module parsed in an LLVM context of its own,
+    which are closed together when the engine is no longer referenced
+
+    llvmlite objects close themselves when they are collected, in any order
+    when they are part of a reference cycle, but the context must be closed
+    after the engine. The finalizer of the JitEngine keeps them alive until
+    it closes them in order.
+    """
+
+    def __init__(self, engine: llvm.ExecutionEngine, context: llvm.ContextRef):
+        self.engine = engine
+        self._finalizer = weakref.finalize(self, close_engine, engine, context)
+
+    def get_function_address(self, name: str) -> int:
+        return self.engine.get_function_address(name)
+
+    def get_global_value_address(self, name: str) -> int:
+        return self.engine.get_global_value_address(name)
+
+    def close(self):
+        """Close the engine and its context, their code can no longer be used"""
+        self._finalizer()
+
+
+def jit_compile(llvm_ir: str) -> JitEngine:
+    """
+    Compile LLVM IR with an execution engine of its own, returned
+
+    The IR is parsed in a new LLVM context, so that several modules can be
+    compiled in parallel threads, llvmlite releasing the GIL. The engine
+    owns the code and its globals, it must be kept alive while they are
+    used. LLVM must be initialized first, by initialize_llvm, which is not
+    thread safe, and the stages are not profiled for the same reason.
+    """
+    context = llvm.create_context()
+    try:
+        mod = llvm.parse_assembly(llvm_ir, context=context)
+        try:
+            mod.verify()
+            promote_locals(mod)
+            target_machine = llvm.Target.from_default_triple().create_target_machine()
+        except BaseException:
+            mod.close()
+            raise
+        try:
+            engine = llvm.create_mcjit_compiler(mod, target_machine)
+        except BaseException:
+            # The module was disposed of with the engine LLVM failed to create
+            mod.detach()
+            raise
+    except BaseException:
+        context.close()
+        raise
+    jit = JitEngine(engine, context)
+    try:
+        engine.finalize_object()
+        engine.run_static_constructors()
+    except BaseException:
+        jit.close()
+        raise
+    return jit
+
+
+def compile_object(llvm_ir):
+    """
+    Compile LLVM IR, a string or an llvmlite ir.Module, to the contents of
+    a position independent object file for the host
+    """
+    llvm_ir = ir_text(llvm_ir)
+    with stage("llvm parse"):
+        mod = llvm.parse_assembly(llvm_ir)
+        mod.verify()
+    with stage("llvm compile"):
+        promote_locals(mod)
+        return create_target_machine(reloc="pic").emit_object(mod)
+
+
 def get_engine():
+    global engine
+    if engine is None:
+        engine = create_execution_engine()
     return engine
@@ -0,0 +1,164 @@
+"""
+Evaluation in Python of constant expressions, like parameter initializers
+"""
+from functools import singledispatch
+import math
+import hir
+from customdict import CustomDict
+from vabuiltins import builtins
+from verilogatypes import VAType
+
+
+def integer_division(a, b):
+    """Division truncating towards zero, like C"""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def limexp(x, limit=80.0):
+    """Same as the code generated for limexp"""
+    return math.exp(min(x, limit)) * (1 + max(x - limit, 0.0))
+
+
+# Python implementation of each builtin function, by identity
+python_functions = {
+    id(builtins.cast_int_to_real): float,
+    id(builtins.cast_real_to_int): int,
+    id(builtins.integer_product): lambda a, b: a * b,
+    id(builtins.real_product): lambda a, b: a * b,
+    id(builtins.integer_addition): lambda a, b: a + b,
+    id(builtins.real_addition): lambda a, b: a + b,
+    id(builtins.integer_division): integer_division,
+    id(builtins.real_division): lambda a, b: a / b,
+    id(builtins.integer_subtraction): lambda a, b: a - b,
+    id(builtins.real_subtraction): lambda a, b: a - b,
+    id(builtins.real_equality): lambda a, b: int(a == b),
+    id(builtins.real_inequality): lambda a, b: int(a != b),
+    id(builtins.integer_equality): lambda a, b: int(a == b),
+    id(builtins.integer_inequality): lambda a, b: int(a != b),
+    id(builtins.integer_abs): abs,
+    id(builtins.integer_min): min,
+    id(builtins.integer_max): max,
+    id(builtins.ln): math.log,
+    id(builtins.log): math.log10,
+    id(builtins.exp): math.exp,
+    id(builtins.sqrt): math.sqrt,
+    id(builtins.abs): abs,
+    id(builtins.floor): lambda x: float(math.floor(x)),
+    id(builtins.ceil): lambda x: float(math.ceil(x)),
+    id(builtins.sin): math.sin,
+    id(builtins.cos): math.cos,
+    id(builtins.tan): math.tan,
+    id(builtins.asin): math.asin,
+    id(builtins.acos): math.acos,
+    id(builtins.atan): math.atan,
+    id(builtins.sinh): math.sinh,
+    id(builtins.cosh): math.cosh,
+    id(builtins.tanh): math.tanh,
+    id(builtins.asinh): math.asinh,
+    id(builtins.acosh): math.acosh,
+    id(builtins.atanh): math.atanh,
+    id(builtins.limexp): limexp,
+    id(builtins.pow): math.pow,
+    id(builtins.min): min,
+    id(builtins.max): max,
+    id(builtins.atan2): math.atan2,
+    id(builtins.hypot): math.hypot,
+}
+
+
+def convert(value, type_: VAType):
+    """Python value stored in a variable or parameter of a type"""
+    if type_ == VAType.integer:
+        return int(value)
+    if type_ == VAType.real:
+        return float(value)
+    return value
+
+
+@singledispatch
+def evaluate_constant(expression, values: CustomDict):
+    """
+    Value of a constant expression, given the `values` of parameters
+
+    Parameters without a value are evaluated from their initializer and
+    added to `values`.
+    """
+    raise NotImplementedError(type(expression))
+
+
+@evaluate_constant.register
+def _(literal: hir.Literal, values):
+    return literal.value
+
+
+@evaluate_constant.register
+def _(funcall: hir.FunctionCall, values):
+    try:
+        function = python_functions[id(funcall.function)]
+    except KeyError:
+        raise NotImplementedError(funcall.function) from None
+    return function(*(evaluate_constant(arg, values) for arg in funcall.arguments))
+
+
+@evaluate_constant.register
+def _(parameter: hir.Parameter, values):
+    try:
+        return values[parameter]
+    except KeyError:
+        pass
+    if parameter.initializer is None:
+        value = convert(0, parameter.type_)
+    else:
+        value = convert(evaluate_constant(parameter.initializer, values), parameter.type_)
+    values[parameter] = value
+    return value
+
+
+@evaluate_constant.register
+def _(variable: hir.Variable, values):
+    # Only builtin variables like $temperature are constant
+    if variable is not builtins.symbols.get(variable.name):
+        raise NotImplementedError(f"{variable.name} is not constant")
+    return convert(evaluate_constant(variable.initializer, values), variable.type_)
+
+
+def evaluate_parameters(parameters) -> CustomDict:
+    """Default value of each parameter"""
+    values = CustomDict(key=id)
+    for parameter in parameters:
+        evaluate_constant(parameter, values)
+    return values
+
+
+def parameters_read(expression) -> set:
+    """Uids of the parameters which an expression reads"""
+    result = set()
+    pending = [expression]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, hir.Parameter):
+            result.add(node.uid)
+        elif isinstance(node, hir.FunctionCall):
+            pending.extend(node.arguments)
+    return result
+
+
+def input_parameter_names(parameters, names) -> set:
+    """
+    Names of the parameters which are inputs given the `names` declared as
+    inputs: those and the parameters whose initializer depends on them
+
+    A parameter computed from an input cannot be a constant, its default is
+    evaluated when the parameters are loaded like the input ones.
+    """
+    result = set()
+    inputs = set()
+    # Initializers only refer to the parameters declared before them
+    for parameter in parameters:
+        if parameter.name in names or not inputs.isdisjoint(
+            parameters_read(parameter.initializer)
+        ):
+            result.add(parameter.name)
+            inputs.add(parameter.uid)
+    return result
@@ -1,4 +1,4 @@
-from collections.abc import MutableMapping
+from collections.abc import Mapping, MutableMapping
 
 
 class CustomDict(MutableMapping):
@@ -7,9 +7,10 @@ class CustomDict(MutableMapping):
         self._items = {}
         self._keys = {}
         if items is not None:
-            for key, value in dict(items):
-                self._items[id(key)] = value
-                self._keys[id(key)] = key
+            if isinstance(items, Mapping):
+                items = items.items()
+            for key, value in items:
+                self[key] = value
 
     def __getitem__(self, key):
         return self._items[self.keyfunc(key)]
@@ -22,6 +23,12 @@ class CustomDict(MutableMapping):
         del self._items[self.keyfunc(key)]
         del self._keys[self.keyfunc(key)]
 
+    def __contains__(self, key):
+        return self.keyfunc(key) in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(self.keyfunc(key), default)
+
     def __iter__(self):
         return self.keys()
 
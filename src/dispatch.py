@@ -0,0 +1,62 @@
+"""
+Methods which dispatch on the type of their argument
+
+This is functools.singledispatchmethod with the same `register` decorator,
+but the method left in the class is a plain function which looks up the
+handler of the argument's type in a dict. singledispatchmethod instead
+creates a dispatcher function on every attribute access and goes through
+the singledispatch machinery on every call, which is a large overhead for
+the visitors of the compiler, called once per node.
+
+The methods take a single argument, which keeps the call overhead low.
+"""
+from functools import update_wrapper
+from typing import get_type_hints
+
+
+class Handlers(dict):
+    """Handler of each type seen, found in the MRO for unregistered types"""
+
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+
+    def __missing__(self, cls):
+        handler = next(self.registry[base] for base in cls.__mro__ if base in self.registry)
+        self[cls] = handler
+        return handler
+
+
+class dispatchmethod:
+    def __init__(self, default):
+        self.default = default
+        # Handler of each registered type
+        self.registry = {object: default}
+        self.handlers = Handlers(self.registry)
+
+    def register(self, cls, method=None):
+        """
+        Register a handler for a type, given or taken from the annotation of
+        the handler's argument
+        """
+        if method is None:
+            if isinstance(cls, type):
+                return lambda method: self.register(cls, method)
+            method = cls
+            hints = get_type_hints(method)
+            hints.pop("return", None)
+            cls = next(iter(hints.values()))
+        self.registry[cls] = method
+        self.handlers.clear()
+        return method
+
+    def __set_name__(self, owner, name):
+        handlers = self.handlers
+
+        def method(obj, arg):
+            return handlers[type(arg)](obj, arg)
+
+        update_wrapper(method, self.default)
+        method.register = self.register
+        method.dispatch = handlers.__getitem__
+        setattr(owner, name, method)
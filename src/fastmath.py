@@ -0,0 +1,172 @@
+"""
+Fast polynomial implementations of exp, ln and pow
+
+They are branch free and generic on the operand type: they generate the same
+code for double and <N x double> values, so batched evaluation can use them
+without a vector math library. Compared to the LLVM intrinsics they are
+accurate to a few ulp, and slower on scalars: codegen does not use them, they
+are meant for code which evaluates <N x double> values.
+
+Special values are handled with selects, as in C99 Annex F:
+- exp overflows to inf, underflows through the subnormals to 0
+- ln(0) is -inf, ln(inf) is inf, ln of negative numbers and NaN is NaN
+- pow(x, y) is exp(y*ln(|x|)), negated for negative x and odd integer y, NaN
+  for negative x and non-integer y, and 1 for y == 0 or x == 1
+"""
+from llvmlite import ir
+import math
+
+LN2_HI = 6.93147180369123816490e-01
+LN2_LO = 1.90821492927058770002e-10
+# exp is 0 below EXP_MIN and inf above EXP_MAX
+EXP_MIN = -746.0
+EXP_MAX = 710.0
+# Adding 1.5 * 2**52 rounds to an integer which is left in the low bits
+ROUNDING_MAGIC = 6755399441055744.0
+# Taylor series of exp(r) for |r| <= ln(2)/2, highest degree first
+EXP_COEFFICIENTS = [1 / math.factorial(k) for k in range(13, -1, -1)]
+# ln(m) = 2*atanh(f) = 2*f*(1 + s/3 + s²/5 + ...) with f = (m-1)/(m+1), s = f²
+LN_COEFFICIENTS = [1 / (2 * k + 1) for k in range(11, -1, -1)]
+# Smallest normal double
+DBL_MIN = 2.0**-1022
+
+
+def constant(type_, value):
+    """Constant of a scalar type, or splatted over a vector type"""
+    if isinstance(type_, ir.VectorType):
+        return ir.Constant(type_, [ir.Constant(type_.element, value)] * type_.count)
+    return ir.Constant(type_, value)
+
+
+def integer_type(type_):
+    """i64 type, or vector of i64, with the same shape as a double type"""
+    if isinstance(type_, ir.VectorType):
+        return ir.VectorType(ir.IntType(64), type_.count)
+    return ir.IntType(64)
+
+
+def intrinsic(builder, name, *args):
+    """Call an LLVM math intrinsic overloaded on the type of its arguments"""
+    type_ = args[0].type
+    if isinstance(type_, ir.VectorType):
+        suffix = f"v{type_.count}f64"
+    else:
+        suffix = "f64"
+    fullname = f"{name}.{suffix}"
+    module = builder.module
+    try:
+        function = module.get_global(fullname)
+    except KeyError:
+        functype = ir.FunctionType(type_, [type_] * len(args))
+        function = ir.Function(module, functype, name=fullname)
+    return builder.call(function, args)
+
+
+def polynomial(builder, x, coefficients):
+    """Horner evaluation, coefficients from the highest degree"""
+    result = constant(x.type, coefficients[0])
+    for coefficient in coefficients[1:]:
+        result = builder.fadd(builder.fmul(result, x), constant(x.type, coefficient))
+    return result
+
+
+def clamp(builder, x, low, high):
+    x = builder.select(builder.fcmp_ordered("<", x, low), low, x)
+    return builder.select(builder.fcmp_ordered(">", x, high), high, x)
+
+
+def power_of_two(builder, n, type_):
+    """2**n of a double type, for integers n in the normal exponent range"""
+    inttype = n.type
+    biased = builder.add(n, constant(inttype, 1023))
+    return builder.bitcast(builder.shl(biased, constant(inttype, 52)), type_)
+
+
+def exp(builder, x):
+    type_ = x.type
+    inttype = integer_type(type_)
+    # Beyond the clamp the result is 0 or inf anyway, NaN is kept
+    x = clamp(builder, x, constant(type_, EXP_MIN), constant(type_, EXP_MAX))
+    # x = n*ln(2) + r with integer n and |r| <= ln(2)/2
+    magic = constant(type_, ROUNDING_MAGIC)
+    shifted = builder.fadd(builder.fmul(x, constant(type_, 1 / math.log(2))), magic)
+    n = builder.fsub(shifted, magic)
+    r = builder.fsub(x, builder.fmul(n, constant(type_, LN2_HI)))
+    r = builder.fsub(r, builder.fmul(n, constant(type_, LN2_LO)))
+    p = polynomial(builder, r, EXP_COEFFICIENTS)
+    # Multiply by 2**n in two steps, as 2**n itself may not be a normal
+    # double: the multiplications overflow and underflow like exp does
+    n = builder.sub(builder.bitcast(shifted, inttype), builder.bitcast(magic, inttype))
+    half_n = builder.ashr(n, constant(inttype, 1))
+    p = builder.fmul(p, power_of_two(builder, half_n, type_))
+    return builder.fmul(p, power_of_two(builder, builder.sub(n, half_n), type_))
+
+
+def ln(builder, x):
+    type_ = x.type
+    inttype = integer_type(type_)
+    # Scale subnormals up to normal numbers
+    subnormal = builder.fcmp_ordered("<", x, constant(type_, DBL_MIN))
+    scaled = builder.select(subnormal, builder.fmul(x, constant(type_, 2.0**52)), x)
+    bits = builder.bitcast(scaled, inttype)
+    # x = m * 2**e with m in [1, 2)
+    e = builder.sub(builder.lshr(bits, constant(inttype, 52)), constant(inttype, 1023))
+    e = builder.select(subnormal, builder.sub(e, constant(inttype, 52)), e)
+    mantissa = builder.or_(
+        builder.and_(bits, constant(inttype, (1 << 52) - 1)),
+        constant(inttype, 1023 << 52),
+    )
+    m = builder.bitcast(mantissa, type_)
+    # Then m in [sqrt(2)/2, sqrt(2)) so that the series converges fast
+    big = builder.fcmp_ordered(">", m, constant(type_, math.sqrt(2)))
+    m = builder.select(big, builder.fmul(m, constant(type_, 0.5)), m)
+    e = builder.select(big, builder.add(e, constant(inttype, 1)), e)
+    e = builder.sitofp(e, type_)
+    one = constant(type_, 1.0)
+    f = builder.fdiv(builder.fsub(m, one), builder.fadd(m, one))
+    series = polynomial(builder, builder.fmul(f, f), LN_COEFFICIENTS)
+    ln_m = builder.fmul(builder.fmul(f, constant(type_, 2.0)), series)
+    low = builder.fadd(ln_m, builder.fmul(e, constant(type_, LN2_LO)))
+    result = builder.fadd(builder.fmul(e, constant(type_, LN2_HI)), low)
+    # Special values
+    zero = constant(type_, 0.0)
+    inf = constant(type_, math.inf)
+    result = builder.select(builder.fcmp_ordered("==", x, inf), inf, result)
+    result = builder.select(builder.fcmp_ordered("==", x, zero), builder.fneg(inf), result)
+    # Unordered: true for NaN too
+    negative = builder.fcmp_unordered("<", x, zero)
+    return builder.select(negative, constant(type_, math.nan), result)
+
+
+def pow(builder, x, y):
+    type_ = x.type
+    inttype = integer_type(type_)
+    zero = constant(type_, 0.0)
+    one = constant(type_, 1.0)
+    abs_x = intrinsic(builder, "llvm.fabs", x)
+    # ln(0) = -inf makes this 0 or inf for x == 0, and exp overflows
+    result = exp(builder, builder.fmul(y, ln(builder, abs_x)))
+    integer = builder.fcmp_ordered("==", intrinsic(builder, "llvm.floor", y), y)
+    half_y = builder.fmul(y, constant(type_, 0.5))
+    odd = builder.and_(
+        integer, builder.fcmp_ordered("!=", intrinsic(builder, "llvm.floor", half_y), half_y)
+    )
+    # The sign bit, so that pow(-0, -1) is -inf
+    sign = builder.icmp_signed("<", builder.bitcast(x, inttype), constant(inttype, 0))
+    result = builder.select(builder.and_(sign, odd), builder.fneg(result), result)
+    negative = builder.fcmp_ordered("<", x, zero)
+    nan = builder.and_(negative, builder.not_(integer))
+    result = builder.select(nan, constant(type_, math.nan), result)
+    # pow(x, 0) and pow(1, y) are 1 even for NaN, as is pow(-1, ±inf)
+    abs_y = intrinsic(builder, "llvm.fabs", y)
+    is_one = builder.or_(
+        builder.fcmp_ordered("==", y, zero),
+        builder.or_(
+            builder.fcmp_ordered("==", x, one),
+            builder.and_(
+                builder.fcmp_ordered("==", abs_x, one),
+                builder.fcmp_ordered("==", abs_y, constant(type_, math.inf)),
+            ),
+        ),
+    )
+    return builder.select(is_one, one, result)
@@ -1,10 +1,16 @@
 from __future__ import annotations
-from dataclasses import dataclass, field, replace
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from hashlib import blake2b
 from verilogatypes import VAType
-from typing import Union, Optional, List, Literal
+from typing import Union, Optional, List, Literal, Sequence
 from abc import ABC, abstractmethod, abstractproperty
 from collections import OrderedDict
+from itertools import count
+import struct
+from weakref import WeakValueDictionary
 import parsetree as pt
+from customdict import CustomDict
+from mytoken import FileLocation
 
 
 class HIR:
@@ -12,9 +18,24 @@ class HIR:
         return replace(self, parsed=None)
 
 
+# Source of the unique ids of symbols
+symbol_uids = count()
+
+
 @dataclass(frozen=False)
 class Symbol(HIR):
+    """
+    Named object of a source file
+
+    Each symbol gets a unique integer id when it is created while lowering,
+    which is kept by its copies (e.g. by strip_parsed), so tables indexed by
+    symbol (e.g. in codegen) are plain dicts keyed by the id.
+    """
+
     name: str
+    uid: int = field(
+        default_factory=symbol_uids.__next__, compare=False, repr=False, kw_only=True
+    )
 
 
 @dataclass(frozen=True)
@@ -32,26 +53,12 @@ class Nature(Symbol):
     parsed: Optional[pt.Nature] = None
 
     def __eq__(self, other):
-        if not (
-            (self.name == other.name)
-            and (self.access.name == other.access.name)
-            and (self.abstol == other.abstol)
-            and (self.units == other.units)
-            and (self.units == other.units)
-            and (self.parsed == other.parsed)
-        ):
-            return False
-        if (
-            self.idt_nature is not None
-            and self.idt_nature.name != other.idt_nature.name
-        ):
-            return False
-        if (
-            self.ddt_nature is not None
-            and self.ddt_nature.name != other.ddt_nature.name
-        ):
-            return False
-        return True
+        # The related natures refer to each other, they are compared by name
+        if self is other:
+            return True
+        if not isinstance(other, Nature):
+            return NotImplemented
+        return fingerprint(self) == fingerprint(other)
 
 
 @dataclass(frozen=False)
@@ -95,31 +102,141 @@ class Port(Symbol):
 # raise NotImplementedError()
 
 
-@dataclass(init=False)
-class Literal:
+class Interned:
+    """
+    Base for hash-consed (interned) immutable expression nodes
+
+    Constructing a node with the same contents as a live node returns the
+    existing instance, so identical subtrees are shared and a repeated
+    subexpression can be recognized by identity. Symbols (variables,
+    parameters, branches...) are compared by identity when interning, so
+    nodes from different modules are never merged.
+    Since a node may occur in several places, possibly of different source
+    files, it has no parse tree: the origins of the occurrences of
+    expressions are recorded by their source file, see SourceFile.origin.
+    """
+
+    _instances: WeakValueDictionary = WeakValueDictionary()
+
+    @classmethod
+    def intern(cls, key, **fields):
+        key = (cls,) + key
+        node = cls._instances.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in fields.items():
+                object.__setattr__(node, name, value)
+            node = cls._instances.setdefault(key, node)
+        return node
+
+    def __init__(self, *args, **kwargs):
+        # Everything is done by __new__, which may return an existing node
+        pass
+
+
+def structural_hash(node) -> int:
+    """Hash consistent with the structural equality of HIR expressions"""
+    if isinstance(node, Interned):
+        return hash(node)
+    # Symbols compare by value but are not hashable, use their name
+    return hash((type(node).__name__, node.name))
+
+
+# Fields of the nodes which are ignored by fingerprints
+unstructural_fields = frozenset({"parsed", "uid", "locations", "expression_origins"})
+# Fields of the nodes which define symbols, other symbols are references
+definition_fields = frozenset(
+    {"modules", "ports", "nets", "branches", "parameters", "variables"}
+)
+
+
+def fingerprint(node) -> bytes:
+    """
+    Canonical digest of the structure of a HIR node
+
+    Parse trees, source locations and symbol ids are ignored, so nodes
+    lowered from different sources (or copied by strip_parsed) have the same
+    fingerprint when they have the same structure, and the fingerprint of a
+    module can key a cache of compiled code. Symbols are described by their
+    definition in the fields which define them (e.g. Module.variables) and by
+    their name and type where they are referred to (e.g. in expressions).
+
+    The fingerprints of immutable nodes, like expressions, are cached in the
+    nodes, so the fingerprint of a node which shares them is computed from
+    the cached fingerprints of its children.
+    """
+    cached = getattr(node, "_fingerprint", None)
+    if cached is not None:
+        return cached
+    if isinstance(node, FunctionCall):
+        fingerprint_arguments(node)
+    description = (type(node).__name__,) + tuple(
+        describe(getattr(node, f.name), f.name in definition_fields)
+        for f in fields(node)
+        if f.name not in unstructural_fields
+    )
+    result = blake2b(repr(description).encode(), digest_size=16).digest()
+    if type(node).__dataclass_params__.frozen:
+        object.__setattr__(node, "_fingerprint", result)
+    return result
+
+
+def fingerprint_arguments(call: FunctionCall):
+    """Cache the fingerprints of nested calls, innermost first, without recursion"""
+    stack = [call]
+    while stack:
+        node = stack[-1]
+        pending = [
+            argument
+            for argument in node.arguments
+            if isinstance(argument, FunctionCall) and "_fingerprint" not in argument.__dict__
+        ]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        if node is not call and "_fingerprint" not in node.__dict__:
+            fingerprint(node)
+
+
+def describe(value, definition: bool):
+    """Description of a field of a node, with the fingerprints of its nodes"""
+    if isinstance(value, Symbol) and not definition:
+        return (type(value).__name__, value.name, getattr(value, "type_", None))
+    if isinstance(value, (list, tuple)):
+        return tuple(describe(item, definition) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, describe(item, definition)) for key, item in value.items())
+    if isinstance(value, type):
+        return value.__name__
+    if is_dataclass(value):
+        return fingerprint(value)
+    return value
+
+
+@dataclass(frozen=True, init=False)
+class Literal(Interned):
     value: int | float | str
     type_: VAType
-    parsed: Optional[pt.Literal] = None
-
-    def __init__(
-        self,
-        value: int | float | str,
-        type_: Optional[VAType] = None,
-        parsed: Optional[pt.Literal] = None,
-    ):
-        self.value = value
+
+    def __new__(cls, value: int | float | str, type_: Optional[VAType] = None):
         if type_ is None:
             type_ = {int: VAType.integer, float: VAType.real, str: VAType.string}[
                 type(value)
             ]
-        self.type_ = type_
-        self.parsed = parsed
+        # Floats are keyed by their bits, which tell -0.0 from 0.0 and
+        # make NaN equal to itself
+        key = struct.pack("<d", value) if type(value) is float else value
+        return cls.intern((type(value), key, type_), value=value, type_=type_)
+
+    def __reduce__(self):
+        return type(self), (self.value, self.type_)
 
     def __repr__(self):
         return f"hir.Literal({self.value!r})"
 
     def strip_parsed(self):
-        return replace(self, parsed=None)
+        return self
 
 
 @dataclass(frozen=True)
@@ -128,28 +245,174 @@ class FunctionSignature:
     parameters: Tuple[VAType, ...]
 
 
+def builtin(name: str) -> FrozenSymbol:
+    """Builtin symbol of this process with a name"""
+    # vabuiltins defines the builtins with the classes of this module
+    from vabuiltins import builtins
+
+    return builtins[name]
+
+
 @dataclass(frozen=True)
 class Function(FrozenSymbol):
     type_: FunctionSignature
 
+    def __reduce_ex__(self, protocol):
+        # Builtins are unpickled as the builtins of the loading process, like
+        # in serialize_hir, since the compiler looks them up by identity
+        try:
+            if builtin(self.name) is self:
+                return builtin, (self.name,)
+        except KeyError:
+            pass
+        return super().__reduce_ex__(protocol)
 
-@dataclass(frozen=False)
-class FunctionCall:
+
+@dataclass(frozen=True, init=False)
+class FunctionCall(Interned):
     function: Function
-    arguments: tuple[Expression]
-    parsed: Optional[pt.FunctionCall] = None
+    arguments: tuple[Expression, ...]
+
+    def __new__(cls, function: Function, arguments: Sequence[Expression]):
+        arguments = tuple(arguments)
+        node = cls.intern(
+            (id(function), tuple(map(id, arguments))),
+            function=function,
+            arguments=arguments,
+        )
+        if "_hash" not in node.__dict__:
+            object.__setattr__(
+                node,
+                "_hash",
+                hash((function, tuple(map(structural_hash, arguments)))),
+            )
+        return node
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        # Same as the dataclass equality, without recursion
+        if self is other:
+            return True
+        if type(other) is not FunctionCall:
+            return NotImplemented
+        compared = set()
+        pending = [(self, other)]
+        while pending:
+            first, second = pending.pop()
+            if first is second or (id(first), id(second)) in compared:
+                continue
+            compared.add((id(first), id(second)))
+            if type(first) is not FunctionCall:
+                if first != second:
+                    return False
+            elif (
+                type(second) is not FunctionCall
+                or first._hash != second._hash
+                or first.function != second.function
+                or len(first.arguments) != len(second.arguments)
+            ):
+                return False
+            else:
+                pending.extend(zip(first.arguments, second.arguments))
+        return True
+
+    def __reduce__(self):
+        # The nested calls are given by their index in a flat tuple, since
+        # pickle recurses into the arguments of objects
+        calls = nested_calls(self)
+        indices = {id(call): index for index, call in enumerate(calls)}
+        records = tuple(
+            (
+                call.function,
+                tuple(
+                    indices[id(argument)] if type(argument) is FunctionCall else argument
+                    for argument in call.arguments
+                ),
+            )
+            for call in calls
+        )
+        return unflatten_calls, (records,)
+
+    def __repr__(self):
+        # Same as the dataclass repr, without recursion
+        parts = []
+        pending = [self]
+        while pending:
+            item = pending.pop()
+            if type(item) is str:
+                parts.append(item)
+            elif type(item) is not FunctionCall:
+                parts.append(repr(item))
+            else:
+                arguments = item.arguments
+                pending.append(",))" if len(arguments) == 1 else "))")
+                for index in reversed(range(len(arguments))):
+                    pending.append(arguments[index])
+                    if index:
+                        pending.append(", ")
+                pending.append(f"FunctionCall(function={item.function!r}, arguments=(")
+        return "".join(parts)
 
     @property
     def type_(self):
         # Get result type from function signature
         return self.function.type_.returntype
 
-    def strip_parsed(node: hir.FunctionCall):
-        return replace(
-            node,
-            parsed=None,
-            arguments=tuple(arg.strip_parsed() for arg in node.arguments),
+    def strip_parsed(self):
+        stripped = {}
+        for call in nested_calls(self):
+            stripped[id(call)] = FunctionCall(
+                call.function,
+                tuple(
+                    stripped[id(argument)]
+                    if type(argument) is FunctionCall
+                    else argument.strip_parsed()
+                    for argument in call.arguments
+                ),
+            )
+        return stripped[id(self)]
+
+
+def nested_calls(call: FunctionCall) -> list:
+    """
+    Distinct calls of an expression, the arguments before the calls, found
+    without recursion
+    """
+    calls = []
+    done = set()
+    stack = [call]
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        pending = [
+            argument
+            for argument in node.arguments
+            if type(argument) is FunctionCall and id(argument) not in done
+        ]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        done.add(id(node))
+        calls.append(node)
+    return calls
+
+
+def unflatten_calls(records) -> FunctionCall:
+    """Call pickled by FunctionCall.__reduce__, the last of the records"""
+    calls = []
+    for function, arguments in records:
+        calls.append(
+            FunctionCall(
+                function,
+                tuple(calls[a] if type(a) is int else a for a in arguments),
+            )
         )
+    return calls[-1]
 
 
 @dataclass(frozen=False)
@@ -278,6 +541,38 @@ class Module(Symbol):
 class SourceFile:
     modules: List[Module] = field(default_factory=list)
     parsed: Optional[pt.SourceFile] = None
+    # Origin of the first token of each node, when the parse tree was released
+    locations: Optional[CustomDict] = field(default=None, repr=False)
+    # Origins of the expressions of each statement or symbol, by field, see
+    # origin
+    expression_origins: Optional[CustomDict] = field(default=None, repr=False)
+
+    def origin(self, node, *path) -> Optional[List[FileLocation]]:
+        """
+        Where a node of this source file comes from, for diagnostics
+
+        Expressions are shared, so an occurrence of an expression is given
+        by the node which contains it, the name of the field and the indices
+        of the arguments down to it, e.g. origin(assignment, "value", 1) for
+        the second argument of the value of an assignment.
+        """
+        if path:
+            if self.expression_origins is None:
+                return None
+            field_name, *indices = path
+            origins = self.expression_origins.get(node, {}).get(field_name)
+            # Origin of the expression and origins of its arguments
+            for index in indices:
+                if origins is None or index >= len(origins[1]):
+                    return None
+                origins = origins[1][index]
+            return None if origins is None else origins[0]
+        if getattr(node, "parsed", None) is not None:
+            token = pt.first_token(node.parsed)
+            return None if token is None else token.origin
+        if self.locations is None:
+            return None
+        return self.locations.get(node)
 
     def strip_parsed(node: hir.SourceFile):
         return replace(
@@ -294,6 +589,7 @@ class Accessor(Symbol):
     def __init__(self, name: str, nature: Nature):
         self.name = name
         self.nature = nature
+        self.uid = next(symbol_uids)
 
 
 @dataclass(frozen=False)
@@ -0,0 +1,61 @@
+"""
+Recompilation which reuses the compiled code of modules whose structure
+did not change
+
+Editing only the defaults of parameters does not change the generated code,
+because parameters are read from global variables. The compiled module is
+then reused and only the parameter initializers are evaluated again. This is
+not the case of the parameters compiled as constants, see the
+input_parameters option of CodegenContext.
+"""
+from dataclasses import replace
+from hashlib import sha256
+import hir
+from constant_evaluation import evaluate_parameters, input_parameter_names
+from compile_module import CompiledModule
+
+
+def structure_hash(module: hir.Module, input_parameters=None) -> str:
+    """
+    Hash of a module which does not depend on the initializers of the
+    parameters which are inputs, all of them by default
+
+    The values of the other parameters, compiled as constants, are hashed.
+    """
+    parameters = [replace(parameter, initializer=None) for parameter in module.parameters]
+    key = hir.fingerprint(replace(module, parameters=parameters))
+    if input_parameters is not None:
+        values = evaluate_parameters(module.parameters)
+        input_parameters = input_parameter_names(module.parameters, input_parameters)
+        constants = [
+            (parameter.name, values[parameter])
+            for parameter in module.parameters
+            if parameter.name not in input_parameters
+        ]
+        key += sha256(repr(constants).encode()).digest()
+    return key.hex()
+
+
+class IncrementalCompiler:
+    """Compiles modules, reusing the code of modules with the same structure"""
+
+    def __init__(self, **options):
+        # Options for CompiledModule.from_hir
+        self.options = options
+        # Compiled module for each structure hash
+        self.compiled = {}
+
+    def compile(self, module: hir.Module) -> CompiledModule:
+        """
+        Compiled module with its parameters set to the defaults of `module`
+
+        A previously compiled module with the same structure is returned if
+        there is one, so its state (e.g. variables) is shared.
+        """
+        key = structure_hash(module, self.options.get("input_parameters"))
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = self.compiled[key] = CompiledModule.from_hir(module, **self.options)
+        else:
+            compiled.load_parameter_defaults(module.parameters)
+        return compiled
@@ -3,9 +3,15 @@ from dataclasses import dataclass, replace
 import ply.lex  # type: ignore
 import re
 import os
+from pathlib import Path
 from mytoken import MyToken
+import profiling
 
-with open("../grammar_manipulation/operators") as fd:
+# Tables shared with the grammar tools, found relative to this file so that
+# the lexer can be imported from any working directory
+GRAMMAR_DIR = Path(__file__).resolve().parent.parent / "grammar_manipulation"
+
+with open(GRAMMAR_DIR / "operators") as fd:
     operators: Dict[str, str] = {}
     for line in fd:
         operator, name = line.strip().split("\t")
@@ -13,7 +19,7 @@ with open("../grammar_manipulation/operators") as fd:
 for name, value in operators.items():
     globals()["t_" + name] = re.escape(value)
 
-with open("../grammar_manipulation/reserved") as fd:
+with open(GRAMMAR_DIR / "reserved") as fd:
     reserved = tuple(line.strip() for line in fd)
 
 tokens = (
@@ -136,6 +142,18 @@ def t_error(t):
 
 TokenSource = Iterator[MyToken]
 
+# Building a lexer inspects this module and compiles the regexes, so it is
+# done once and the lexers used are clones of this one
+master_lexer = None
+
+
+def new_lexer():
+    """Lexer with its own state, so that lexing included files is reentrant"""
+    global master_lexer
+    if master_lexer is None:
+        master_lexer = ply.lex.lex()
+    return master_lexer.clone()
+
 
 def lex(filename: Optional[str] = None, content: Optional[str] = None) -> TokenSource:
     if content is None:
@@ -144,20 +162,21 @@ def lex(filename: Optional[str] = None, content: Optional[str] = None) -> TokenS
         ), "If filename is not provided then content is mandatory"
         with open(filename) as fd:
             content = fd.read()
-    # Can't create this at the module level because then the lexer is not reentrant
-    # This breaks lexing of included files
-    lexer = ply.lex.lex()
+    lexer = new_lexer()
     lexer.filename = filename
     lexer.line_beginning = 0
     lexer.lineno = 1
     lexer.input(content)
+    ntokens = 0
     for raw_token in lexer:
         column = raw_token.lexpos - lexer.line_beginning + 1
+        ntokens += 1
         yield MyToken(
             type=raw_token.type,
             value=raw_token.value,
             origin=[(filename, raw_token.lineno, column)],
         )
+    profiling.count("tokens lexed", ntokens)
 
 
 class TokenHelper:
@@ -0,0 +1,169 @@
+"""
+Elimination of the statements and variables which cannot affect the outputs
+of a module
+
+The outputs are the net flows and branch potentials, which contributions
+add to, and the observable variables, whose values are read after
+run_analog. An assignment is dead when its variable is not read before
+being assigned again or before the end of run_analog, unless the variable
+is observable. Variables are global variables of the generated code, so a
+variable read before it is assigned reads its value at the end of the
+previous run, which is then live too.
+"""
+from dataclasses import replace
+from operator import is_not
+from typing import Collection, Optional
+from dispatch import dispatchmethod
+import hir
+
+
+class Liveness:
+    """Backward analysis of the variables live before each statement"""
+
+    def __init__(self):
+        # Uids of the variables read by each expression, by identity
+        self.reads = {}
+        # Uids of the variables live at the position of the sweep, a set
+        # which is updated in place
+        self.live = set()
+        # Uids of the variables whose values at the end of a run may be read
+        # by the next run, set by eliminate
+        self.carried = None
+
+    def read(self, expression: hir.Expression) -> frozenset:
+        """Uids of the variables which an expression reads, without recursion"""
+        try:
+            return self.reads[id(expression)]
+        except KeyError:
+            pass
+        if type(expression) is hir.Variable:
+            result = {expression.uid}
+        elif type(expression) is hir.FunctionCall:
+            result = set()
+            seen = set()
+            pending = [expression]
+            while pending:
+                for argument in pending.pop().arguments:
+                    kind = type(argument)
+                    if kind is hir.FunctionCall:
+                        if id(argument) not in seen:
+                            seen.add(id(argument))
+                            pending.append(argument)
+                    elif kind is hir.Variable:
+                        result.add(argument.uid)
+        else:
+            result = ()
+        result = self.reads[id(expression)] = frozenset(result)
+        return result
+
+    def sweep_all(self, statements) -> list:
+        """Statements without their dead code"""
+        kept = []
+        for statement in reversed(statements):
+            statement = self.sweep(statement)
+            if statement is not None:
+                kept.append(statement)
+        kept.reverse()
+        return kept
+
+    @dispatchmethod
+    def sweep(self, statement: hir.Statement):
+        """
+        Statement without its dead code, None if it is all dead (leaving
+        the live variables unchanged), given the variables live after it,
+        which are replaced by those live before it
+        """
+        raise NotImplementedError(type(statement))
+
+    @sweep.register
+    def _(self, assignment: hir.Assignment):
+        uid = assignment.lvalue.uid
+        if uid not in self.live:
+            return None
+        self.live.discard(uid)
+        self.live |= self.read(assignment.value)
+        return assignment
+
+    @sweep.register
+    def _(self, contribution: hir.AnalogContribution):
+        self.live |= self.read(contribution.value)
+        return contribution
+
+    @sweep.register
+    def _(self, block: hir.Block):
+        statements = self.sweep_all(block.statements)
+        if not statements:
+            return None
+        if len(statements) < len(block.statements) or any(
+            map(is_not, statements, block.statements)
+        ):
+            block = replace(block, statements=statements)
+        return block
+
+    @sweep.register
+    def _(self, if_: hir.If):
+        after = self.live
+        self.live = set(after)
+        then = None if if_.then is None else self.sweep(if_.then)
+        live_then, self.live = self.live, after
+        else_ = None if if_.else_ is None else self.sweep(if_.else_)
+        # Conditions have no side effects
+        if then is None and else_ is None:
+            return None
+        if then is not if_.then or else_ is not if_.else_:
+            if_ = replace(if_, then=then, else_=else_)
+        self.live |= live_then
+        self.live |= self.read(if_.condition)
+        return if_
+
+    def eliminate(self, module: hir.Module, observable: Optional[Collection[str]] = None):
+        """Copy of a module without its dead code, see eliminate_dead_code"""
+        live_at_end = frozenset(
+            variable.uid
+            for variable in module.variables
+            if observable is None or variable.name in observable
+        )
+        observed = live_at_end
+        while True:
+            self.live = set(live_at_end)
+            statements = self.sweep_all(module.statements)
+            # Values carried over from the previous run
+            if self.live <= live_at_end:
+                break
+            live_at_end |= self.live
+        self.carried = frozenset(self.live)
+        used = observed | self.referenced(statements)
+        variables = [variable for variable in module.variables if variable.uid in used]
+        return replace(module, statements=statements, variables=variables)
+
+    def referenced(self, statements) -> set:
+        """Uids of the variables which statements assign or read"""
+        result = set()
+        pending = list(statements)
+        while pending:
+            statement = pending.pop()
+            if isinstance(statement, hir.Assignment):
+                result.add(statement.lvalue.uid)
+                result |= self.read(statement.value)
+            elif isinstance(statement, hir.AnalogContribution):
+                result |= self.read(statement.value)
+            elif isinstance(statement, hir.Block):
+                pending.extend(statement.statements)
+            elif isinstance(statement, hir.If):
+                result |= self.read(statement.condition)
+                pending.extend(arm for arm in (statement.then, statement.else_) if arm is not None)
+        return result
+
+
+def eliminate_dead_code(
+    module: hir.Module, observable: Optional[Collection[str]] = None
+) -> hir.Module:
+    """
+    Copy of a module without the statements and variables which cannot
+    affect its outputs
+
+    `observable` are the names of the variables whose values are outputs,
+    all of them if it is None. Names which are not variables of the module
+    are ignored, so the same names can be given for several modules.
+    """
+    return Liveness().eliminate(module, observable)
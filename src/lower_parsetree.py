@@ -1,15 +1,34 @@
-from typing import Mapping, Optional, Tuple, Union, List, Sequence
+from typing import Iterable, Mapping, Optional, Tuple, Union, List, Sequence
+from dataclasses import fields, is_dataclass
+from itertools import chain
+from operator import is_
 import hir
 import parsetree as pt
-from itertools import chain
-from functools import singledispatchmethod
+from dispatch import dispatchmethod
 from contextlib import contextmanager
 from verilogatypes import VAType
 from vabuiltins import builtins
-from symboltable import SymbolTable
+from symboltable import SymbolTable, ScopedSymbolTable
+from customdict import CustomDict
 
 Context = Tuple[Union[hir.SourceFile, hir.Module, hir.Block], SymbolTable]
 
+# Polymorphic builtins, by identity: version used with integer arguments
+integer_overloads = {
+    id(builtins.abs): builtins.integer_abs,
+    id(builtins.min): builtins.integer_min,
+    id(builtins.max): builtins.integer_max,
+}
+# Builtins of each binary operator: integer version, real version
+binary_operators = {
+    "*": (builtins.integer_product, builtins.real_product),
+    "+": (builtins.integer_addition, builtins.real_addition),
+    "/": (builtins.integer_division, builtins.real_division),
+    "-": (builtins.integer_subtraction, builtins.real_subtraction),
+    "==": (builtins.integer_equality, builtins.real_equality),
+    "!=": (builtins.integer_inequality, builtins.real_inequality),
+}
+
 
 def ensure_type(expression, type_):
     if expression.type_ == type_:
@@ -25,39 +44,141 @@ def ensure_type(expression, type_):
     return hir.FunctionCall(function=function, arguments=(expression,))
 
 
+# First token of the expressions, without pt.first_token for speed
+first_tokens = {
+    pt.Literal: lambda node: node.value,
+    pt.Identifier: lambda node: node.name,
+    pt.Operation: lambda node: node.operator,
+    pt.FunctionCall: lambda node: node.function.name,
+}
+
+
+def token_origin(node: pt.ParseTree):
+    """Origin of the first token of a parse tree node"""
+    first_token = first_tokens.get(type(node), pt.first_token)
+    token = first_token(node)
+    return None if token is None else token.origin
+
+
+def call_origins(node: hir.Expression, operands, operand_origins, origin) -> tuple:
+    """
+    Origins of an expression lowered from operands and of its arguments,
+    given the origins of the operands, e.g. of a cast operand
+    """
+    if (
+        type(node) is hir.FunctionCall
+        and len(node.arguments) == len(operands)
+        and all(map(is_, node.arguments, operands))
+    ):
+        return (origin, tuple(operand_origins))
+    remaining = list(zip(operands, operand_origins))
+    for operand, origins in remaining:
+        if node is operand:
+            return origins
+    if type(node) is not hir.FunctionCall:
+        return (origin, ())
+    arguments = []
+    for argument in node.arguments:
+        for index, (operand, origins) in enumerate(remaining):
+            if argument is operand:
+                break
+            if (
+                type(argument) is hir.FunctionCall
+                and len(argument.arguments) == 1
+                and argument.arguments[0] is operand
+            ):
+                # Converted operand
+                origins = (origins[0], (origins,))
+                break
+        else:
+            # e.g. the 0 of a negation
+            arguments.append((origin, ()))
+            continue
+        del remaining[index]
+        arguments.append(origins)
+    return (origin, tuple(arguments))
+
+
+def release_parsed(root, locations: CustomDict):
+    """
+    Drop the references to parse trees of the HIR nodes reachable from root,
+    recording the origin of their first token in `locations`
+
+    Interned expressions have no parse trees, their origins are recorded
+    separately (see hir.SourceFile.origin), and the symbols they refer to
+    are reached through the module or the disciplines, so they are skipped.
+    """
+    seen = set()
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (list, tuple)):
+            pending.extend(node)
+        elif isinstance(node, dict):
+            pending.extend(node.values())
+        elif isinstance(node, hir.Interned):
+            continue
+        elif is_dataclass(node) and not isinstance(node, type):
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            parsed = getattr(node, "parsed", None)
+            if parsed is not None:
+                token = pt.first_token(parsed)
+                if token is not None:
+                    locations[node] = token.origin
+                # Contributions are frozen
+                object.__setattr__(node, "parsed", None)
+            pending.extend(getattr(node, f.name) for f in fields(node) if f.name != "parsed")
+
+
 class LowerParseTree:
-    def __init__(self, contexts: Optional[List[Context]] = None):
+    def __init__(
+        self,
+        contexts: Optional[List[Context]] = None,
+        locations: Optional[CustomDict] = None,
+    ):
         if contexts is None:
             contexts = []
         self.contexts = contexts
+        self.symbols = ScopedSymbolTable()
+        for _, symboltable in contexts:
+            self.symbols.enter(symboltable)
+        # When given, the HIR keeps no parse trees, their origins are
+        # recorded here instead
+        self.locations = locations
+        # Origins of the expressions of the statements and symbols, see
+        # hir.SourceFile.origin
+        self.expression_origins = CustomDict(key=id)
 
     @contextmanager
     def push_context(self, context: Context):
         self.contexts.append(context)
-        yield
-        del self.contexts[-1]
+        self.symbols.enter(context[1])
+        try:
+            yield
+        finally:
+            self.symbols.exit()
+            del self.contexts[-1]
 
     @property
     def symboltable(self):
-        """Return active (innermost) symbol table"""
-        return self.contexts[-1][1]
+        """Symbols of all scopes, which defines symbols in the innermost one"""
+        return self.symbols
 
     def resolve(self, identifier_token):
-        name = identifier_token.value
-        for _, symboltable in reversed(self.contexts):
-            try:
-                return symboltable[name]
-            except KeyError:
-                continue
-        raise KeyError(identifier_token, "Undefined identifier")
+        symbol = self.symbols.lookup(identifier_token.value)
+        if symbol is None:
+            raise KeyError(identifier_token, "Undefined identifier")
+        return symbol
 
-    @singledispatchmethod
+    @dispatchmethod
     def lower(self, parsetree: pt.ParseTree) -> hir.HIR:
         raise NotImplementedError(parsetree)
 
     @lower.register
     def _(self, literal: pt.Literal):
-        return hir.Literal(value=literal.value.value, parsed=literal)
+        return hir.Literal(value=literal.value.value)
 
     @lower.register
     def _(self, identifier: pt.Identifier):
@@ -65,22 +186,74 @@ class LowerParseTree:
 
     @lower.register
     def _(self, operation: pt.Operation):
-        operands = [self.lower(operand) for operand in operation.operands]
-        binary_operators = {
-            "*": (builtins.integer_product, builtins.real_product),
-            "+": (builtins.integer_addition, builtins.real_addition),
-            "/": (builtins.integer_division, builtins.real_division),
-            "-": (builtins.integer_subtraction, builtins.real_subtraction),
-            "==": (builtins.integer_equality, builtins.real_equality),
-            "!=": (builtins.integer_inequality, builtins.real_inequality),
-        }
+        return self.lower_expression(operation)[0]
+
+    @lower.register
+    def _(self, funcall: pt.FunctionCall):
+        return self.lower_expression(funcall)[0]
+
+    def lower_expression(self, expression: pt.Expression) -> Tuple[hir.Expression, tuple]:
+        """
+        Lower an expression with an explicit stack instead of recursion, so
+        that the depth of expressions is not limited by the recursion limit
+
+        The origins of the expression are returned with it: the origin of
+        its first token and the origins of its arguments, if it is a call.
+        """
+        # Lowered subexpressions, whose parents are not lowered yet, and
+        # their origins
+        lowered = []
+        origins = []
+        # Subexpressions to lower, and (lowering method, node, number of
+        # operands) for nodes whose operands are at the end of `lowered`
+        pending = [expression]
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                method, node, count = node
+                start = len(lowered) - count
+                operands = lowered[start:]
+                operand_origins = origins[start:]
+                del lowered[start:], origins[start:]
+                result = method(node, operands)
+                lowered.append(result)
+                origins.append(
+                    call_origins(result, operands, operand_origins, token_origin(node))
+                )
+            elif type(node) is pt.Operation:
+                pending.append((self.lower_operation, node, len(node.operands)))
+                pending.extend(reversed(node.operands))
+            elif type(node) is pt.FunctionCall:
+                pending.append((self.lower_function_call, node, len(node.args)))
+                pending.extend(reversed(node.args))
+            else:
+                lowered.append(self.lower(node))
+                origins.append((token_origin(node), ()))
+        result, = lowered
+        return result, origins[0]
+
+    def lower_located(self, expression: pt.Expression, type_=None):
+        """
+        Lower an expression, converted to a type if given, and its origins,
+        which are recorded by locate
+        """
+        value, origins = self.lower_expression(expression)
+        if type_ is not None:
+            converted = ensure_type(value, type_)
+            if converted is not value:
+                origins = (origins[0], (origins,))
+            value = converted
+        return value, origins
+
+    def locate(self, node, field_name: str, origins: tuple):
+        """Record the origins of the expression in a field of a node"""
+        self.expression_origins.setdefault(node, {})[field_name] = origins
+
+    def lower_operation(self, operation: pt.Operation, operands: List[hir.Expression]):
+        """Lower an operation whose operands are lowered"""
         operator = operation.operator.value
         if len(operands) == 1:
             operand, = operands
-            unary_operators = {
-                "+": (builtins.integer_addition, builtins.real_addition),
-                "-": (builtins.integer_subtraction, builtins.real_subtraction),
-            }
             if operator == '+':
                 return operand
             elif operator == '-':
@@ -94,23 +267,22 @@ class LowerParseTree:
                     raise Exception(operation.operands[0])
             else:
                 raise Exception(operation.operator)
-        if operator in binary_operators:
+        try:
             intfunc, realfunc = binary_operators[operator]
-            if any(operand.type_ == VAType.real for operand in operands):
-                function = realfunc
-                operands = [ensure_type(operand, VAType.real) for operand in operands]
-            else:
-                # TODO: better error messages if mixing with other types
-                assert all(operand.type_ == VAType.integer for operand in operands)
-                function = intfunc
+        except KeyError:
+            raise NotImplementedError(operation.operator) from None
+        if any(operand.type_ == VAType.real for operand in operands):
+            function = realfunc
+            operands = [ensure_type(operand, VAType.real) for operand in operands]
         else:
-            raise NotImplementedError(operation.operator)
+            # TODO: better error messages if mixing with other types
+            assert all(operand.type_ == VAType.integer for operand in operands)
+            function = intfunc
         return hir.FunctionCall(function=function, arguments=tuple(operands))
 
-    @lower.register
-    def _(self, funcall: pt.FunctionCall):
+    def lower_function_call(self, funcall: pt.FunctionCall, arguments: List[hir.Expression]):
+        """Lower a function call whose arguments are lowered"""
         function = self.resolve(funcall.function.name)
-        arguments = [self.lower(arg) for arg in funcall.args]
         if isinstance(function, hir.Accessor):
             assert 1 <= len(arguments) <= 2
             branch, type_ = self.resolve_analog(function, arguments[0], None if len(arguments) == 1 else arguments[1])
@@ -118,13 +290,15 @@ class LowerParseTree:
             function = {'potential': builtins.potential, 'flow': builtins.flow}[type_]
         elif isinstance(function, hir.Function):
             assert len(funcall.args) == len(function.type_.parameters)
+            if id(function) in integer_overloads and all(
+                arg.type_ == VAType.integer for arg in arguments
+            ):
+                function = integer_overloads[id(function)]
             arguments = [
                 ensure_type(arg, type_)
                 for arg, type_ in zip(arguments, function.type_.parameters)
             ]
-        return hir.FunctionCall(
-            function=function, arguments=tuple(arguments), parsed=funcall
-        )
+        return hir.FunctionCall(function=function, arguments=tuple(arguments))
 
     def lower_natures(self, nature_pts: Sequence[pt.Nature]) -> List[hir.Nature]:
         lowered = {}
@@ -179,9 +353,13 @@ class LowerParseTree:
             ret.branches = {(branch.net1.name,branch.net2.name): branch
                     for branch in map(self.lower, module.branches)}
             ret.variables = list(map(self.lower, module.variables))
-            ret.parameters = list(map(self.lower, module.parameters))
-            for x in chain(ret.variables, ret.parameters):
-                self.symboltable.define(x)
+            for variable in ret.variables:
+                self.symboltable.define(variable)
+            # Parameter defaults may refer to the parameters declared before
+            ret.parameters = []
+            for parameter in module.parameters:
+                ret.parameters.append(self.lower(parameter))
+                self.symboltable.define(ret.parameters[-1])
             for branch in ret.branches.values():
                 if branch.name:
                     self.symboltable.define(branch)
@@ -229,43 +407,46 @@ class LowerParseTree:
     @lower.register
     def _(self, variable: pt.Variable):
         if variable.initializer is None:
-            initializer = None
+            initializer = origins = None
         else:
-            initializer = self.lower(variable.initializer)
-        return hir.Variable(
+            initializer, origins = self.lower_located(variable.initializer)
+        ret = hir.Variable(
             name=variable.name.value,
             type_=self.lower_type(variable.type),
             initializer=initializer,
             parsed=variable,
         )
+        if origins is not None:
+            self.locate(ret, "initializer", origins)
+        return ret
 
     @lower.register
     def _(self, parameter: pt.Parameter):
-        initializer = self.lower(parameter.initializer)
-        return hir.Parameter(
+        initializer, origins = self.lower_located(parameter.initializer)
+        ret = hir.Parameter(
             name=parameter.name.value,
             type_=self.lower_type(parameter.type),
             initializer=initializer,
             parsed=parameter,
         )
+        self.locate(ret, "initializer", origins)
+        return ret
 
     @lower.register
     def _(self, assignment: pt.Assignment):
         lvalue = self.resolve(assignment.lvalue)
-        return hir.Assignment(
-            lvalue=lvalue,
-            value=ensure_type(self.lower(assignment.value), lvalue.type_),
-            parsed=assignment,
-        )
+        value, origins = self.lower_located(assignment.value, lvalue.type_)
+        ret = hir.Assignment(lvalue=lvalue, value=value, parsed=assignment)
+        self.locate(ret, "value", origins)
+        return ret
 
     @lower.register
     def _(self, if_: pt.If):
         else_ = self.lower(if_.else_) if if_.else_ is not None else None
-        return hir.If(
-            condition=self.lower(if_.condition),
-            then=self.lower(if_.then),
-            else_=else_,
-        )
+        condition, origins = self.lower_located(if_.condition)
+        ret = hir.If(condition=condition, then=self.lower(if_.then), else_=else_)
+        self.locate(ret, "condition", origins)
+        return ret
 
     def resolve_analog(self, accessor, arg1, net2):
         """
@@ -312,19 +493,54 @@ class LowerParseTree:
         accessor = self.resolve(contribution.accessor)
         net1 = self.resolve(contribution.arg1)
         net2 = None if contribution.arg2 is None else self.resolve(contribution.arg2)
-        value = self.lower(contribution.value)
+        value, origins = self.lower_located(contribution.value)
         branch, type_ = self.resolve_analog(accessor, net1, net2)
-        return hir.AnalogContribution(branch=branch, type_=type_, value=value)
+        ret = hir.AnalogContribution(branch=branch, type_=type_, value=value)
+        self.locate(ret, "value", origins)
+        return ret
 
     @lower.register
     def _(self, sourcefile: pt.SourceFile):
-        ret = hir.SourceFile(parsed=sourcefile)
+        items = chain(sourcefile.natures, sourcefile.disciplines, sourcefile.modules)
+        return self.lower_toplevel(items, parsed=sourcefile)
+
+    def lower_toplevel(
+        self, items: Iterable[pt.ParseTree], parsed: Optional[pt.SourceFile] = None
+    ) -> hir.SourceFile:
+        """
+        Lower the natures, disciplines and modules of a source file, which
+        may be parsed while they are lowered
+
+        Without a parse tree to keep, each item is only referenced until it
+        is lowered.
+        """
+        ret = hir.SourceFile(parsed=parsed if self.locations is None else None)
+        ret.locations = self.locations
+        ret.expression_origins = self.expression_origins = CustomDict(key=id)
+        # Natures refer to each other, they are lowered together
+        natures = []
         with self.push_context((ret, SymbolTable())):
-            for nature in self.lower_natures(sourcefile.natures):
-                self.symboltable.define(nature)
-                self.symboltable.define(nature.access)
-            for discipline in sourcefile.disciplines:
-                self.symboltable.define(self.lower(discipline))
-            for module_pt in sourcefile.modules:
-                ret.modules.append(self.lower(module_pt))
+            for item in chain(items, [None]):
+                if isinstance(item, pt.Nature):
+                    natures.append(item)
+                    continue
+                if natures:
+                    for nature in self.lower_natures(natures):
+                        self.symboltable.define(nature)
+                        self.symboltable.define(nature.access)
+                        self.release_parsed(nature)
+                    natures = []
+                if isinstance(item, pt.Discipline):
+                    discipline = self.lower(item)
+                    self.symboltable.define(discipline)
+                    self.release_parsed(discipline)
+                elif isinstance(item, pt.Module):
+                    ret.modules.append(self.lower(item))
+                    self.release_parsed(ret.modules[-1])
+                # Release the parse tree of the item before parsing the next
+                item = None
         return ret
+
+    def release_parsed(self, node: hir.HIR):
+        if self.locations is not None:
+            release_parsed(node, self.locations)
@@ -105,6 +105,60 @@ operators = {
 }
 
 
+class OperatorStack:
+    """
+    Operands and pending operators of an expression being parsed
+
+    An operator is applied as soon as the following operator does not take
+    precedence over it, which builds the same tree as precedence climbing.
+    """
+
+    def __init__(self):
+        self.operands = []
+        # Pending operators, with whether the colon of ternary operators
+        # was parsed
+        self.operators = []
+        # Number of pending ternary operators waiting for their colon
+        self.open_ternaries = 0
+
+    def apply(self):
+        """Apply the last pending operator to the last operands"""
+        operator, _ = self.operators.pop()
+        count = 3 if operator.type == "TERNARY" else 2
+        operands = self.operands[-count:]
+        del self.operands[-count:]
+        self.operands.append(pt.Operation(operator, operands))
+
+    def push_operator(self, operator):
+        precedence, _ = operators[operator.type]
+        while self.operators:
+            last, colon = self.operators[-1]
+            if last.type == "TERNARY" and not colon:
+                break
+            last_precedence, associativity = operators[last.type]
+            if last_precedence < precedence or (
+                last_precedence == precedence and associativity == "R"
+            ):
+                break
+            self.apply()
+        self.operators.append((operator, False))
+        if operator.type == "TERNARY":
+            self.open_ternaries += 1
+
+    def colon(self):
+        """End the second operand of the innermost open ternary operator"""
+        while self.operators[-1][1] or self.operators[-1][0].type != "TERNARY":
+            self.apply()
+        self.operators[-1] = (self.operators[-1][0], True)
+        self.open_ternaries -= 1
+
+    def result(self):
+        while self.operators:
+            self.apply()
+        result, = self.operands
+        return result
+
+
 class Parser:
     def __init__(self, tokens):
         self.peekiterator = PeekIterator(tokens)
@@ -134,57 +188,76 @@ class Parser:
     def next(self):
         return next(self.peekiterator)
 
-    def expression(self, min_precedence=-1):
-        if self.peek_type() in unary_operators:
-            operator = self.next()
-            result = pt.Operation(operator, [self.expression_primary()])
-        else:
-            result = self.expression_primary()
+    def expression(self):
+        """
+        Parse an expression by operator precedence
+
+        Parenthesized expressions and function arguments are parsed with an
+        explicit stack instead of recursion, so that long or deeply nested
+        expressions (e.g. generated polynomial fits) do not reach the
+        recursion limit.
+        """
+        # Expressions enclosing the current one: their operators, the unary
+        # operator before the parenthesis or call, and the function called
+        # with the arguments parsed so far, or None for parentheses
+        enclosing = []
+        current = OperatorStack()
         while True:
-            if self.eof():
-                return result
-            operator = self.peek()
-            type_ = operator.type
-            if type_ not in operators or operators[type_][0] < min_precedence:
-                return result
-            self.next()
-            precedence, associativity = operators[operator.type]
-            child_min_precedence = (
-                precedence + 1 if associativity == "L" else precedence
-            )
-            operands = [
-                result,
-                self.expression(min_precedence=child_min_precedence),
-            ]
-            if type_ == "TERNARY":
-                self.expect_type("COLON", "separating ternary expression arguments")
-                operands.append(self.expression(min_precedence=child_min_precedence))
-            result = pt.Operation(operator, operands)
-
-    def expression_primary(self):
-        tok = self.next()
-        if tok.type == "LPAREN":
-            ret = self.expression()
-            self.expect_type("RPAREN", "to close parenthesized expression")
-            return ret
-        if tok.type in ("REAL_NUMBER", "UNSIGNED_NUMBER", "STRING_LITERAL"):
-            return pt.Literal(tok)
-        if tok.type in ("SIMPLE_IDENTIFIER", "SYSTEM_IDENTIFIER") + BUILTIN_FUNCTIONS:
-            id_ = pt.Identifier(tok)
-            if self.eof() or self.peek_type() != "LPAREN":
-                return id_
-            # Function call, eat LPAREN
-            self.next()
-            arguments = []
-            while self.peek_type() != "RPAREN":
-                arguments.append(self.expression())
-                if self.peek_type() == "RPAREN":
+            unary = None
+            if self.peek_type() in unary_operators:
+                unary = self.next()
+            tok = self.next()
+            if tok.type == "LPAREN":
+                enclosing.append((current, unary, None))
+                current = OperatorStack()
+                continue
+            if tok.type in ("REAL_NUMBER", "UNSIGNED_NUMBER", "STRING_LITERAL"):
+                primary = pt.Literal(tok)
+            elif tok.type in ("SIMPLE_IDENTIFIER", "SYSTEM_IDENTIFIER") + BUILTIN_FUNCTIONS:
+                primary = pt.Identifier(tok)
+                if not self.eof() and self.peek_type() == "LPAREN":
+                    # Function call, eat LPAREN
+                    self.next()
+                    if self.peek_type() != "RPAREN":
+                        enclosing.append((current, unary, (primary, [])))
+                        current = OperatorStack()
+                        continue
+                    self.next()
+                    primary = pt.FunctionCall(function=primary, args=[])
+            else:
+                self.fail("Expected expression primary")
+            # Operators after the primary, and the ends of the expressions
+            # it closes
+            while True:
+                if unary is not None:
+                    primary = pt.Operation(unary, [primary])
+                current.operands.append(primary)
+                type_ = None if self.eof() else self.peek_type()
+                if type_ in operators:
+                    current.push_operator(self.next())
                     break
-                self.expect_type("COMMA", "separating function arguments")
-            self.next()
-
-            return pt.FunctionCall(function=id_, args=arguments)
-        self.fail("Expected expression primary")
+                if current.open_ternaries:
+                    self.expect_type("COLON", "separating ternary expression arguments")
+                    current.colon()
+                    break
+                result = current.result()
+                if not enclosing:
+                    return result
+                current, unary, call = enclosing.pop()
+                if call is None:
+                    self.expect_type("RPAREN", "to close parenthesized expression")
+                    primary = result
+                    continue
+                function, arguments = call
+                arguments.append(result)
+                if self.peek_type() != "RPAREN":
+                    self.expect_type("COMMA", "separating function arguments")
+                if self.peek_type() != "RPAREN":
+                    enclosing.append((current, unary, call))
+                    current = OperatorStack()
+                    break
+                self.next()
+                primary = pt.FunctionCall(function=function, args=arguments)
 
     def nature(self):
         self.expect_type("NATURE")
@@ -569,22 +642,32 @@ class Parser:
         return pt.Branch(name=name, nets=nets)
 
 
-    def sourcefile(self):
-        sourcefile = pt.SourceFile()
+    def toplevel(self):
+        """Parse the natures, disciplines and modules of a source file one by one"""
         while True:
             try:
                 tok = self.peek()
             except StopIteration:
-                break
+                return
             if tok.type == "MODULE":
-                sourcefile.modules.append(self.module())
+                yield self.module()
             elif tok.type == "NATURE":
-                sourcefile.natures.append(self.nature())
+                yield self.nature()
             elif tok.type == "DISCIPLINE":
-                sourcefile.disciplines.append(self.discipline())
+                yield self.discipline()
             else:
                 self.next()
                 self.fail("Expected module, nature or discipline while parsing sourcefile")
+
+    def sourcefile(self):
+        sourcefile = pt.SourceFile()
+        for item in self.toplevel():
+            if isinstance(item, pt.Module):
+                sourcefile.modules.append(item)
+            elif isinstance(item, pt.Nature):
+                sourcefile.natures.append(item)
+            else:
+                sourcefile.disciplines.append(item)
         return sourcefile
 
 
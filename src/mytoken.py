@@ -5,7 +5,7 @@ import os
 FileLocation = Tuple[Optional[str], int, int]
 
 
-@dataclass
+@dataclass(slots=True)
 class MyToken:
     type: str
     value: str | int | float
@@ -0,0 +1,174 @@
+"""
+Lower and compile the modules of a source file in parallel
+
+Library files contain many modules, which are independent once the natures
+and disciplines are lowered. Each module is lowered and its code generated
+in a pool of processes, together with the natures and disciplines, and the
+LLVM IR is compiled in a pool of threads, each module with an execution
+engine of its own (see compiler.jit_compile). With a single process, the
+code is generated in this one while the threads compile:
+
+    modules = compile_source(filename="library.va", include_path=["include"])
+    modules["resistor"].run_analog()
+
+The profiles of the processes and threads are added to the active profile,
+if any, so the stage times are summed over them.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import chain
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Mapping, Optional
+import os
+from codegen import CodegenContext
+from compile_module import CompiledModule, ModuleGlobals
+from compiler import initialize_llvm, ir_text, jit_compile
+from constant_evaluation import evaluate_parameters
+from lower_parsetree import LowerParseTree
+from manual_parser import Parser
+from parser_interface import preprocess_source
+from profiling import Profile, merge, stage
+from symboltable import SymbolTable
+from vabuiltins import builtins
+import parsetree as pt
+
+
+@dataclass
+class GeneratedModule:
+    """Code generated for a module by a worker process"""
+
+    name: str
+    llvm_ir: str
+    globals_: ModuleGlobals
+    # Value of the initializer of each parameter
+    parameter_defaults: dict[str, float]
+    profile: Profile
+
+
+# Source file compiled by a worker process: the parse trees of its natures
+# and disciplines and of its modules, and the options for CodegenContext
+worker_source = None
+
+
+def init_worker(prelude: list[pt.ParseTree], modules: list[pt.Module], options: dict):
+    """
+    Initialize a worker process with the source file to compile
+
+    Forked processes inherit the arguments instead of unpickling them, which
+    takes longer than lowering the parse trees.
+    """
+    global worker_source
+    worker_source = prelude, modules, options
+
+
+def generate_module(index: int) -> GeneratedModule:
+    """
+    Lower a module of the source file of the worker, after its natures and
+    disciplines, and generate its code
+    """
+    prelude, modules, options = worker_source
+    module = modules[index]
+    with Profile() as profile:
+        contexts = [(None, SymbolTable(builtins.symbols.values()))]
+        with stage("lower"):
+            sourcefile = LowerParseTree(contexts=contexts).lower_toplevel(
+                chain(prelude, [module])
+            )
+        module, = sourcefile.modules
+        codegen = CodegenContext.module_to_llvm_module_ir(module, **options)
+        llvm_ir = ir_text(codegen.irmodule)
+        defaults = evaluate_parameters(module.parameters)
+        globals_ = ModuleGlobals.from_codegen(codegen)
+    return GeneratedModule(
+        name=module.name,
+        llvm_ir=llvm_ir,
+        globals_=globals_,
+        # Parameters compiled as constants have no global
+        parameter_defaults={
+            parameter.name: value
+            for parameter, value in defaults.items()
+            if parameter.name in globals_.parameters
+        },
+        profile=profile,
+    )
+
+
+def generate_modules(
+    prelude: list[pt.ParseTree], modules: list[pt.Module], options: dict, processes: int
+) -> Iterator[GeneratedModule]:
+    """
+    Generate the code of modules in worker processes, or in this process
+    when there is only one, yielding them as they are done
+    """
+    if processes == 1:
+        init_worker(prelude, modules, options)
+        try:
+            yield from map(generate_module, range(len(modules)))
+        finally:
+            init_worker(None, None, None)
+        return
+    with ProcessPoolExecutor(
+        processes, initializer=init_worker, initargs=(prelude, modules, options)
+    ) as pool:
+        generating = [pool.submit(generate_module, index) for index in range(len(modules))]
+        for future in as_completed(generating):
+            yield future.result()
+
+
+def timed_jit_compile(llvm_ir: str):
+    """Engine which compiled the IR, and the seconds it took"""
+    start = perf_counter()
+    engine = jit_compile(llvm_ir)
+    return engine, perf_counter() - start
+
+
+def compile_modules(
+    sourcefile: pt.SourceFile,
+    processes: Optional[int] = None,
+    threads: Optional[int] = None,
+    **options,
+) -> dict[str, CompiledModule]:
+    """
+    Lower and compile the modules of a parsed source file in parallel, with
+    options for CodegenContext
+
+    The numbers of processes and threads default to the number of CPUs, and
+    the compiled modules are returned by name in the order of the source.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    prelude = [*sourcefile.natures, *sourcefile.disciplines]
+    modules = sourcefile.modules
+    compiled = dict.fromkeys(module.name.value for module in modules)
+    initialize_llvm()
+    with ThreadPoolExecutor(threads) as jit_pool:
+        # Modules are compiled while the others are generated
+        compiling = {}
+        for generated in generate_modules(prelude, modules, options, processes):
+            merge(generated.profile)
+            compiling[jit_pool.submit(timed_jit_compile, generated.llvm_ir)] = generated
+        for future, generated in compiling.items():
+            engine, seconds = future.result()
+            merge(Profile(times={"llvm compile": seconds}, calls={"llvm compile": 1}))
+            module = CompiledModule.from_globals(generated.globals_, engine)
+            for name, value in generated.parameter_defaults.items():
+                module.parameters[name] = value
+            compiled[generated.name] = module
+    return compiled
+
+
+def compile_source(
+    content: Optional[str] = None,
+    filename: Optional[str] = None,
+    include_path: Optional[list[Path | str]] = None,
+    defines: Optional[Mapping[str, str]] = None,
+    processes: Optional[int] = None,
+    threads: Optional[int] = None,
+    **options,
+) -> dict[str, CompiledModule]:
+    """Lex, preprocess and parse a source, and compile its modules in parallel"""
+    tokens = preprocess_source(content, filename, include_path, defines)
+    with stage("parse"):
+        sourcefile = Parser(tokens).sourcefile()
+    return compile_modules(sourcefile, processes, threads, **options)
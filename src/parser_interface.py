@@ -3,42 +3,149 @@ from pathlib import Path
 from lower_parsetree import LowerParseTree
 from lexer import lex
 from manual_parser import Parser, ParseMethod
-from preprocessor import VerilogAPreprocessor
-from typing import Optional, List
-from parsetree import ParseTree
+from preprocessor import VerilogAPreprocessor, command_line_definitions
+from typing import Iterator, Optional, List, Mapping
+import parsetree as pt
+from customdict import CustomDict
 from mytoken import MyToken
 from hir import HIR
 from symboltable import SymbolTable
 from vabuiltins import builtins
+from profiling import Profile, stage, count, enabled, count_nodes
 
 
-def parse_source(
+def preprocess_source(
     content: Optional[str] = None,
     filename: Optional[str] = None,
-    method: Optional[ParseMethod] = None,
     include_path: Optional[list[Path|str]] = None,
-) -> HIR:
-    """Lex, preprocess, parse and lower"""
+    defines: Optional[Mapping[str, str]] = None,
+    included_files: Optional[list[Path]] = None,
+) -> List[MyToken]:
+    """
+    Lex and preprocess, with macros predefined as in `defines`
+
+    The files included are appended to `included_files`, if given.
+    """
     if include_path is None:
         include_path = []
-    tokens = list(VerilogAPreprocessor(lex(content=content, filename=filename), include_path=include_path))
-    if method is None:
-        method = Parser.sourcefile
-    parser = Parser(tokens)
-    parsetree = method(parser)
-    print(parsetree)
+    definitions = command_line_definitions(defines or {})
+    with stage("lex"):
+        tokens = list(lex(content=content, filename=filename))
+    with stage("preprocess"):
+        tokens = list(
+            VerilogAPreprocessor(
+                iter(tokens),
+                definitions=definitions,
+                include_path=include_path,
+                included_files=included_files,
+            )
+        )
+    count("tokens preprocessed", len(tokens))
+    return tokens
+
+
+def consume(tokens: List[MyToken]) -> Iterator[MyToken]:
+    """Iterate over tokens, removing them from the list"""
+    tokens.reverse()
+    while tokens:
+        yield tokens.pop()
+
+
+def parse_items(parser: Parser) -> Iterator[pt.ParseTree]:
+    """Parse the top level items of a source file one at a time"""
+    items = parser.toplevel()
+    while True:
+        with stage("parse"):
+            item = next(items, None)
+        if item is None:
+            return
+        if enabled():
+            count("parse tree nodes", count_nodes(item, ignore=(MyToken,)))
+        yield item
+
+
+def parse_tokens(
+    tokens: List[MyToken],
+    method: Optional[ParseMethod] = None,
+    release_parse_tree: bool = False,
+) -> HIR:
+    """
+    Parse and lower
+
+    With `release_parse_tree`, a source file is parsed and lowered one
+    module at a time, and the HIR keeps the origin of its nodes in the
+    `locations` of the SourceFile instead of parse trees. The tokens are
+    removed from `tokens` as they are parsed.
+    """
     contexts = [(None, SymbolTable(builtins.symbols.values()))]
-    hir = LowerParseTree(contexts=contexts).lower(parsetree)
+    if release_parse_tree:
+        if method is not None:
+            raise ValueError("Parse trees are only released when parsing source files")
+        lowerer = LowerParseTree(contexts=contexts, locations=CustomDict(key=id))
+        with stage("lower"):
+            hir = lowerer.lower_toplevel(parse_items(Parser(consume(tokens))))
+    else:
+        if method is None:
+            method = Parser.sourcefile
+        with stage("parse"):
+            parser = Parser(tokens)
+            parsetree = method(parser)
+        if enabled():
+            count("parse tree nodes", count_nodes(parsetree, ignore=(MyToken,)))
+        with stage("lower"):
+            hir = LowerParseTree(contexts=contexts).lower(parsetree)
+    if enabled():
+        count("HIR nodes", count_nodes(hir))
     return hir
 
 
+def parse_source(
+    content: Optional[str] = None,
+    filename: Optional[str] = None,
+    method: Optional[ParseMethod] = None,
+    include_path: Optional[list[Path|str]] = None,
+    defines: Optional[Mapping[str, str]] = None,
+    release_parse_tree: bool = False,
+) -> HIR:
+    """Lex, preprocess, parse and lower, see parse_tokens for `release_parse_tree`"""
+    tokens = preprocess_source(content, filename, include_path, defines)
+    return parse_tokens(tokens, method, release_parse_tree)
+
+
+def parse_defines(options: Optional[List[str]]) -> dict[str, str]:
+    """Macro definitions from `name=value` or `name` command line options"""
+    defines = {}
+    for option in options or []:
+        name, _, value = option.partition("=")
+        defines[name] = value
+    return defines
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument("veriloga")
     parser.add_argument("-I", action="append")
+    parser.add_argument("-D", action="append", help="define a macro, name or name=value")
+    parser.add_argument("--compile", action="store_true", help="compile the modules too")
+    parser.add_argument("--profile", action="store_true", help="print time spent per stage")
+    parser.add_argument("--profile-json", help="write the profile to a JSON file")
     args = parser.parse_args()
-    print(parse_source(filename=args.veriloga, include_path=args.I))
+    with Profile() as profile:
+        hir = parse_source(filename=args.veriloga, include_path=args.I, defines=parse_defines(args.D))
+        if args.compile:
+            # Imported here because it loads llvmlite, which takes longer than parsing
+            from compile_module import CompiledModule
+
+            for module in hir.modules:
+                CompiledModule.from_hir(module)
+    # The parse trees are as deep as the expressions, their repr would
+    # exceed the recursion limit
+    print(hir.strip_parsed())
     print("OK")
+    if args.profile:
+        print(profile.report())
+    if args.profile_json is not None:
+        profile.write_json(args.profile_json)
 
 
 if __name__ == "__main__":
@@ -1,74 +1,74 @@
 from __future__ import annotations
 from typing import List, Union, Optional
 from mytoken import MyToken
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, is_dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Identifier:
     name: MyToken
 
 
-@dataclass
+@dataclass(slots=True)
 class FunctionCall:
     function: MyToken
     args: List[Expression]
 
 
-@dataclass
+@dataclass(slots=True)
 class Literal:
     value: MyToken
 
 
-@dataclass
+@dataclass(slots=True)
 class Operation:
     operator: MyToken
     operands: List[Expression]
 
 
-@dataclass
+@dataclass(slots=True)
 class Nature:
     name: MyToken
     attributes: List[NatureAttribute]
 
 
-@dataclass
+@dataclass(slots=True)
 class NatureAttribute:
     name: MyToken
     value: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class Discipline:
     name: MyToken
     attributes: List[DisciplineAttribute]
 
 
-@dataclass
+@dataclass(slots=True)
 class DisciplineAttribute:
     name: MyToken
     value: MyToken
 
 
-@dataclass
+@dataclass(slots=True)
 class Port:
     name: MyToken
     direction: MyToken
 
 
-@dataclass
+@dataclass(slots=True)
 class Net:
     name: MyToken
     discipline: MyToken
 
 
-@dataclass
+@dataclass(slots=True)
 class Branch:
     name: MyToken
     nets: List[MyToken]
 
 
-@dataclass
+@dataclass(slots=True)
 class Module:
     name: MyToken
     ports: List[Port] = field(default_factory=list)
@@ -79,13 +79,13 @@ class Module:
     parameters: List[Parameter] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class Assignment:
     lvalue: MyToken
     value: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class AnalogContribution:
     accessor: MyToken
     arg1: MyToken
@@ -93,28 +93,28 @@ class AnalogContribution:
     value: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class Block:
     statements: List[Statement]
     name: Optional[MyToken] = None
     declarations: Optional[List[Variable]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class If:
     condition: Expression
     then: Statement
     else_: Optional[Statement]
 
 
-@dataclass
+@dataclass(slots=True)
 class Variable:
     name: MyToken
     type: MyToken
     initializer: Optional[Expression]
 
 
-@dataclass
+@dataclass(slots=True)
 class Parameter:
     name: MyToken
     type: MyToken
@@ -122,19 +122,19 @@ class Parameter:
     # TODO: include/exclude ranges
 
 
-@dataclass
+@dataclass(slots=True)
 class CaseItem:
     expr: Optional[List[Expression]]
     statement: Statement
 
 
-@dataclass
+@dataclass(slots=True)
 class Case:
     expr: Expression
     items: CaseItem
 
 
-@dataclass
+@dataclass(slots=True)
 class ForLoop:
     initial: Assignment
     condition: Expression
@@ -142,7 +142,7 @@ class ForLoop:
     statement: Statement
 
 
-@dataclass
+@dataclass(slots=True)
 class SourceFile:
     natures: List[Nature] = field(default_factory=list)
     disciplines: List[Discipline] = field(default_factory=list)
@@ -171,3 +171,20 @@ ParseTree = Union[
     Variable,
     SourceFile,
 ]
+
+
+def first_token(node) -> Optional[MyToken]:
+    """First token of a parse tree node, in the order of its fields"""
+    if isinstance(node, MyToken):
+        return node
+    if isinstance(node, list):
+        items = node
+    elif is_dataclass(node):
+        items = [getattr(node, f.name) for f in fields(node)]
+    else:
+        return None
+    for item in items:
+        token = first_token(item)
+        if token is not None:
+            return token
+    return None
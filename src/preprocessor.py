@@ -1,11 +1,13 @@
 import os
 import re
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Iterator, Mapping, Optional, Union, Tuple, cast
 from dataclasses import dataclass, replace
 from itertools import takewhile, count, chain
 from lexer import lex, TokenSource
 from mytoken import MyToken, FileLocation
+import profiling
 
 
 @dataclass
@@ -34,12 +36,48 @@ class Macro:
 Definitions = Mapping[str, Macro]
 
 
+def command_line_definitions(defines: Mapping[str, str]) -> Definitions:
+    """Macros like those defined by `-D name=value` compiler options"""
+    return {
+        name: Macro(
+            parameters=[],
+            body=[tok for tok in lex(content=value) if tok.type != "NEWLINE"],
+        )
+        for name, value in defines.items()
+    }
+
+
+# Contents and tokens of the included files lexed last, by file name, least
+# recently used first
+lexed_files: OrderedDict[Path, tuple[str, list[MyToken]]] = OrderedDict()
+# Files kept in lexed_files, so that a long running process which compiles
+# many different files does not keep all their tokens
+max_lexed_files = 64
+
+
+def lex_file(filename: Path) -> list[MyToken]:
+    """Tokens of a file, lexed again only if its contents changed"""
+    content = filename.read_text()
+    cached = lexed_files.get(filename)
+    if cached is not None and cached[0] == content:
+        profiling.count("include cache hits")
+        lexed_files.move_to_end(filename)
+        return cached[1]
+    tokens = list(lex(filename=filename, content=content))
+    lexed_files[filename] = (content, tokens)
+    lexed_files.move_to_end(filename)
+    while len(lexed_files) > max_lexed_files:
+        lexed_files.popitem(last=False)
+    return tokens
+
+
 class VerilogAPreprocessor:
     def __init__(
         self,
         source: TokenSource,
         definitions: Optional[Definitions] = None,
-        include_path: Optional[list[str|Path]] = None
+        include_path: Optional[list[str|Path]] = None,
+        included_files: Optional[list[Path]] = None,
     ):
         self.input_iterator = self.input_generator(source)
         self.output_iterator = self.output_generator()
@@ -51,6 +89,11 @@ class VerilogAPreprocessor:
             self.include_path = []
         else:
             self.include_path = [Path(p) for p in include_path]
+        # Files included so far, shared with nested preprocessors
+        if included_files is None:
+            self.included_files: list[Path] = []
+        else:
+            self.included_files = included_files
 
     def __iter__(self):
         return self.output_iterator
@@ -136,9 +179,12 @@ class VerilogAPreprocessor:
         name = cast(str, self.last_token.value)[1:]
         origin = self.last_token.origin
         macro = self.definitions[name]
+        profiling.count("macros expanded")
         arguments = list(self.consume_macrocall_arguments(len(macro.parameters)))
         yield from VerilogAPreprocessor(
-            source=macro.expand(arguments, origin), definitions=self.definitions
+            source=macro.expand(arguments, origin),
+            definitions=self.definitions,
+            included_files=self.included_files,
         )
 
     def expect(self, type_: str, why, last_token=False):
@@ -193,7 +239,9 @@ class VerilogAPreprocessor:
 
     def find_file(self, f: str) -> Path:
         parentfile = self.last_token.origin[-1][0]
-        for dirname in chain([Path(parentfile).parent], self.include_path):
+        # Sources given as content have no directory to search
+        dirnames = [] if parentfile is None else [Path(parentfile).parent]
+        for dirname in chain(dirnames, self.include_path):
             ret = dirname / f
             if ret.exists():
                 return ret
@@ -201,4 +249,12 @@ class VerilogAPreprocessor:
 
     def include(self):
         filename = self.find_file(self.expect("STRING_LITERAL", "include").value)
-        yield from VerilogAPreprocessor(lex(filename=filename), definitions=self.definitions)
+        self.included_files.append(filename)
+        profiling.count("files included")
+        with profiling.stage("lex"):
+            tokens = lex_file(filename)
+        yield from VerilogAPreprocessor(
+            iter(tokens),
+            definitions=self.definitions,
+            included_files=self.included_files,
+        )
@@ -0,0 +1,141 @@
+"""
+Timing and counting instrumentation of the compile pipeline
+
+The pipeline marks its stages with `with stage("parse"): ...` and counts
+things with `count("tokens lexed", n)`. Both do nothing unless a Profile is
+active:
+
+    with Profile() as profile:
+        parse_source(...)
+    print(profile.report())
+
+The time of a stage excludes the stages nested in it, e.g. lexing included
+files while preprocessing, so the stage times add up to the total.
+Profiles of other processes can be added with `merge`, the times are then
+summed over the processes.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, is_dataclass
+from time import perf_counter
+from typing import Optional
+
+active: Optional["Profile"] = None
+
+
+@dataclass
+class Profile:
+    # Exclusive seconds spent in each stage
+    times: dict[str, float] = field(default_factory=dict)
+    # Number of times each stage was entered
+    calls: dict[str, int] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+    # Stages being timed: [name, start, time spent in nested stages]
+    _stack: list = field(default_factory=list, repr=False)
+    _previous: Optional["Profile"] = field(default=None, repr=False)
+
+    def __enter__(self):
+        global active
+        self._previous = active
+        active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self._previous
+        self._previous = None
+
+    def enter(self, name):
+        self._stack.append([name, perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, nested = self._stack.pop()
+        elapsed = perf_counter() - start
+        self.times[name] = self.times.get(name, 0.0) + elapsed - nested
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: "Profile"):
+        """Add the times, calls and counters of a profile, e.g. of another process"""
+        for mine, theirs in [
+            (self.times, other.times),
+            (self.calls, other.calls),
+            (self.counters, other.counters),
+        ]:
+            for name, value in theirs.items():
+                mine[name] = mine.get(name, 0) + value
+
+    def as_dict(self):
+        return {"times": self.times, "calls": self.calls, "counters": self.counters}
+
+    def write_json(self, filename):
+        # Imported here so that importing the pipeline does not load json
+        import json
+        with open(filename, "w") as fd:
+            json.dump(self.as_dict(), fd, indent=2)
+
+    def report(self) -> str:
+        """Per-stage breakdown followed by the counters"""
+        total = sum(self.times.values())
+        lines = [f"{'stage':20}{'seconds':>10}{'%':>7}{'calls':>7}"]
+        for name, seconds in sorted(self.times.items(), key=lambda item: -item[1]):
+            percent = 100 * seconds / total if total else 0.0
+            lines.append(f"{name:20}{seconds:10.4f}{percent:7.1f}{self.calls[name]:7}")
+        lines.append(f"{'total':20}{total:10.4f}")
+        for name, value in self.counters.items():
+            lines.append(f"{name:20}{value:10}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the pipeline in the active profile, if any"""
+    profile = active
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def count(name, n=1):
+    """Increment a counter of the active profile, if any"""
+    if active is not None:
+        active.count(name, n)
+
+
+def merge(profile: Profile):
+    """Add a profile, e.g. of another process, to the active profile, if any"""
+    if active is not None:
+        active.merge(profile)
+
+
+def enabled() -> bool:
+    """Whether there is an active profile, to skip computing expensive counts"""
+    return active is not None
+
+
+def count_nodes(root, ignore=(), ignore_fields=("parsed",)) -> int:
+    """Number of distinct dataclass instances reachable from root"""
+    seen = set()
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (list, tuple)):
+            pending.extend(node)
+        elif isinstance(node, dict):
+            pending.extend(node.values())
+        elif is_dataclass(node) and not isinstance(node, (type, *ignore)):
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            pending.extend(
+                getattr(node, f.name) for f in fields(node) if f.name not in ignore_fields
+            )
+    return len(seen)
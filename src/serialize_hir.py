@@ -0,0 +1,368 @@
+"""
+Compact binary serialization of lowered HIR
+
+Lowering can be done once and its result shipped to where the code is
+generated, e.g. with CPU specific options:
+
+    data = serialize_hir.dumps(parse_source(source))
+    sourcefile = serialize_hir.loads(data)
+
+The nodes reachable from the serialized one are written as a flat array of
+records, each one referring to the nodes it contains by their index in the
+array, so shared nodes (symbols, interned expressions) are written once and
+loading is a single loop over the records. Builtins are referred to by
+name, so the loaded expressions use the builtins of the loading process.
+The records are encoded with marshal after a header with the format version.
+
+Parse trees and source locations are not serialized, and loaded symbols get
+new uids.
+"""
+import marshal
+import struct
+import hir
+from dispatch import dispatchmethod
+from vabuiltins import builtins
+from verilogatypes import VAType
+
+MAGIC = b"VAHIR"
+# Incremented when the records change
+VERSION = 1
+header = struct.Struct("<H")
+
+# Kinds of records, their first item
+(
+    BUILTIN,
+    LITERAL,
+    CALL,
+    NATURE,
+    ACCESSOR,
+    DISCIPLINE,
+    NET,
+    PORT,
+    BRANCH,
+    VARIABLE,
+    PARAMETER,
+    ASSIGNMENT,
+    BLOCK,
+    IF,
+    CONTRIBUTION,
+    MODULE,
+    SOURCEFILE,
+) = range(17)
+
+builtin_names = {id(symbol): name for name, symbol in builtins.symbols.items()}
+
+
+class Writer:
+    """Records of the nodes reachable from the written ones"""
+
+    def __init__(self):
+        self.records = []
+        # Index of the record of each node, by id
+        self.indices = {}
+        # Natures and the indices of the access, idt_nature and ddt_nature
+        # they refer to, which may refer back to them
+        self.fixups = []
+
+    def index(self, node) -> int:
+        """Index of the record of a node, written if it is not yet"""
+        if node is None:
+            return None
+        index = self.indices.get(id(node))
+        if index is None:
+            name = builtin_names.get(id(node))
+            if name is not None:
+                index = self.add(node, (BUILTIN, name))
+            else:
+                if type(node) is hir.FunctionCall:
+                    self.write_arguments(node)
+                index = self.write(node)
+        return index
+
+    def indices_of(self, nodes) -> tuple:
+        return tuple(map(self.index, nodes))
+
+    def add(self, node, record) -> int:
+        index = self.indices[id(node)] = len(self.records)
+        self.records.append(record)
+        return index
+
+    def write_arguments(self, call: hir.FunctionCall):
+        """Write the nested calls of a call, innermost first, without recursion"""
+        stack = [call]
+        while stack:
+            node = stack[-1]
+            pending = [
+                argument
+                for argument in node.arguments
+                if type(argument) is hir.FunctionCall and id(argument) not in self.indices
+            ]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if node is not call and id(node) not in self.indices:
+                self.write(node)
+
+    @dispatchmethod
+    def write(self, node) -> int:
+        raise TypeError(f"Cannot serialize {node!r}")
+
+    @write.register
+    def _(self, literal: hir.Literal):
+        return self.add(literal, (LITERAL, literal.value, literal.type_.name))
+
+    @write.register
+    def _(self, call: hir.FunctionCall):
+        record = (CALL, self.index(call.function), self.indices_of(call.arguments))
+        return self.add(call, record)
+
+    @write.register
+    def _(self, nature: hir.Nature):
+        index = self.add(nature, (NATURE, nature.name, nature.abstol, nature.units))
+        related = (nature.access, nature.idt_nature, nature.ddt_nature)
+        self.fixups.append((index, *self.indices_of(related)))
+        return index
+
+    @write.register
+    def _(self, accessor: hir.Accessor):
+        return self.add(accessor, (ACCESSOR, accessor.name, self.index(accessor.nature)))
+
+    @write.register
+    def _(self, discipline: hir.Discipline):
+        record = (
+            DISCIPLINE,
+            discipline.name,
+            discipline.domain,
+            self.index(discipline.potential),
+            self.index(discipline.flow),
+        )
+        return self.add(discipline, record)
+
+    @write.register
+    def _(self, net: hir.Net):
+        return self.add(net, (NET, net.name, self.index(net.discipline)))
+
+    @write.register
+    def _(self, port: hir.Port):
+        return self.add(port, (PORT, port.name, port.direction))
+
+    @write.register
+    def _(self, branch: hir.Branch):
+        record = (BRANCH, branch.name, self.index(branch.net1), self.index(branch.net2))
+        return self.add(branch, record)
+
+    @write.register
+    def _(self, variable: hir.Variable):
+        record = (
+            VARIABLE,
+            variable.name,
+            variable.type_.name,
+            self.index(variable.initializer),
+        )
+        return self.add(variable, record)
+
+    @write.register
+    def _(self, parameter: hir.Parameter):
+        record = (
+            PARAMETER,
+            parameter.name,
+            parameter.type_.name,
+            self.index(parameter.initializer),
+        )
+        return self.add(parameter, record)
+
+    @write.register
+    def _(self, assignment: hir.Assignment):
+        record = (ASSIGNMENT, self.index(assignment.lvalue), self.index(assignment.value))
+        return self.add(assignment, record)
+
+    @write.register
+    def _(self, block: hir.Block):
+        return self.add(block, (BLOCK, self.indices_of(block.statements)))
+
+    @write.register
+    def _(self, if_: hir.If):
+        record = (IF, self.index(if_.condition), self.index(if_.then), self.index(if_.else_))
+        return self.add(if_, record)
+
+    @write.register
+    def _(self, contribution: hir.AnalogContribution):
+        record = (
+            CONTRIBUTION,
+            self.index(contribution.branch),
+            self.index(contribution.value),
+            contribution.type_,
+        )
+        return self.add(contribution, record)
+
+    @write.register
+    def _(self, module: hir.Module):
+        branches = tuple(
+            (*key, self.index(branch)) for key, branch in module.branches.items()
+        )
+        record = (
+            MODULE,
+            module.name,
+            self.indices_of(module.ports),
+            self.indices_of(module.nets),
+            branches,
+            self.indices_of(module.parameters),
+            self.indices_of(module.variables),
+            self.indices_of(module.statements),
+        )
+        return self.add(module, record)
+
+    @write.register
+    def _(self, sourcefile: hir.SourceFile):
+        return self.add(sourcefile, (SOURCEFILE, self.indices_of(sourcefile.modules)))
+
+
+def dumps(node) -> bytes:
+    """Serialize a HIR node, usually a source file or a module"""
+    writer = Writer()
+    root = writer.index(node)
+    body = marshal.dumps((writer.records, writer.fixups, root))
+    return MAGIC + header.pack(VERSION) + body
+
+
+def read_optional(nodes, index):
+    return None if index is None else nodes[index]
+
+
+def read_builtin(record, nodes):
+    return builtins[record[1]]
+
+
+def read_literal(record, nodes):
+    return hir.Literal(record[1], VAType[record[2]])
+
+
+def read_call(record, nodes):
+    return hir.FunctionCall(nodes[record[1]], tuple(nodes[index] for index in record[2]))
+
+
+def read_nature(record, nodes):
+    _, name, abstol, units = record
+    return hir.Nature(name=name, abstol=abstol, units=units)
+
+
+def read_accessor(record, nodes):
+    return hir.Accessor(record[1], nodes[record[2]])
+
+
+def read_discipline(record, nodes):
+    _, name, domain, potential, flow = record
+    return hir.Discipline(
+        name=name,
+        domain=domain,
+        potential=read_optional(nodes, potential),
+        flow=read_optional(nodes, flow),
+    )
+
+
+def read_net(record, nodes):
+    return hir.Net(name=record[1], discipline=read_optional(nodes, record[2]))
+
+
+def read_port(record, nodes):
+    return hir.Port(name=record[1], direction=record[2])
+
+
+def read_branch(record, nodes):
+    _, name, net1, net2 = record
+    return hir.Branch(name=name, net1=nodes[net1], net2=read_optional(nodes, net2))
+
+
+def read_variable(record, nodes):
+    _, name, type_, initializer = record
+    return hir.Variable(
+        name=name, type_=VAType[type_], initializer=read_optional(nodes, initializer)
+    )
+
+
+def read_parameter(record, nodes):
+    _, name, type_, initializer = record
+    return hir.Parameter(
+        name=name, type_=VAType[type_], initializer=read_optional(nodes, initializer)
+    )
+
+
+def read_assignment(record, nodes):
+    return hir.Assignment(lvalue=nodes[record[1]], value=nodes[record[2]])
+
+
+def read_block(record, nodes):
+    return hir.Block(statements=[nodes[index] for index in record[1]])
+
+
+def read_if(record, nodes):
+    _, condition, then, else_ = record
+    return hir.If(
+        condition=nodes[condition], then=nodes[then], else_=read_optional(nodes, else_)
+    )
+
+
+def read_contribution(record, nodes):
+    _, branch, value, type_ = record
+    return hir.AnalogContribution(branch=nodes[branch], value=nodes[value], type_=type_)
+
+
+def read_module(record, nodes):
+    _, name, ports, nets, branches, parameters, variables, statements = record
+    return hir.Module(
+        name=name,
+        ports=[nodes[index] for index in ports],
+        nets=[nodes[index] for index in nets],
+        branches={(net1, net2): nodes[index] for net1, net2, index in branches},
+        parameters=[nodes[index] for index in parameters],
+        variables=[nodes[index] for index in variables],
+        statements=[nodes[index] for index in statements],
+    )
+
+
+def read_sourcefile(record, nodes):
+    return hir.SourceFile(modules=[nodes[index] for index in record[1]])
+
+
+# Reader of each kind of record
+readers = (
+    read_builtin,
+    read_literal,
+    read_call,
+    read_nature,
+    read_accessor,
+    read_discipline,
+    read_net,
+    read_port,
+    read_branch,
+    read_variable,
+    read_parameter,
+    read_assignment,
+    read_block,
+    read_if,
+    read_contribution,
+    read_module,
+    read_sourcefile,
+)
+
+
+def loads(data: bytes):
+    """HIR node serialized by dumps"""
+    data = memoryview(data)
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not serialized HIR")
+    (version,) = header.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"Serialized HIR version {version} is not {VERSION}")
+    records, fixups, root = marshal.loads(data[len(MAGIC) + header.size :])
+    nodes = []
+    append = nodes.append
+    for record in records:
+        append(readers[record[0]](record, nodes))
+    for index, access, idt_nature, ddt_nature in fixups:
+        nature = nodes[index]
+        nature.access = read_optional(nodes, access)
+        nature.idt_nature = read_optional(nodes, idt_nature)
+        nature.ddt_nature = read_optional(nodes, ddt_nature)
+    return nodes[root]
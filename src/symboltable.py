@@ -34,3 +34,46 @@ class SymbolTable:
 
     def __iter__(self) -> Iterable[Symbol]:
         return iter(self.symbols.values())
+
+
+class ScopedSymbolTable:
+    """
+    Symbols of nested scopes, resolved with a single lookup
+
+    Each name maps to the stack of symbols bound to it, innermost last.
+    Entering a scope pushes the bindings of its SymbolTable and exiting
+    pops them.
+    """
+
+    def __init__(self):
+        self.bindings: dict[str, list[Symbol]] = {}
+        self.scopes: list[SymbolTable] = []
+
+    def enter(self, symboltable: SymbolTable):
+        self.scopes.append(symboltable)
+        for symbol in symboltable:
+            self.bind(symbol)
+
+    def exit(self):
+        for symbol in self.scopes.pop():
+            stack = self.bindings[symbol.name]
+            stack.pop()
+            if not stack:
+                del self.bindings[symbol.name]
+
+    def define(self, symbol: Symbol):
+        """Define a symbol in the innermost scope"""
+        self.scopes[-1].define(symbol)
+        self.bind(symbol)
+
+    def bind(self, symbol: Symbol):
+        stack = self.bindings.get(symbol.name)
+        if stack is None:
+            self.bindings[symbol.name] = [symbol]
+        else:
+            stack.append(symbol)
+
+    def lookup(self, name: str) -> Optional[Symbol]:
+        """Innermost symbol with a name, if any"""
+        stack = self.bindings.get(name)
+        return None if stack is None else stack[-1]
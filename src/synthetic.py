@@ -0,0 +1,155 @@
+"""
+Generator of synthetic Verilog-A models of configurable size
+
+The models only use the supported subset of the language: the natures and
+disciplines of include/disciplines.vams, parameters, variables, nested
+conditionals, macros, math builtins and flow contributions. Expressions
+are built so that they evaluate to finite values.
+
+Run from the src directory to print a model:
+`python synthetic.py [--size bsimbulk] [--scale 0.5] [--seed 0]`
+"""
+from argparse import ArgumentParser
+from dataclasses import dataclass, replace
+from pathlib import Path
+import random
+
+INCLUDE_PATH = [Path(__file__).parent.parent / "include"]
+
+
+@dataclass
+class ModelSize:
+    parameters: int = 100
+    variables: int = 50
+    # Assignments and conditionals in the analog block
+    statements: int = 500
+    # Maximum depth of nested conditionals
+    nesting: int = 3
+    macros: int = 10
+    nets: int = 4
+
+    def scaled(self, factor: float) -> "ModelSize":
+        """Size with the number of parameters, variables, statements and macros scaled"""
+        return replace(
+            self,
+            parameters=max(1, round(self.parameters * factor)),
+            variables=max(1, round(self.variables * factor)),
+            statements=max(1, round(self.statements * factor)),
+            macros=max(1, round(self.macros * factor)),
+        )
+
+
+SIZES = {
+    "small": ModelSize(parameters=10, variables=5, statements=20, nesting=2, macros=3, nets=2),
+    "medium": ModelSize(),
+    # Roughly the number of parameters and statements of BSIMBULK
+    "bsimbulk": ModelSize(
+        parameters=1200, variables=800, statements=8000, nesting=5, macros=150, nets=5
+    ),
+}
+
+
+class ModelGenerator:
+    def __init__(self, size: ModelSize, seed: int = 0):
+        self.size = size
+        self.random = random.Random(seed)
+        self.parameters = [f"p{i}" for i in range(size.parameters)]
+        self.variables = [f"v{i}" for i in range(size.variables)]
+        self.nets = [f"n{i}" for i in range(size.nets)]
+        self.macros = [f"EXPR{i}" for i in range(size.macros)]
+        # Integer parameters which select between model branches
+        self.modes = [f"mode{i}" for i in range(max(1, size.parameters // 50))]
+        self.statements_left = size.statements
+
+    def operand(self):
+        """A variable, parameter or literal, bounded in magnitude"""
+        kind = self.random.random()
+        if kind < 0.5:
+            return self.random.choice(self.variables)
+        if kind < 0.85:
+            return self.random.choice(self.parameters)
+        return f"{self.random.uniform(0.1, 2.0):.3f}"
+
+    def expression(self, depth=2):
+        """An expression which stays bounded when its operands are"""
+        if depth == 0:
+            return self.operand()
+        a = self.expression(depth - 1)
+        b = self.expression(depth - 1)
+        return self.random.choice([
+            f"({a} * 0.5 + {b} * 0.25)",
+            f"(({a} - {b}) * 0.5)",
+            f"({a} / (1.0 + {b} * {b}))",
+            f"(sqrt({a} * {a} + 1.0) * 0.5)",
+            f"ln({a} * {a} + 1.0)",
+            f"limexp({a} * 0.01)",
+            f"`{self.random.choice(self.macros)}({a}, {b})",
+        ])
+
+    def condition(self):
+        if self.random.random() < 0.5:
+            return f"{self.random.choice(self.modes)} == {self.random.randrange(3)}"
+        return f"{self.random.choice(self.variables)} != {self.random.choice(self.parameters)}"
+
+    def statements(self, indent, depth):
+        """Generate lines of statements until the budget is spent or by chance"""
+        lines = []
+        while self.statements_left > 0:
+            self.statements_left -= 1
+            prefix = "    " * indent
+            if depth < self.size.nesting and self.random.random() < 0.15:
+                lines.append(f"{prefix}if ({self.condition()}) begin")
+                lines += self.statements(indent + 1, depth + 1)
+                if self.random.random() < 0.5:
+                    lines.append(f"{prefix}end else begin")
+                    lines += self.statements(indent + 1, depth + 1)
+                lines.append(f"{prefix}end")
+            else:
+                variable = self.random.choice(self.variables)
+                lines.append(f"{prefix}{variable} = {self.expression()};")
+            if depth > 0 and self.random.random() < 0.2:
+                break
+        return lines
+
+    def model(self, name):
+        lines = ['`include "disciplines.vams"', ""]
+        for macro in self.macros:
+            weight = self.random.uniform(0.1, 0.9)
+            lines.append(f"`define {macro}(a, b) ((a) * {weight:.3f} + (b) * 0.1)")
+        ports = ", ".join(self.nets)
+        lines += ["", f"module {name}({ports});", f"inout electrical {ports};"]
+        for parameter in self.parameters:
+            default = self.random.uniform(0.1, 2.0)
+            lines.append(f"parameter real {parameter} = {default:.4f} from [0:inf];")
+        for mode in self.modes:
+            lines.append(f"parameter integer {mode} = {self.random.randrange(3)};")
+        lines.append("real " + ", ".join(self.variables) + ";")
+        lines += ["", "analog begin"]
+        lines.append(f"    {self.variables[0]} = V({self.nets[0]});")
+        lines += self.statements(indent=1, depth=0)
+        for net1, net2 in zip(self.nets, self.nets[1:] + [None]):
+            branch = f"{net1}, {net2}" if net2 is not None else net1
+            value = " + ".join(self.random.sample(self.variables, min(3, len(self.variables))))
+            lines.append(f"    I({branch}) <+ ({value}) * 1e-3 * V({branch});")
+        lines += ["end", "endmodule", ""]
+        return "\n".join(lines)
+
+
+def generate_model(size: ModelSize | str = "medium", name="synthetic", seed: int = 0) -> str:
+    """Verilog-A source of a module of the given size, which includes disciplines.vams"""
+    if isinstance(size, str):
+        size = SIZES[size]
+    return ModelGenerator(size, seed).model(name)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--size", choices=SIZES, default="medium")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate_model(SIZES[args.size].scaled(args.scale), seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
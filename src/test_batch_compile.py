@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+import batch_compile
+from batch_compile import CompileJob, compile_batch, MANIFEST
+from parser_interface import parse_source
+
+INCLUDE_PATH = [str(Path(__file__).parent.parent / "include")]
+
+SOURCE = """
+`include "disciplines.vams"
+module resistor(a, b);
+inout electrical a, b;
+analog begin
+`ifdef DOUBLE
+    I(a, b) <+ 2 * V(a, b) / `R;
+`else
+    I(a, b) <+ V(a, b) / `R;
+`endif
+end
+endmodule
+"""
+
+
+def test_parse_source_defines():
+    source = "module mymod(); real x; analog x = `VALUE; endmodule"
+    module = parse_source(source, defines={"VALUE": "2.5"}).modules[0]
+    assert module.statements[0].value.value == 2.5
+
+
+def test_compile_batch(tmp_path):
+    source = tmp_path / "resistor.va"
+    source.write_text(SOURCE)
+    cache_dir = tmp_path / "cache"
+    jobs = [
+        CompileJob("single", str(source), {"R": "1e3"}, INCLUDE_PATH),
+        CompileJob("double", str(source), {"R": "1e3", "DOUBLE": ""}, INCLUDE_PATH),
+        CompileJob("broken", str(source), {}, INCLUDE_PATH),
+    ]
+    results = compile_batch(jobs, cache_dir, processes=2)
+    assert [result.name for result in results] == ["single", "double", "broken"]
+    single, double, broken = results
+    for result in [single, double]:
+        assert result.error is None
+        assert not result.cached
+        assert result.object_files == [f"{result.name}.resistor.o"]
+        assert (cache_dir / result.object_files[0]).stat().st_size > 0
+        assert set(result.timings) == {
+            "lex", "preprocess", "parse", "lower", "codegen", "format", "llvm parse", "llvm compile"
+        }
+        assert result.counters["files included"] == 1
+        assert any(Path(dep).name == "disciplines.vams" for dep in result.dependencies)
+    ir_text = (cache_dir / "single.resistor.ll").read_text()
+    assert (cache_dir / "double.resistor.ll").read_text() != ir_text
+    # `R is not defined
+    assert broken.error is not None
+    assert set(json.loads((cache_dir / MANIFEST).read_text())) == {"single", "double"}
+
+    # Nothing changed
+    results = compile_batch(jobs[:2], cache_dir)
+    assert [result.cached for result in results] == [True, True]
+    # Different definitions
+    jobs[1].defines["R"] = "2e3"
+    results = compile_batch(jobs[:2], cache_dir)
+    assert [result.cached for result in results] == [True, False]
+    # Source changed
+    source.write_text(SOURCE.replace("2 *", "3 *"))
+    results = compile_batch(jobs[:2], cache_dir)
+    assert [result.cached for result in results] == [False, False]
+
+
+def test_compile_batch_options(tmp_path, monkeypatch):
+    source = tmp_path / "resistor.va"
+    source.write_text(SOURCE)
+    cache_dir = tmp_path / "cache"
+    jobs = [CompileJob("single", str(source), {"R": "1e3"}, INCLUDE_PATH)]
+    assert not compile_batch(jobs, cache_dir, processes=1)[0].cached
+    assert compile_batch(jobs, cache_dir, processes=1)[0].cached
+    # Different codegen options
+    jobs[0].options["limexp_limit"] = 50.0
+    assert not compile_batch(jobs, cache_dir, processes=1)[0].cached
+    assert compile_batch(jobs, cache_dir, processes=1)[0].cached
+    # Different compiler
+    monkeypatch.setattr(batch_compile, "compiler_version", lambda: "other")
+    assert not compile_batch(jobs, cache_dir, processes=1)[0].cached
+    assert compile_batch(jobs, cache_dir, processes=1)[0].cached
@@ -1,5 +1,6 @@
 import pytest
 import math
+from codegen import CodegenContext
 from compile_expression import expression_to_pythonfunc
 import hir
 from vabuiltins import builtins
@@ -142,3 +143,53 @@ def test_compile_expression(expression, expected):
     actual = func()
     assert type(actual) == type(expected)
     assert actual == expected
+
+
+def call(name, *args):
+    return hir.FunctionCall(builtins[name], tuple(map(hir.Literal, args)))
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        (call("ln", 2.0), math.log(2.0)),
+        (call("log", 200.0), math.log10(200.0)),
+        (call("exp", 1.5), math.exp(1.5)),
+        (call("sqrt", 2.0), math.sqrt(2.0)),
+        (call("abs", -2.5), 2.5),
+        (call("floor", -2.5), -3.0),
+        (call("ceil", 2.5), 3.0),
+        (call("cos", 1.0), math.cos(1.0)),
+        (call("tan", 1.0), math.tan(1.0)),
+        (call("asin", 0.5), math.asin(0.5)),
+        (call("acos", 0.5), math.acos(0.5)),
+        (call("atan", 0.5), math.atan(0.5)),
+        (call("sinh", 0.5), math.sinh(0.5)),
+        (call("cosh", 0.5), math.cosh(0.5)),
+        (call("tanh", 0.5), math.tanh(0.5)),
+        (call("asinh", 0.5), math.asinh(0.5)),
+        (call("acosh", 1.5), math.acosh(1.5)),
+        (call("atanh", 0.5), math.atanh(0.5)),
+        (call("limexp", 1.5), math.exp(1.5)),
+        (call("limexp", 100.0), math.exp(80.0) * 21),
+        (call("min", 1.5, -2.5), -2.5),
+        (call("max", 1.5, -2.5), 1.5),
+        (call("atan2", 1.0, 2.0), math.atan2(1.0, 2.0)),
+        (call("hypot", 3.0, 4.0), 5.0),
+        (call("builtin.integer_abs", -3), 3),
+        (call("builtin.integer_abs", 3), 3),
+        (call("builtin.integer_min", 3, -4), -4),
+        (call("builtin.integer_max", 3, -4), 3),
+    ],
+)
+def test_compile_math_builtin(expression, expected):
+    actual = expression_to_pythonfunc(expression)()
+    assert type(actual) == type(expected)
+    assert actual == pytest.approx(expected, rel=1e-15)
+
+
+def test_literal_expressions_are_compiled():
+    # Only expressions of parameters compiled as constants are folded
+    expression = call("acosh", 1.5)
+    irmodule = CodegenContext.expression_to_llvm_module_ir(expression, "evaluate_expression")
+    assert 'call double @"acosh"(double' in str(irmodule)
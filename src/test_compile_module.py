@@ -9,6 +9,9 @@ import hir
 from parser_interface import parse_source
 from utils import DISCIPLINES
 from itertools import product
+import pickle
+import sys
+import pytest
 
 
 def test_from_hir_mocking_module_to_llvm_module_ir(monkeypatch):
@@ -24,7 +27,8 @@ def test_from_hir_mocking_module_to_llvm_module_ir(monkeypatch):
             codegen.irmodule, vatype_to_llvmtype(hirvar.type_), hirvar.name
         )
         compiledvar.initializer = ir.Constant(vatype_to_llvmtype(VAType.real), 0)
-        vars_[ii] = codegen.variables[hirvar] = compiledvar
+        codegen.declare(codegen.variables, hirvar, compiledvar)
+        vars_[ii] = compiledvar
     block = func.append_basic_block(name="entry")
     codegen.builder = ir.IRBuilder(block)
     real1 = codegen.builder.load(vars_[1])
@@ -240,7 +244,12 @@ def test_analogprobe():
     """
     )
     module = parse_source(source).modules[0]
-    compiled = CompiledModule.from_hir(module)
+    # Copies of the symbols, like those of strip_parsed, are the same symbols
+    for module in [module, module.strip_parsed()]:
+        check_analogprobe(CompiledModule.from_hir(module))
+
+
+def check_analogprobe(compiled):
     for _ in range(2):
         compiled.net_potential['net1'] = 3
         compiled.net_potential['net2'] = 7
@@ -253,6 +262,41 @@ def test_analogprobe():
         assert compiled.branch_potential["net1",None] == 6
 
 
+def test_probes_loaded_once():
+    source = (
+        DISCIPLINES
+        + """
+    module mymod(net1, net2);
+    inout electrical net1, net2;
+    real real1;
+
+    analog begin
+        I(net1, net2) <+ V(net1, net2);
+        if (real1)
+            I(net1, net2) <+ V(net1, net2) * V(net1, net2) + I(net1, net2);
+        real1 = V(net1, net2) + I(net1, net2);
+        I(net1) <+ V(net1);
+    end
+
+    endmodule
+    """
+    )
+    module = parse_source(source).modules[0]
+    llvm_ir = str(CodegenContext.module_to_llvm_module_ir(module).irmodule)
+    for net in ["net1", "net2"]:
+        assert llvm_ir.count(f'load double, double* @"__net_potential_{net}"') == 1
+    assert llvm_ir.count('load double, double* @"__branch_flow_net1__net2"') == 1
+    compiled = CompiledModule.from_hir(module)
+    compiled.net_potential["net1"] = 5
+    compiled.net_potential["net2"] = 2
+    compiled.branch_flow["net1", "net2"] = 0.5
+    compiled.vars["real1"] = 1
+    compiled.run_analog()
+    assert compiled.net_flow["net1"] == 3 + 9 + 0.5 + 5
+    assert compiled.net_flow["net2"] == -3 - 9 - 0.5
+    assert compiled.vars["real1"] == 3.5
+
+
 def test_resistor():
     source = (
         DISCIPLINES
@@ -281,5 +325,307 @@ def test_resistor():
         assert compiled.net_flow['net2'] == -(v1 - v2) / r
 
 
+def test_unpickled_module():
+    source = DISCIPLINES + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = 2;
+real x;
+analog begin
+    x = max(V(net1, net2), 0.0) + 1;
+    I(net1, net2) <+ x / R;
+end
+endmodule
+"""
+    module = pickle.loads(pickle.dumps(parse_source(source).modules[0]))
+    compiled = CompiledModule.from_hir(module)
+    compiled.net_potential["net1"] = 3.0
+    compiled.run_analog()
+    assert compiled.net_flow["net1"] == 2.0
+
+
+def test_common_subexpression_elimination():
+    source = (
+        DISCIPLINES
+        + """
+    module mymod();
+    real real1, real2, real3;
+
+    analog begin
+        real2 = pow(real1, 2) + pow(real1, 2);
+        if (real2)
+            real3 = pow(real1, 2);
+        real1 = real1 + 1;
+        real3 = real3 + pow(real1, 2);
+    end
+    endmodule
+    """
+    )
+    module = parse_source(source).modules[0]
+    codegen = CodegenContext.module_to_llvm_module_ir(module)
+    # Reused before the assignment to real1, recomputed after it
+    assert str(codegen.irmodule).count("call double @\"llvm.pow.f64\"") == 2
+    compiled = CompiledModule.from_hir(module)
+    compiled.vars["real1"] = 3
+    compiled.vars["real3"] = 0
+    compiled.run_analog()
+    assert compiled.vars["real2"] == 18
+    assert compiled.vars["real3"] == 9 + 16
+
+
+def test_values_known_across_branches():
+    source = (
+        DISCIPLINES
+        + """
+    module mymod();
+    real real1, real2, real3;
+    integer int1, int2;
+
+    analog begin
+        real2 = pow(real1, 2);
+        if (int1 != 0) begin
+            int2 = 8 / int1;
+            real3 = pow(real1, 2) + real2;
+        end
+        real3 = real3 + pow(real1, 2) + int2;
+    end
+    endmodule
+    """
+    )
+    module = parse_source(source).modules[0]
+    codegen = CodegenContext.module_to_llvm_module_ir(module)
+    # Computed before the branch, reused in it and after the merge
+    assert str(codegen.irmodule).count("call double @\"llvm.pow.f64\"") == 1
+    compiled = CompiledModule.from_hir(module)
+    compiled.vars["real1"] = 3
+    compiled.vars["int1"] = 2
+    compiled.run_analog()
+    assert compiled.vars["real3"] == 9 + 9 + 9 + 4
+
+
+def test_branch_restores_only_arm_values(monkeypatch):
+    """Going back after an `if` costs as much as its arms, not all known values"""
+    undone = []
+    restore_values = CodegenContext.restore_values
+
+    def counting_restore_values(self, mark):
+        undone.append(len(self.journal) - mark)
+        restore_values(self, mark)
+
+    monkeypatch.setattr(CodegenContext, "restore_values", counting_restore_values)
+    counts = {}
+    for n in [10, 1000]:
+        sums = "".join(f"real2 = real2 + pow(real1, {i + 2});\n" for i in range(n))
+        source = DISCIPLINES + f"""
+    module mymod();
+    real real1, real2, real3;
+    integer int1;
+
+    analog begin
+        {sums}
+        if (int1 != 0) real3 = real1 * 2; else real3 = real1 * 3;
+    end
+    endmodule
+    """
+        module = parse_source(source).modules[0]
+        undone.clear()
+        CodegenContext.module_to_llvm_module_ir(module, if_conversion=False)
+        counts[n] = list(undone)
+    # One restore after each arm, the same whatever is known before the `if`
+    assert len(counts[10]) == 2
+    assert counts[10] == counts[1000]
+
+
+def test_from_hir_dump(capsys):
+    module = hir.Module(name="mymod")
+    CompiledModule.from_hir(module)
+    assert capsys.readouterr().out == ""
+    CompiledModule.from_hir(module, dump=True)
+    assert "define void @\"run_analog\"()" in capsys.readouterr().out
+
+
+def test_if_conversion():
+    source = (
+        DISCIPLINES
+        + """
+    module mymod();
+    real real1, real2, real3;
+    integer int1, int2;
+
+    analog begin
+        if (real1 == 2.5) real2 = 1; else begin real2 = 2; real3 = real2 + 1; end
+        if (int1) real1 = real1 * 2;
+        if (int1 != 0) int2 = 8 / int1;
+    end
+    endmodule
+    """
+    )
+    module = parse_source(source).modules[0]
+    llvm_ir = str(CodegenContext.module_to_llvm_module_ir(module).irmodule)
+    assert llvm_ir.count("select") == 3
+    assert "zext" not in llvm_ir
+    # Integer division could trap, so it is still guarded by a branch
+    assert llvm_ir.count("br i1") == 1
+    compiled = CompiledModule.from_hir(module)
+    for real1, int1 in product([2.5, 3], [0, 1, 2]):
+        compiled.vars["real1"] = real1
+        compiled.vars["real3"] = 0
+        compiled.vars["int1"] = int1
+        compiled.vars["int2"] = -1
+        compiled.run_analog()
+        assert compiled.vars["real2"] == (1 if real1 == 2.5 else 2)
+        assert compiled.vars["real3"] == (0 if real1 == 2.5 else 3)
+        assert compiled.vars["real1"] == (real1 * 2 if int1 else real1)
+        assert compiled.vars["int2"] == {0: -1, 1: 8, 2: 4}[int1]
+
+
+def test_if_conversion_of_probes():
+    source = (
+        DISCIPLINES
+        + """
+    module mymod(a, b);
+    inout electrical a, b;
+    real vmax, x;
+    integer clip;
+
+    analog begin
+        if (clip) x = min(V(a, b), vmax); else x = V(a, b);
+        I(a, b) <+ x + I(a, b);
+    end
+    endmodule
+    """
+    )
+    module = parse_source(source).modules[0]
+    llvm_ir = str(CodegenContext.module_to_llvm_module_ir(module).irmodule)
+    assert llvm_ir.count("select") == 1
+    assert "br i1" not in llvm_ir
+    compiled = CompiledModule.from_hir(module)
+    compiled.vars["vmax"] = 1.5
+    compiled.branch_flow["a", "b"] = 0.25
+    for va, clip in product([3, 2], [0, 1]):
+        compiled.net_potential["a"] = va
+        compiled.net_potential["b"] = 1
+        compiled.vars["clip"] = clip
+        compiled.run_analog()
+        x = min(va - 1, 1.5) if clip else va - 1
+        assert compiled.vars["x"] == x
+        assert compiled.net_flow["a"] == x + 0.25
+
+
 def test_compile_bsimbulk():
     module = parse_source(filename="../inputfiles/dump/bsimbulk_without_functions.va", include_path=["../include"]).modules[0]
+
+
+def deep_expressions_source(n):
+    horner = "".join(f"{k + 1} + x * (" for k in range(n - 1)) + f"{n}" + ")" * (n - 1)
+    flat = " + ".join(f"{k + 1} * x" for k in range(n))
+    return (
+        DISCIPLINES
+        + f"""
+    module poly();
+    real x, y, z;
+
+    analog begin
+        y = {horner};
+        if (x)
+            z = {flat};
+    end
+
+    endmodule
+    """
+    )
+
+
+def test_deep_expressions():
+    """Expressions much deeper than the recursion limit are lowered and compiled"""
+    n = 10 * sys.getrecursionlimit()
+    sourcefile = parse_source(deep_expressions_source(n))
+    module = sourcefile.modules[0]
+    horner = module.statements[0].statements[0].value
+    # Additions, products and conversions of the integers
+    assert repr(horner).count("FunctionCall(") == 3 * n - 2
+    stripped = sourcefile.strip_parsed().modules[0]
+    assert hir.fingerprint(stripped) == hir.fingerprint(module)
+    # Without the parse tree, which is as deep as the expressions
+    assert pickle.loads(pickle.dumps(stripped)) == stripped
+    codegen = CodegenContext.module_to_llvm_module_ir(module)
+    assert str(codegen.irmodule).count("fmul double") == 2 * n - 1
+    # The LLVM backend takes a time quadratic in the size of the blocks, the
+    # code is run for smaller expressions
+    n = sys.getrecursionlimit() + 500
+    compiled = CompiledModule.from_hir(parse_source(deep_expressions_source(n)).modules[0])
+    compiled.vars["x"] = 0.5
+    compiled.run_analog()
+    assert compiled.vars["y"] == pytest.approx(sum((k + 1) * 0.5**k for k in range(n)))
+    assert compiled.vars["z"] == 0.5 * n * (n + 1) / 2
+
+
+def test_inputs_and_outputs():
+    source = DISCIPLINES + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = 1.0;
+parameter real scale = 2.0;
+parameter real G = 1 / scale;
+parameter integer n = 3;
+real v, i, total, gain;
+analog begin
+    v = V(net1, net2);
+    i = G * n * v;
+    total = total + i;
+    I(net1, net2) <+ i * gain / R + total;
+end
+endmodule
+"""
+    module = parse_source(source).modules[0]
+    options = dict(observable_variables=["i"], input_variables=["gain"], input_parameters=["R"])
+    codegen = CodegenContext.module_to_llvm_module_ir(module, **options)
+    # total is kept from one run to the next, v is local
+    assert {variable.name for variable in codegen.irmodule.global_values} >= {"i", "gain", "total", "R"}
+    assert "v" not in {variable.name for variable in codegen.irmodule.global_values}
+    ir_text = str(codegen.irmodule)
+    assert 'alloca double' in ir_text
+    # G * n is folded to a constant
+    assert f"fmul double {ir.Constant(ir.DoubleType(), 1.5).get_reference()}, " in ir_text
+    assert '@"G"' not in ir_text and '@"n"' not in ir_text and '@"scale"' not in ir_text
+    compiled = {
+        name: CompiledModule.from_hir(module, **options)
+        for name, options in [("all", {}), ("selected", options)]
+    }
+    assert set(compiled["selected"].vars.pointers) == {"i", "gain"}
+    assert set(compiled["selected"].parameters.pointers) == {"R"}
+    for name, module in compiled.items():
+        module.net_potential["net1"] = 3.0
+        module.net_potential["net2"] = 1.0
+        module.vars["gain"] = 2.0
+        module.parameters["R"] = 2.0
+        module.run_analog()
+        assert module.vars["i"] == 3.0
+        assert module.net_flow["net1"] == 6.0
+        module.run_analog()
+        assert module.net_flow["net1"] == 9.0
+
+
+def test_parameters_depending_on_inputs():
+    source = DISCIPLINES + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = 2.0;
+parameter real G = 1 / R;
+parameter real k = 3.0;
+analog I(net1, net2) <+ k * G * V(net1, net2);
+endmodule
+"""
+    module = parse_source(source).modules[0]
+    compiled = CompiledModule.from_hir(module, input_parameters=["R"])
+    # G is computed from R, so it is not a constant but an input with its
+    # default, which is not computed again when R is set
+    assert set(compiled.parameters.pointers) == {"R", "G"}
+    assert compiled.parameters["G"] == 0.5
+    compiled.net_potential["net1"] = 1.0
+    compiled.parameters["R"] = 4.0
+    compiled.run_analog()
+    assert compiled.net_flow["net1"] == 1.5
+    compiled.parameters["G"] = 0.25
+    compiled.run_analog()
+    assert compiled.net_flow["net1"] == 0.75
@@ -0,0 +1,107 @@
+import io
+import json
+import threading
+import time
+from pathlib import Path
+import preprocessor
+from compile_client import request
+from compile_server import CompileServer, serve_stream, serve_socket
+from profiling import Profile
+from parser_interface import parse_source
+
+INCLUDE_PATH = [str(Path(__file__).parent.parent / "include")]
+
+SOURCE = """
+`include "disciplines.vams"
+module resistor(a, b);
+inout electrical a, b;
+parameter real R = {R};
+real i;
+analog begin
+    i = V(a, b) / R;
+    I(a, b) <+ i;
+end
+endmodule
+"""
+
+
+def compile_request(R=1.0):
+    return {"command": "compile", "content": SOURCE.format(R=R), "include_path": INCLUDE_PATH}
+
+
+def test_compile_and_evaluate():
+    server = CompileServer()
+    response = server.handle(compile_request(R=2.0))
+    assert response["ok"], response
+    assert response["modules"] == ["resistor"]
+    response = server.handle(
+        {"command": "evaluate", "module": "resistor", "net_potential": {"a": 3.0, "b": 1.0}}
+    )
+    assert response == {
+        "ok": True,
+        "variables": {"i": 1.0},
+        "parameters": {"R": 2.0},
+        "net_flow": {"a": 1.0, "b": -1.0},
+    }
+    # Only the default changed, the compiled code is reused
+    compiled = server.modules["resistor"]
+    assert server.handle(compile_request(R=4.0))["ok"]
+    assert server.modules["resistor"] is compiled
+    response = server.handle({"command": "evaluate", "module": "resistor"})
+    assert response["variables"] == {"i": 0.5}
+
+
+def test_errors():
+    server = CompileServer()
+    assert server.handle({"command": "unknown"}) == {
+        "ok": False, "error": "Unknown command 'unknown'"
+    }
+    response = server.handle({"command": "evaluate", "module": "missing"})
+    assert not response["ok"]
+    assert "KeyError" in response["error"]
+    response = server.handle({"command": "compile", "content": "module"})
+    assert not response["ok"]
+
+
+def test_serve_stream():
+    requests = [compile_request(), {"command": "ping"}, {"command": "shutdown"}, {"command": "ping"}]
+    input = io.StringIO("".join(json.dumps(r) + "\n" for r in requests) + "\n")
+    output = io.StringIO()
+    server = CompileServer()
+    serve_stream(server, input, output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    # Requests after the shutdown are not answered
+    assert [response["ok"] for response in responses] == [True, True, True]
+
+
+def test_serve_socket(tmp_path):
+    path = tmp_path / "server.sock"
+    thread = threading.Thread(target=serve_socket, args=(CompileServer(), path))
+    thread.start()
+    while not path.exists():
+        time.sleep(0.01)
+    filename = tmp_path / "resistor.va"
+    filename.write_text(SOURCE.format(R=1.0))
+    response = request(path, "compile", filename=str(filename), include_path=INCLUDE_PATH)
+    assert response["ok"], response
+    response = request(path, "evaluate", module="resistor", net_potential={"a": 2.0, "b": 0.0})
+    assert response["net_flow"] == {"a": 2.0, "b": -2.0}
+    assert request(path, "shutdown") == {"ok": True}
+    thread.join()
+    assert not path.exists()
+
+
+def test_included_files_lexed_once(tmp_path):
+    included = tmp_path / "constants.vams"
+    included.write_text("`define ONE 1\n")
+    source = '`include "constants.vams"\nmodule m(); real x; analog x = `ONE; endmodule\n'
+    for hits in [0, 1]:
+        with Profile() as profile:
+            parse_source(source, include_path=[tmp_path])
+        assert profile.counters.get("include cache hits", 0) == hits
+    # Changed files are lexed again
+    included.write_text("`define ONE 2\n")
+    with Profile() as profile:
+        parse_source(source, include_path=[tmp_path])
+    assert "include cache hits" not in profile.counters
+    assert 2 in [token.value for token in preprocessor.lexed_files[included][1]]
@@ -22,3 +22,17 @@ def test_customdict():
     assert d[key] == 4
     assert Dummy(2) not in d
     assert list(d.values()) == [4]
+    assert d.get(key) == 4
+    assert d.get(Dummy(2)) is None
+    assert d.get(Dummy(2), 7) == 7
+
+
+def test_customdict_initial_items():
+    a, b = Dummy(1), Dummy(1)
+    d = CustomDict(key=id, items=[(a, 1), (b, 2)])
+    assert d[a] == 1
+    assert d[b] == 2
+    assert list(d.keys()) == [a, b]
+    d = CustomDict(key=lambda x: x % 2, items={1: "odd", 2: "even", 3: "odd again"})
+    assert d[5] == "odd again"
+    assert len(d) == 2
@@ -0,0 +1,52 @@
+import pytest
+from dispatch import dispatchmethod
+
+
+class Base:
+    pass
+
+
+class Derived(Base):
+    pass
+
+
+class Visitor:
+    @dispatchmethod
+    def visit(self, node):
+        raise NotImplementedError(type(node))
+
+    @visit.register
+    def _(self, node: Base):
+        return "base"
+
+    @visit.register(int)
+    def _(self, node):
+        return node + 1
+
+
+def test_dispatch():
+    visitor = Visitor()
+    assert visitor.visit(Base()) == "base"
+    # Unregistered subclasses use the handler of their closest base
+    assert visitor.visit(Derived()) == "base"
+    assert visitor.visit(2) == 3
+    with pytest.raises(NotImplementedError):
+        visitor.visit("string")
+    assert Visitor.visit.__name__ == "visit"
+
+
+def test_register_after_use():
+    class Extensible:
+        @dispatchmethod
+        def visit(self, node):
+            return "default"
+
+    visitor = Extensible()
+    assert visitor.visit(Derived()) == "default"
+
+    @Extensible.visit.register
+    def _(self, node: Base):
+        return "base"
+
+    assert visitor.visit(Derived()) == "base"
+    assert visitor.visit(1) == "default"
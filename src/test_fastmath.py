@@ -0,0 +1,137 @@
+import ctypes
+import itertools
+import math
+import pytest
+from llvmlite import ir
+import fastmath
+from compiler import compile_ir, get_engine
+
+kernel_names = (f"fastmath_kernel{i}" for i in itertools.count())
+
+
+def evaluate(function, *columns, width=1):
+    """
+    Apply a fastmath function to the columns of arguments, in chunks of
+    <width x double> values, or doubles for width 1
+    """
+    double = ir.DoubleType()
+    type_ = ir.VectorType(double, width) if width > 1 else double
+    arity = len(columns)
+    name = next(kernel_names)
+    irmodule = ir.Module(name=__file__)
+    functype = ir.FunctionType(ir.VoidType(), [type_.as_pointer()] * (arity + 1))
+    func = ir.Function(irmodule, functype, name=name)
+    builder = ir.IRBuilder(func.append_basic_block(name="entry"))
+    args = [builder.load(arg, align=8) for arg in func.args[:arity]]
+    builder.store(function(builder, *args), func.args[arity], align=8)
+    builder.ret_void()
+    compile_ir(str(irmodule))
+    pointer = ctypes.POINTER(ctypes.c_double)
+    cfunc = ctypes.CFUNCTYPE(None, *[pointer] * (arity + 1))(get_engine().get_function_address(name))
+    results = []
+    for start in range(0, len(columns[0]), width):
+        arrays = [(ctypes.c_double * width)(*column[start : start + width]) for column in columns]
+        result = (ctypes.c_double * width)()
+        cfunc(*arrays, result)
+        results += list(result)
+    return results
+
+
+def libm_exp(x):
+    """C exp, which overflows to inf where math.exp raises"""
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return math.inf
+
+
+def libm_pow(x, y):
+    """C pow, which returns inf or NaN where math.pow raises"""
+    try:
+        return math.pow(x, y)
+    except OverflowError:
+        return math.inf
+    except ValueError:
+        if x == 0:
+            # Signed for odd negative y
+            return math.copysign(math.inf, x) if y % 2 == 1 else math.inf
+        return math.nan
+
+
+def libm_log(x):
+    if x == 0:
+        return -math.inf
+    if x < 0:
+        return math.nan
+    return math.log(x)
+
+
+def check(results, expected, rel):
+    for result, value in zip(results, expected):
+        if math.isnan(value):
+            assert math.isnan(result)
+        elif math.isinf(value) or value == 0:
+            assert result == value and math.copysign(1, result) == math.copysign(1, value)
+        else:
+            assert result == pytest.approx(value, rel=rel)
+
+
+EXP_ARGUMENTS = [-700.0, -20.5, -1.0, -1e-10, 0.0, 0.3, 1.0, 2.5, 42.0, 700.0, 709.5]
+EXP_SPECIAL = [1000.0, -1000.0, math.inf, -math.inf, math.nan, 709.8, -745.2, 7e10]
+LN_ARGUMENTS = [1e-300, 1e-5, 0.5, 0.70710678, 1.0, 1.5, 2.0, 1e10, 1e300, 1e-310, 5e-324]
+LN_SPECIAL = [0.0, -0.0, -1.0, -1e-300, math.inf, -math.inf, math.nan]
+POW_ARGUMENTS = [
+    (2.0, 0.5),
+    (2.0, 10.0),
+    (0.1, -3.3),
+    (-2.0, 3.0),
+    (-2.0, 2.0),
+    (0.0, 2.5),
+    (1e3, 1.3),
+    (2.0, -1074.0),
+]
+POW_SPECIAL = [
+    (0.0, -1.0),
+    (-0.0, -1.0),
+    (0.0, -2.0),
+    (-0.0, 3.0),
+    (0.0, 0.0),
+    (-2.0, 0.5),
+    (math.nan, 0.0),
+    (1.0, math.nan),
+    (-1.0, math.inf),
+    (2.0, math.inf),
+    (0.5, math.inf),
+    (2.0, -math.inf),
+    (math.inf, -1.0),
+    (-math.inf, 3.0),
+    (10.0, 400.0),
+    (math.nan, 1.0),
+]
+
+
+@pytest.mark.parametrize("width", [1, 4])
+def test_exp(width):
+    arguments = EXP_ARGUMENTS + EXP_SPECIAL
+    results = evaluate(fastmath.exp, arguments, width=width)
+    check(results, list(map(libm_exp, arguments)), rel=1e-15)
+
+
+@pytest.mark.parametrize("width", [1, 4])
+def test_ln(width):
+    arguments = LN_ARGUMENTS + LN_SPECIAL
+    results = evaluate(fastmath.ln, arguments, width=width)
+    check(results, list(map(libm_log, arguments)), rel=1e-15)
+
+
+@pytest.mark.parametrize("width", [1, 4])
+def test_pow(width):
+    arguments = POW_ARGUMENTS + POW_SPECIAL
+    results = evaluate(fastmath.pow, *zip(*arguments), width=width)
+    check(results, [libm_pow(x, y) for x, y in arguments], rel=1e-14)
+
+
+def test_exp_underflows_through_subnormals():
+    (result,) = evaluate(fastmath.exp, [-740.0])
+    assert 0 < result < 2.0**-1022
+    assert result == pytest.approx(math.exp(-740.0), abs=2.0**-1074)
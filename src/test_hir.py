@@ -0,0 +1,103 @@
+import math
+import pickle
+import pytest
+from dataclasses import FrozenInstanceError
+import hir
+from vabuiltins import builtins
+from verilogatypes import VAType
+
+
+real1 = hir.Variable(name="real1", type_=VAType.real, initializer=None)
+
+
+def test_literal_interning():
+    assert hir.Literal(3) is hir.Literal(3)
+    assert hir.Literal(3.0) is hir.Literal(3.0)
+    assert hir.Literal(3) is not hir.Literal(3.0)
+    assert hir.Literal(3) != hir.Literal(3.0)
+    # Shared by all the source files, interned nodes have no parse tree
+    assert not hasattr(hir.Literal(3), "parsed")
+    assert hir.Literal(-0.0) is not hir.Literal(0.0)
+    assert math.copysign(1.0, hir.Literal(-0.0).value) == -1.0
+    assert hir.Literal(math.nan) is hir.Literal(math.nan)
+
+
+def test_functioncall_interning():
+    def square(x):
+        return hir.FunctionCall(builtins.real_product, (x, x))
+
+    expr1 = hir.FunctionCall(builtins.real_addition, (square(real1), hir.Literal(1.0)))
+    expr2 = hir.FunctionCall(builtins.real_addition, [square(real1), hir.Literal(1.0)])
+    assert expr1 is expr2
+    assert expr1.arguments[0] is square(real1)
+    assert hash(expr1) == hash(expr2)
+    assert {expr1: 1}[expr2] == 1
+
+
+def test_functioncall_interning_uses_symbol_identity():
+    other = hir.Variable(name="real1", type_=VAType.real, initializer=None)
+    expr1 = hir.FunctionCall(builtins.sin, (real1,))
+    expr2 = hir.FunctionCall(builtins.sin, (other,))
+    # Different symbols are not merged, but still compare equal by value
+    assert expr1 is not expr2
+    assert expr1 == expr2
+    assert hash(expr1) == hash(expr2)
+
+
+def test_expressions_are_immutable():
+    expr = hir.FunctionCall(builtins.sin, (hir.Literal(1.0),))
+    with pytest.raises(FrozenInstanceError):
+        expr.arguments = ()
+
+
+def test_pickle_preserves_interning():
+    expr = hir.FunctionCall(builtins.pow, (hir.Literal(2.0), hir.Literal(3.0)))
+    copy = pickle.loads(pickle.dumps(expr))
+    assert copy == expr
+    assert copy.arguments[0] is hir.Literal(2.0)
+
+
+def test_fingerprint_ignores_parse_trees_and_ids():
+    other = hir.Variable(name="real1", type_=VAType.real, initializer=None, parsed="x")
+    assert other.uid != real1.uid
+    assert hir.fingerprint(other) == hir.fingerprint(real1)
+    expr1 = hir.FunctionCall(builtins.sin, (real1,))
+    expr2 = hir.FunctionCall(builtins.sin, (other,))
+    assert hir.fingerprint(expr1) == hir.fingerprint(expr2)
+    assert hir.fingerprint(expr1) != hir.fingerprint(hir.FunctionCall(builtins.cos, (real1,)))
+    integer = hir.Variable(name="real1", type_=VAType.integer, initializer=None)
+    assert hir.fingerprint(expr1) != hir.fingerprint(hir.FunctionCall(builtins.sin, (integer,)))
+    assert hir.fingerprint(hir.Literal(1)) != hir.fingerprint(hir.Literal(1.0))
+    assert hir.fingerprint(hir.Literal(1)) != hir.fingerprint(hir.Literal("1"))
+
+
+def test_fingerprint_is_cached_in_expressions():
+    expr = hir.FunctionCall(builtins.real_addition, (real1, hir.Literal(2.0)))
+    for _ in range(100000):
+        expr = hir.FunctionCall(builtins.real_product, (expr, real1))
+    # Computed from the innermost expression, without recursion
+    result = hir.fingerprint(expr)
+    assert expr._fingerprint == result
+    assert expr.arguments[0]._fingerprint == hir.fingerprint(expr.arguments[0])
+    assert hir.fingerprint(hir.Assignment(real1, expr)) == hir.fingerprint(
+        hir.Assignment(real1, expr, parsed="assignment")
+    )
+
+
+def test_pickled_builtins_are_the_builtins():
+    expr = hir.FunctionCall(builtins.real_addition, (real1, hir.Literal(2.0)))
+    copy = pickle.loads(pickle.dumps(expr))
+    assert copy.function is builtins.real_addition
+    other = hir.Function(name="other", type_=builtins.sin.type_)
+    assert pickle.loads(pickle.dumps(other)) == other
+
+
+def test_nature_equality(monkeypatch):
+    charge = hir.Nature(name="Charge", units="coul")
+    current = hir.Nature(name="Current", units="A", idt_nature=charge)
+    charge.ddt_nature = current
+    assert charge == hir.Nature(name="Charge", units="coul", ddt_nature=current)
+    assert charge != current
+    # The same nature is equal without fingerprinting it
+    monkeypatch.setattr(hir, "fingerprint", None)
+    assert charge == charge
@@ -0,0 +1,107 @@
+import math
+from compile_module import CompiledModule
+from constant_evaluation import evaluate_parameters
+from incremental import IncrementalCompiler, structure_hash
+from parser_interface import parse_source
+from utils import DISCIPLINES
+
+TEMPLATE = (
+    DISCIPLINES
+    + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = {R};
+parameter real scale = 2 * R + 1;
+parameter integer n = {n};
+real out;
+
+analog begin
+    out = scale + n;
+    I(net1, net2) <+ V(net1, net2) / R;
+end
+
+endmodule
+"""
+)
+
+
+def module(R="1.5", n="2"):
+    return parse_source(TEMPLATE.format(R=R, n=n)).modules[0]
+
+
+def test_defaults_loaded():
+    compiled = CompiledModule.from_hir(module(n="2.6"))
+    assert compiled.parameters["R"] == 1.5
+    assert compiled.parameters["scale"] == 4.0
+    assert compiled.parameters["n"] == 2
+    compiled.run_analog()
+    assert compiled.vars["out"] == 6.0
+
+
+def test_evaluate_parameters():
+    source = DISCIPLINES + """
+    module mymod();
+    parameter real a = sqrt(16.0) - 1;
+    parameter integer b = 7 / 2;
+    parameter integer c = -7 / 2;
+    parameter real d = max(a, 5.0) * exp(0.0);
+    endmodule
+    """
+    parameters = parse_source(source).modules[0].parameters
+    values = {p.name: value for p, value in evaluate_parameters(parameters).items()}
+    assert values == {"a": 3.0, "b": 3, "c": -3, "d": 5.0}
+    assert type(values["b"]) is int
+
+
+def test_structure_hash_ignores_defaults():
+    assert structure_hash(module()) == structure_hash(module(R="3.0", n="5"))
+    changed = parse_source(TEMPLATE.replace("scale + n", "scale - n").format(R=1.5, n=2))
+    assert structure_hash(module()) != structure_hash(changed.modules[0])
+
+
+def test_reuse_when_defaults_change():
+    compiler = IncrementalCompiler()
+    first = compiler.compile(module())
+    second = compiler.compile(module(R="0.5", n="7"))
+    assert second is first
+    assert second.parameters["R"] == 0.5
+    assert second.parameters["scale"] == 2.0
+    second.net_potential["net1"] = 3.0
+    second.net_potential["net2"] = 1.0
+    second.run_analog()
+    assert second.vars["out"] == 9.0
+    assert math.isclose(second.net_flow["net1"], 4.0)
+
+
+def test_recompile_when_structure_changes():
+    compiler = IncrementalCompiler()
+    first = compiler.compile(module())
+    changed = parse_source(TEMPLATE.replace("scale + n", "scale - n").format(R=1.5, n=2))
+    second = compiler.compile(changed.modules[0])
+    assert second is not first
+    second.run_analog()
+    assert second.vars["out"] == 2.0
+    first.run_analog()
+    assert first.vars["out"] == 6.0
+
+
+def test_structure_hash_ignores_layout():
+    relaid = TEMPLATE.replace("out = scale + n;", "out =\n    scale\n    + n;  // same")
+    assert structure_hash(module()) == structure_hash(
+        parse_source(relaid.format(R=1.5, n=2)).modules[0]
+    )
+    assert structure_hash(module()) == structure_hash(module().strip_parsed())
+
+
+def test_recompile_when_constant_parameters_change():
+    compiler = IncrementalCompiler(input_parameters=["R"])
+    first = compiler.compile(module())
+    # scale depends on R, which makes it an input too
+    assert set(first.parameters.pointers) == {"R", "scale"}
+    assert compiler.compile(module(R="0.5")) is first
+    assert first.parameters["scale"] == 2.0
+    # n is a constant
+    second = compiler.compile(module(n="5"))
+    assert second is not first
+    second.run_analog()
+    assert second.vars["out"] == 9.0
@@ -1,4 +1,7 @@
 from typing import List
+import os
+import subprocess
+import sys
 import pytest
 from testcases import testcases
 from lexer import lex, MyToken
@@ -55,3 +58,14 @@ def test_lexer(source: str, expected_tokens: List[MyToken]):
     source = source.replace("\n", " ")
     result = [replace(tok, origin=[]) for tok in lex(content=source)]
     assert result == expected_tokens
+
+
+def test_import_from_other_directory(tmp_path):
+    """The lexer tables are found from any directory, and parsing does not load llvmlite"""
+    script = (
+        "import sys; import parser_interface; "
+        "parser_interface.parse_source('module m(); endmodule'); "
+        "assert 'llvmlite' not in sys.modules"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, check=True)
@@ -0,0 +1,78 @@
+import pytest
+from compile_module import CompiledModule
+from liveness import eliminate_dead_code
+from parser_interface import parse_source
+from utils import DISCIPLINES
+
+SOURCE = DISCIPLINES + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = 2.0;
+real current, debug, unused, state, overwritten;
+integer mode;
+analog begin
+    overwritten = 5.0;
+    debug = V(net1, net2) * 1000.0;
+    overwritten = V(net1, net2) / R;
+    current = overwritten + state;
+    state = current;
+    if (mode)
+        debug = debug + 1.0;
+    else
+        unused = 2.0;
+    I(net1, net2) <+ current;
+end
+endmodule
+"""
+
+
+def names(variables):
+    return [variable.name for variable in variables]
+
+
+def test_all_variables_observable():
+    module = parse_source(SOURCE).modules[0]
+    assert eliminate_dead_code(module).variables == module.variables
+    statements = eliminate_dead_code(module).statements[0].statements
+    # The first assignment is overwritten before being read
+    assert statements == module.statements[0].statements[1:]
+
+
+def test_dead_code_eliminated():
+    module = parse_source(SOURCE).modules[0]
+    eliminated = eliminate_dead_code(module, observable=())
+    # state is read by the next run
+    assert names(eliminated.variables) == ["current", "state", "overwritten"]
+    assignments = [statement.lvalue.name for statement in eliminated.statements[0].statements[:-1]]
+    assert assignments == ["overwritten", "current", "state"]
+    # The module is not modified
+    assert len(module.statements[0].statements) == 7
+    eliminated = eliminate_dead_code(module, observable=["debug", "other"])
+    assert names(eliminated.variables) == ["current", "debug", "state", "overwritten", "mode"]
+    if_ = eliminated.statements[0].statements[-2]
+    assert if_.then.lvalue.name == "debug"
+    assert if_.else_ is None
+
+
+def test_compiled_outputs():
+    compiled = {
+        observable: CompiledModule.from_hir(
+            parse_source(SOURCE).modules[0], observable_variables=observable
+        )
+        for observable in [None, ("state",)]
+    }
+    assert set(compiled[("state",)].vars.pointers) == {"state"}
+    for module in compiled.values():
+        module.net_potential["net1"] = 3.0
+        module.net_potential["net2"] = 1.0
+        module.run_analog()
+        module.run_analog()
+        assert module.net_flow["net1"] == pytest.approx(2.0)
+        assert module.vars["state"] == pytest.approx(2.0)
+    assert compiled[None].vars["debug"] == pytest.approx(2000.0)
+
+
+def test_elimination_disabled():
+    module = parse_source(SOURCE).modules[0]
+    compiled = CompiledModule.from_hir(module, dead_code_elimination=False)
+    assert set(compiled.vars.pointers) == {variable.name for variable in module.variables}
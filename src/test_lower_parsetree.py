@@ -9,7 +9,11 @@ from preprocessor import VerilogAPreprocessor
 from vabuiltins import builtins
 from symboltable import SymbolTable
 from functools import singledispatch
+from dataclasses import fields, replace
+import weakref
+from customdict import CustomDict
 from utils import DISCIPLINES
+import serialize_hir
 
 
 
@@ -148,6 +152,22 @@ syms = {
                 ),
             ),
         ),
+        ("abs(int1)", hir.FunctionCall(builtins.integer_abs, (syms["int1"],))),
+        ("abs(real1)", hir.FunctionCall(builtins.abs, (syms["real1"],))),
+        (
+            "max(int1, int2)",
+            hir.FunctionCall(builtins.integer_max, (syms["int1"], syms["int2"])),
+        ),
+        (
+            "min(int1, 2.5)",
+            hir.FunctionCall(
+                builtins.min,
+                (
+                    hir.FunctionCall(builtins.cast_int_to_real, (syms["int1"],)),
+                    hir.Literal(2.5),
+                ),
+            ),
+        ),
         ("V(net1)", hir.FunctionCall(builtins.potential, (hir.Branch(name='', net1=syms['net1'], net2=None),))),
         ("V(net1, net2)", hir.FunctionCall(builtins.potential, (hir.Branch(name='', net1=syms['net1'], net2=syms['net2']),))),
         ("I(net1)", hir.FunctionCall(builtins.flow, (hir.Branch(name='', net1=syms['net1'], net2=None),))),
@@ -165,6 +185,7 @@ def test_lower_parsetree_expression(source: str, expected: hir.HIR):
     ]
     actual = LowerParseTree(context).lower(parsetree).strip_parsed()
     assert actual == expected
+    assert serialize_hir.loads(serialize_hir.dumps(actual)) == expected
 
 
 def test_lower_parsetree_disciplines():
@@ -184,13 +205,16 @@ endmodule
     contexts = [(hir.SourceFile(), SymbolTable(builtins.symbols.values()))]
     lowerer = LowerParseTree(contexts=contexts)
     sourcefile = lowerer.lower(parsetree).strip_parsed()
-    discipline = sourcefile.modules[0].nets[0].discipline
-    assert discipline.name == "electrical"
-    assert discipline.potential.name == "Voltage"
-    assert discipline.potential.abstol == 1e-6
-    assert discipline.flow.name == "Current"
-    assert discipline.flow.abstol == 1e-12
-    assert discipline.flow.idt_nature.name == "Charge"
+    for sourcefile in [sourcefile, serialize_hir.loads(serialize_hir.dumps(sourcefile))]:
+        discipline = sourcefile.modules[0].nets[0].discipline
+        assert discipline.name == "electrical"
+        assert discipline.potential.name == "Voltage"
+        assert discipline.potential.abstol == 1e-6
+        assert discipline.flow.name == "Current"
+        assert discipline.flow.abstol == 1e-12
+        assert discipline.flow.idt_nature.name == "Charge"
+        assert discipline.flow.idt_nature.ddt_nature == discipline.flow
+        assert discipline.flow.access.nature == discipline.flow
 
 
 @pytest.mark.parametrize(
@@ -330,6 +354,9 @@ endmodule
         branches=module.branches,
     )
     assert module == expected_module
+    loaded = serialize_hir.loads(serialize_hir.dumps(sourcefile)).modules[0]
+    assert loaded == replace(expected_module, branches=loaded.branches)
+    assert loaded.branches == module.branches
 
 
 def test_lower_parsetree_branches():
@@ -360,3 +387,118 @@ endmodule
     assert branch.name == 'branch13'
     assert branch.net1.name == 'net1'
     assert branch.net2.name == 'net3'
+    assert serialize_hir.loads(serialize_hir.dumps(module)).branches == module.branches
+
+
+def test_release_parse_tree():
+    source = DISCIPLINES + """
+module first(net1);
+inout electrical net1;
+real x;
+analog begin
+    x = 2 * V(net1);
+end
+endmodule
+module second(net1);
+inout electrical net1;
+analog I(net1) <+ 1;
+endmodule
+"""
+    tokens = list(VerilogAPreprocessor(lex(content=source)))
+    contexts = [(None, SymbolTable(builtins.symbols.values()))]
+    kept = LowerParseTree(contexts=contexts).lower(Parser(tokens).sourcefile())
+    locations = CustomDict(key=id)
+    lowerer = LowerParseTree(contexts=contexts, locations=locations)
+    released = lowerer.lower_toplevel(Parser(tokens).toplevel())
+    assert released.locations is locations
+    assert released.parsed is None
+    assert [module.parsed for module in released.modules] == [None, None]
+    assert released.modules == kept.strip_parsed().modules
+    # Locations are the origin of the first token of each node
+    line = source[: source.index("    x = 2")].count("\n") + 1
+    assignment = released.modules[0].statements[0].statements[0]
+    assert released.origin(assignment) == [(None, line, 5)]
+    assert kept.origin(kept.modules[0].statements[0].statements[0]) == [(None, line, 5)]
+    line = source[: source.index("module second")].count("\n") + 1
+    assert released.origin(released.modules[1]) == [(None, line, 8)]
+
+
+def test_expression_origins_are_per_source_file():
+    first = """
+module first;
+real x;
+analog x = sin(7.25);
+endmodule
+"""
+    second = """
+module second;
+real y;
+analog begin
+    y = 1;
+    y = y + sin(7.25);
+end
+endmodule
+"""
+    contexts = [(None, SymbolTable(builtins.symbols.values()))]
+    tokens = list(VerilogAPreprocessor(lex(content=first)))
+    kept = LowerParseTree(contexts=contexts).lower(Parser(tokens).sourcefile())
+    tokens = list(VerilogAPreprocessor(lex(content=second)))
+    lowerer = LowerParseTree(contexts=contexts, locations=CustomDict(key=id))
+    released = lowerer.lower_toplevel(Parser(tokens).toplevel())
+    assignment = kept.modules[0].statements[0]
+    cast, addition = released.modules[0].statements[0].statements
+    # The calls are shared, their occurrences are located in each file
+    assert addition.value.arguments[1] is assignment.value
+    assert kept.origin(assignment, "value") == [(None, 4, 12)]
+    assert kept.origin(assignment, "value", 0) == [(None, 4, 16)]
+    assert released.origin(addition, "value") == [(None, 6, 11)]
+    assert released.origin(addition, "value", 0) == [(None, 6, 9)]
+    assert released.origin(addition, "value", 1) == [(None, 6, 13)]
+    assert released.origin(addition, "value", 1, 0) == [(None, 6, 17)]
+    assert released.origin(addition, "value", 2) is None
+    # Converted to real
+    assert released.origin(cast, "value") == [(None, 5, 9)]
+    assert released.origin(cast, "value", 0) == [(None, 5, 9)]
+    assert released.origin(assignment, "value") is None
+
+
+class TracedModule(pt.Module):
+    """Module parse tree which can be referred to weakly"""
+
+
+def test_release_parse_tree_frees_items():
+    source = DISCIPLINES + """
+module first(a);
+inout electrical a;
+real x;
+analog begin
+    x = sin(2.5) * V(a);
+    I(a) <+ x + sin(2.5);
+end
+endmodule
+module second(a);
+inout electrical a;
+analog I(a) <+ sin(2.5);
+endmodule
+"""
+    tokens = list(VerilogAPreprocessor(lex(content=source)))
+    contexts = [(None, SymbolTable(builtins.symbols.values()))]
+    # The same expressions lowered with their parse tree kept
+    kept = LowerParseTree(contexts=contexts).lower(Parser(tokens).sourcefile())
+    released_items = []
+
+    def items():
+        for item in Parser(tokens).toplevel():
+            if isinstance(item, pt.Module):
+                # The previous module is no longer referenced
+                assert all(reference() is None for reference in released_items)
+                item = TracedModule(**{f.name: getattr(item, f.name) for f in fields(item)})
+                released_items.append(weakref.ref(item))
+            yield item
+            item = None
+
+    lowerer = LowerParseTree(contexts=contexts, locations=CustomDict(key=id))
+    released = lowerer.lower_toplevel(items())
+    assert len(released_items) == 2
+    assert all(reference() is None for reference in released_items)
+    assert released.modules == kept.strip_parsed().modules
@@ -1,4 +1,5 @@
 from typing import List, Callable, Optional
+import sys
 import pytest
 from manual_parser import PeekIterator, Parser
 from mytoken import MyToken
@@ -54,3 +55,30 @@ def test_parser(
     assert len(unconsumed_tokens) >= len(guard), "Too much input consumed"
     assert len(unconsumed_tokens) <= len(guard), "Not all input consumed"
     assert result == expected
+
+
+def test_nodes_are_slotted():
+    """Parse trees of large models have many nodes, which must not carry a __dict__"""
+    source = "module m(); real x; analog x = 1 + f(2); endmodule"
+    tokens = list(VerilogAPreprocessor(lex(content=source)))
+    tree = Parser(tokens).sourcefile()
+    assert not hasattr(tree, "__dict__")
+    assert not hasattr(tree.modules[0].statements[0], "__dict__")
+    assert not hasattr(tokens[0], "__dict__")
+
+
+def test_deep_expression():
+    """Expressions much deeper than the recursion limit are parsed"""
+    depth = 10 * sys.getrecursionlimit()
+    source = "x = " + "f(1, -(2 + " * depth + "3" + "))" * depth + ";"
+    tokens = list(VerilogAPreprocessor(lex(content=source)))
+    expression = Parser(tokens).assignment_or_analogcontribution().value
+    for _ in range(depth):
+        assert isinstance(expression, pt.FunctionCall)
+        literal, negation = expression.args
+        assert literal.value.value == 1
+        assert negation.operator.value == "-"
+        sum_, = negation.operands
+        assert sum_.operands[0].value.value == 2
+        expression = sum_.operands[1]
+    assert expression.value.value == 3
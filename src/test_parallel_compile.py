@@ -0,0 +1,95 @@
+import gc
+from pathlib import Path
+import pytest
+from compile_module import CompiledModule
+from compiler import initialize_llvm, jit_compile
+from parallel_compile import compile_source
+from parser_interface import parse_source
+from profiling import Profile
+
+INCLUDE_PATH = [str(Path(__file__).parent.parent / "include")]
+
+SOURCE = """
+`include "disciplines.vams"
+module resistor(a, b);
+inout electrical a, b;
+parameter real R = 2;
+analog I(a, b) <+ V(a, b) / R;
+endmodule
+
+module diode(a, c);
+inout electrical a, c;
+parameter real Is = 1e-14;
+parameter real Vt = 0.025;
+real id;
+analog begin
+    id = Is * (limexp(V(a, c) / Vt) - 1);
+    I(a, c) <+ id;
+end
+endmodule
+
+module tangent(a);
+inout electrical a;
+parameter integer n = 3;
+analog I(a) <+ n * tan(V(a));
+endmodule
+"""
+
+
+def evaluate(compiled: CompiledModule, potentials):
+    for net, value in potentials.items():
+        compiled.net_potential[net] = value
+    compiled.run_analog()
+    return {net: compiled.net_flow[net] for net in compiled.net_flow.pointers}
+
+
+@pytest.mark.parametrize("processes,threads", [(1, 1), (2, 3)])
+def test_compile_source(processes, threads):
+    with Profile() as profile:
+        modules = compile_source(
+            SOURCE, include_path=INCLUDE_PATH, processes=processes, threads=threads
+        )
+    assert list(modules) == ["resistor", "diode", "tangent"]
+    assert modules["resistor"].parameters["R"] == 2
+    assert modules["tangent"].parameters["n"] == 3
+    # The stages of the processes and threads are profiled
+    assert profile.calls["lower"] == 3
+    assert profile.calls["llvm compile"] == 3
+    hir = parse_source(SOURCE, include_path=INCLUDE_PATH)
+    potentials = {"a": 0.6, "b": 0.1, "c": 0.0}
+    for module in hir.modules:
+        sequential = CompiledModule.from_hir(module)
+        nets = {net.name: potentials[net.name] for net in module.nets}
+        assert evaluate(modules[module.name], nets) == evaluate(sequential, nets)
+    # Each module has its own globals
+    modules["resistor"].parameters["R"] = 4
+    assert evaluate(modules["resistor"], {"a": 1.0, "b": 0.0}) == {"a": 0.25, "b": -0.25}
+
+
+def test_errors_are_raised():
+    source = SOURCE + "module broken(a); inout electrical a; analog I(a) <+ missing; endmodule\n"
+    with pytest.raises(KeyError, match="Undefined identifier"):
+        compile_source(source, include_path=INCLUDE_PATH, processes=2)
+
+
+def test_engines_collected_in_cycles():
+    modules = compile_source(SOURCE, include_path=INCLUDE_PATH, processes=1, threads=1)
+    # The engines, modules and contexts are disposed of in the right order
+    cycle = [modules]
+    cycle.append(cycle)
+    del modules, cycle
+    gc.collect()
+
+
+def test_failed_compilation_closes_context():
+    initialize_llvm()
+    with pytest.raises(RuntimeError):
+        jit_compile("invalid IR")
+    # Fails verification, after the module is parsed
+    with pytest.raises(RuntimeError):
+        jit_compile("define i32 @f() {\nentry:\n  ret void\n}\n")
+    engine = jit_compile("define i32 @f() {\nentry:\n  ret i32 1\n}\n")
+    assert engine.get_function_address("f")
+    engine.close()
+    engine.close()
+    gc.collect()
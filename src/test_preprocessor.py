@@ -1,6 +1,7 @@
 import pytest
 import dataclasses
 
+import preprocessor
 from preprocessor import VerilogAPreprocessor, lex, MyToken
 
 
@@ -263,3 +264,32 @@ def test_include_search_path(tmp_path):
     expected = [strip_token_origin(t) for t in VerilogAPreprocessor(lex(content=expected_src))]
     assert tokens == expected
     # TODO: test absolute paths
+
+
+def test_include_from_content(tmp_path):
+    child = tmp_path / "child.va"
+    child.write_text("`define CHILD_MACRO(x) 3*x\n")
+    src = """
+    `include "child.va"
+    `CHILD_MACRO(2)
+    """
+    tokens = [
+        strip_token_origin(t)
+        for t in VerilogAPreprocessor(lex(content=src), include_path=[tmp_path])
+    ]
+    expected = [strip_token_origin(t) for t in VerilogAPreprocessor(lex(content="3*2"))]
+    assert tokens == expected
+
+
+def test_lexed_files_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocessor, "lexed_files", preprocessor.OrderedDict())
+    monkeypatch.setattr(preprocessor, "max_lexed_files", 2)
+    files = [tmp_path / f"file{i}.va" for i in range(3)]
+    for i, file in enumerate(files):
+        file.write_text(f"`define X{i} {i}\n")
+    preprocessor.lex_file(files[0])
+    preprocessor.lex_file(files[1])
+    # A cache hit makes file0 the most recently used
+    preprocessor.lex_file(files[0])
+    preprocessor.lex_file(files[2])
+    assert list(preprocessor.lexed_files) == [files[0], files[2]]
@@ -0,0 +1,95 @@
+import json
+import sys
+import time
+from pathlib import Path
+import profiling
+from profiling import Profile, stage, count, count_nodes
+from compile_module import CompiledModule
+from parser_interface import parse_source, main
+
+INCLUDE_PATH = [Path(__file__).parent.parent / "include"]
+
+SOURCE = """
+`include "disciplines.vams"
+`define HALF(x) x / 2
+module resistor(a, b);
+inout electrical a, b;
+analog I(a, b) <+ `HALF(V(a, b));
+endmodule
+"""
+
+
+def test_stages_exclude_nested_stages():
+    with Profile() as profile:
+        with stage("outer"):
+            time.sleep(0.01)
+            with stage("inner"):
+                time.sleep(0.02)
+            with stage("inner"):
+                pass
+        count("things", 3)
+        count("things")
+    assert profiling.active is None
+    assert 0.01 <= profile.times["outer"] < profile.times["inner"]
+    assert profile.times["inner"] >= 0.02
+    assert profile.calls == {"outer": 1, "inner": 2}
+    assert profile.counters == {"things": 4}
+
+
+def test_inactive_profile():
+    with stage("stage"):
+        count("things")
+    assert profiling.active is None
+
+
+def test_merge():
+    other = Profile(times={"lower": 1.5}, calls={"lower": 1}, counters={"things": 2})
+    profiling.merge(other)
+    with Profile() as profile:
+        count("things")
+        profiling.merge(other)
+        profiling.merge(other)
+    assert profile.times == {"lower": 3.0}
+    assert profile.calls == {"lower": 2}
+    assert profile.counters == {"things": 5}
+
+
+def test_count_nodes():
+    shared = Profile()
+    assert count_nodes([shared, (shared, Profile())]) == 2
+
+
+def test_profile_pipeline(tmp_path):
+    filename = tmp_path / "resistor.va"
+    filename.write_text(SOURCE)
+    with Profile() as profile:
+        module = parse_source(filename=str(filename), include_path=INCLUDE_PATH).modules[0]
+        CompiledModule.from_hir(module)
+    assert set(profile.times) == {
+        "lex", "preprocess", "parse", "lower", "codegen", "format", "llvm parse", "llvm compile"
+    }
+    # The main file and the included one
+    assert profile.calls["lex"] == 2
+    counters = profile.counters
+    assert counters["files included"] == 1
+    assert counters["macros expanded"] == 1
+    for name in ["tokens lexed", "parse tree nodes", "HIR nodes", "IR instructions"]:
+        assert counters[name] > 0
+
+
+def test_profile_cli(tmp_path, monkeypatch, capsys):
+    filename = tmp_path / "resistor.va"
+    filename.write_text(SOURCE)
+    json_filename = tmp_path / "profile.json"
+    argv = [
+        "parser_interface.py", str(filename), "-I", str(INCLUDE_PATH[0]),
+        "--compile", "--profile", "--profile-json", str(json_filename),
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    main()
+    out = capsys.readouterr().out
+    assert "llvm compile" in out
+    assert "tokens lexed" in out
+    profile = json.loads(json_filename.read_text())
+    assert set(profile) == {"times", "calls", "counters"}
+    assert profile["counters"]["files included"] == 1
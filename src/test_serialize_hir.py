@@ -0,0 +1,88 @@
+import math
+import sys
+import pytest
+import hir
+import serialize_hir
+from compile_module import CompiledModule
+from parser_interface import parse_source
+from utils import DISCIPLINES
+from vabuiltins import builtins
+from verilogatypes import VAType
+
+SOURCE = DISCIPLINES + """
+module mymod(net1, net2);
+inout electrical net1, net2;
+parameter real R = 2.0;
+parameter real scale = 2 * R;
+real x, y;
+integer n = 3;
+analog begin
+    x = V(net1, net2) / R;
+    y = exp(x) + x;
+    if (n)
+        I(net1, net2) <+ y * scale;
+    else
+        I(net1, net2) <+ 0.0;
+end
+endmodule
+"""
+
+
+def test_roundtrip():
+    sourcefile = parse_source(SOURCE)
+    loaded = serialize_hir.loads(serialize_hir.dumps(sourcefile))
+    assert loaded.modules == sourcefile.strip_parsed().modules
+    assert hir.fingerprint(loaded) == hir.fingerprint(sourcefile)
+    module = loaded.modules[0]
+    # Shared nodes are loaded once, symbols with new uids
+    assert module.nets[0].discipline is module.nets[1].discipline
+    assert module.statements[0].statements[1].value.arguments[1] is module.variables[0]
+    assert module.variables[0].uid != sourcefile.modules[0].variables[0].uid
+    # Builtins are those of this process
+    assert module.statements[0].statements[1].value.function is builtins.real_addition
+
+
+def test_loaded_module_compiles():
+    module = parse_source(SOURCE).modules[0]
+    results = []
+    for module in [module, serialize_hir.loads(serialize_hir.dumps(module))]:
+        compiled = CompiledModule.from_hir(module)
+        compiled.net_potential["net1"] = 2.0
+        compiled.net_potential["net2"] = 1.0
+        compiled.vars["n"] = 1
+        compiled.run_analog()
+        results.append((compiled.vars["x"], compiled.vars["y"], compiled.net_flow["net1"]))
+    assert results[0][2] != 0.0
+    assert results[1] == results[0]
+
+
+def test_deep_expression():
+    x = hir.Variable(name="x", type_=VAType.real, initializer=None)
+    expression = x
+    for _ in range(sys.getrecursionlimit() * 2):
+        expression = hir.FunctionCall(builtins.real_addition, (expression, hir.Literal(1.0)))
+    loaded = serialize_hir.loads(serialize_hir.dumps(expression))
+    assert hir.fingerprint(loaded) == hir.fingerprint(expression)
+
+
+def test_version_is_checked():
+    data = serialize_hir.dumps(hir.Literal(1.5))
+    assert serialize_hir.loads(data) is hir.Literal(1.5)
+    with pytest.raises(ValueError, match="version"):
+        serialize_hir.loads(data.replace(b"VAHIR\x01", b"VAHIR\x02"))
+    with pytest.raises(ValueError, match="Not serialized HIR"):
+        serialize_hir.loads(data[1:])
+
+
+def test_natures_refer_to_each_other():
+    net = serialize_hir.loads(serialize_hir.dumps(parse_source(SOURCE))).modules[0].nets[0]
+    current = net.discipline.flow
+    assert current.idt_nature.ddt_nature is current
+    assert current.access.nature is current
+
+
+def test_negative_zero():
+    expression = hir.FunctionCall(builtins.real_product, (hir.Literal(-0.0), hir.Literal(0.0)))
+    loaded = serialize_hir.loads(serialize_hir.dumps(expression))
+    assert loaded is expression
+    assert math.copysign(1.0, loaded.arguments[0].value) == -1.0
@@ -0,0 +1,29 @@
+import pytest
+import hir
+from symboltable import SymbolTable, ScopedSymbolTable
+from verilogatypes import VAType
+
+
+def variable(name):
+    return hir.Variable(name=name, type_=VAType.real, initializer=None)
+
+
+def test_scoped_symbol_table():
+    outer_x, inner_x, y = variable("x"), variable("x"), variable("y")
+    symbols = ScopedSymbolTable()
+    symbols.enter(SymbolTable([outer_x]))
+    assert symbols.lookup("x") is outer_x
+    assert symbols.lookup("y") is None
+    symbols.enter(SymbolTable())
+    symbols.define(inner_x)
+    symbols.define(y)
+    # Inner symbols shadow outer ones
+    assert symbols.lookup("x") is inner_x
+    assert symbols.lookup("y") is y
+    with pytest.raises(AssertionError):
+        symbols.define(variable("y"))
+    symbols.exit()
+    assert symbols.lookup("x") is outer_x
+    assert symbols.lookup("y") is None
+    symbols.exit()
+    assert symbols.bindings == {}
@@ -0,0 +1,43 @@
+import math
+import hir
+from verilogatypes import VAType
+from compile_module import CompiledModule
+from parser_interface import parse_source
+from synthetic import generate_model, ModelSize, SIZES, INCLUDE_PATH
+
+
+def count_statements(statement):
+    if isinstance(statement, hir.Block):
+        return sum(map(count_statements, statement.statements))
+    if isinstance(statement, hir.If):
+        arms = [arm for arm in (statement.then, statement.else_) if arm is not None]
+        return 1 + sum(map(count_statements, arms))
+    return 1
+
+
+def test_generated_model_compiles():
+    size = ModelSize(parameters=30, variables=10, statements=100, nesting=3, macros=5, nets=3)
+    source = generate_model(size, name="mymodel", seed=1)
+    module = parse_source(source, include_path=INCLUDE_PATH).modules[0]
+    assert module.name == "mymodel"
+    assert [net.name for net in module.nets] == ["n0", "n1", "n2"]
+    assert len([p for p in module.parameters if p.type_ == VAType.real]) == 30
+    assert len(module.variables) == 10
+    # The initial assignment, the statements and the contributions
+    assert sum(map(count_statements, module.statements)) == 1 + 100 + 3
+    compiled = CompiledModule.from_hir(module)
+    compiled.net_potential["n0"] = 0.7
+    compiled.net_potential["n1"] = 0.2
+    compiled.run_analog()
+    assert all(math.isfinite(compiled.vars[f"v{i}"]) for i in range(10))
+    assert compiled.net_flow["n0"] != 0
+
+
+def test_deterministic():
+    assert generate_model("small", seed=3) == generate_model("small", seed=3)
+    assert generate_model("small", seed=3) != generate_model("small", seed=4)
+
+
+def test_scaled():
+    size = SIZES["bsimbulk"].scaled(0.1)
+    assert (size.parameters, size.statements, size.nesting) == (120, 800, 5)
@@ -12,6 +12,9 @@ binary_real_type = FunctionSignature(
     returntype=VAType.real, parameters=(VAType.real, VAType.real)
 )
 unary_real_type = FunctionSignature(returntype=VAType.real, parameters=(VAType.real,))
+unary_int_type = FunctionSignature(
+    returntype=VAType.integer, parameters=(VAType.integer,)
+)
 
 builtins_list = [
     replace(symbol, name="builtin." + symbol.name)
@@ -54,12 +57,43 @@ builtins_list = [
         ),
         Function(name="integer_equality", type_=binary_int_type),
         Function(name="integer_inequality", type_=binary_int_type),
+        # Integer versions of polymorphic math functions
+        Function(name="integer_abs", type_=unary_int_type),
+        Function(name="integer_min", type_=binary_int_type),
+        Function(name="integer_max", type_=binary_int_type),
     ]
 ]
 builtins_list.extend(
     [
-        Function(name="sin", type_=unary_real_type),
-        Function(name="pow", type_=binary_real_type),
+        *(
+            Function(name=name, type_=unary_real_type)
+            for name in [
+                "ln",
+                "log",
+                "exp",
+                "sqrt",
+                "abs",
+                "floor",
+                "ceil",
+                "sin",
+                "cos",
+                "tan",
+                "asin",
+                "acos",
+                "atan",
+                "sinh",
+                "cosh",
+                "tanh",
+                "asinh",
+                "acosh",
+                "atanh",
+                "limexp",
+            ]
+        ),
+        *(
+            Function(name=name, type_=binary_real_type)
+            for name in ["pow", "min", "max", "atan2", "hypot"]
+        ),
         Variable(name="$temperature", type_=VAType.real, initializer=Literal(25)),
         Function(name="potential", type_=accessor),
         Function(name="flow", type_=accessor),